@@ -0,0 +1,254 @@
+import argparse
+import gc
+import hashlib
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+import sync_logic
+try: import resource
+except ImportError: resource = None  # Windows: пиковый RSS не измеряется
+
+# --- Константы ---
+# Формы синтетических деревьев: число файлов, диапазон размеров и глубина вложенности при scale=1.
+TREE_SHAPES = {
+    'tiny': {'files': 5000, 'min_size': 0, 'max_size': 4096, 'depth': 2, 'files_per_dir': 100},
+    'huge': {'files': 3, 'min_size': 64 * 1024 * 1024, 'max_size': 96 * 1024 * 1024, 'depth': 1, 'files_per_dir': 3},
+    'deep': {'files': 2000, 'min_size': 512, 'max_size': 64 * 1024, 'depth': 24, 'files_per_dir': 4},
+}
+# Метрики, для которых рост — ухудшение, и метрики, для которых ухудшение — падение.
+LOWER_IS_BETTER = ('wall_seconds', 'peak_rss_mb')
+HIGHER_IS_BETTER = ('files_per_sec', 'mb_per_sec')
+WRITE_CHUNK_SIZE = 4 * 1024 * 1024
+
+# --- Синтетические деревья ---
+def _write_random(path, size, rng):
+    with open(path, 'wb') as f:
+        while size > 0:
+            chunk = min(size, WRITE_CHUNK_SIZE); f.write(rng.randbytes(chunk)); size -= chunk
+
+def generate_tree(root, shape='tiny', scale=1.0, seed=1):
+    """Строит воспроизводимое дерево заданной формы; одинаковые shape/scale/seed дают одинаковое содержимое."""
+    params = TREE_SHAPES[shape]; rng = random.Random(seed)
+    files = max(1, int(params['files'] * scale))
+    total_bytes = 0
+    for i in range(files):
+        dir_no = i // params['files_per_dir']
+        if params['depth'] > 2:
+            # Глубокое дерево: каждая следующая папка вложена в предыдущую.
+            parts = [f"level{level:02d}" for level in range(dir_no % params['depth'] + 1)]
+        else:
+            parts = [f"dir{dir_no % 10}", f"sub{dir_no}"][:params['depth']]
+        directory = Path(root, *parts); directory.mkdir(parents=True, exist_ok=True)
+        size = rng.randint(params['min_size'], params['max_size'])
+        _write_random(directory / f"file_{i:06d}.dat", size, rng); total_bytes += size
+    return files, total_bytes
+
+def apply_churn(root, percent, seed=2):
+    """Меняет percent% файлов дерева: половину переписывает, четверть удаляет, четверть переименовывает,
+    и добавляет новые файлы в количестве четверти от измененных. Возвращает счетчики изменений."""
+    rng = random.Random(seed)
+    files = sorted(str(p) for p in Path(root).rglob('*') if p.is_file())
+    changed = rng.sample(files, max(1, int(len(files) * percent / 100))) if files and percent else []
+    counts = {'modified': 0, 'deleted': 0, 'renamed': 0, 'added': 0}
+    for i, path in enumerate(changed):
+        kind = ('modified', 'modified', 'deleted', 'renamed')[i % 4]
+        if kind == 'modified':
+            size = os.path.getsize(path)
+            _write_random(path, max(1, size), rng)
+            stat = os.stat(path); os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 2_000_000_000))
+        elif kind == 'deleted': os.remove(path)
+        else: os.rename(path, path + '.renamed')
+        counts[kind] += 1
+    for i in range(len(changed) // 4):
+        _write_random(Path(root) / f"churn_new_{i:06d}.dat", rng.randint(1, 64 * 1024), rng); counts['added'] += 1
+    return counts
+
+def tree_size(root):
+    files = [p for p in Path(root).rglob('*') if p.is_file()]
+    return len(files), sum(p.stat().st_size for p in files)
+
+# --- Замер одной комбинации ---
+def peak_rss_mb():
+    if not resource: return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдает килобайты, macOS — байты.
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def measure_pass(source, dest, options, label):
+    files, total_bytes = tree_size(source)
+    start = time.perf_counter()
+    stats = sync_logic.sync_folders(source, dest, False, True, comparison_mode=options['mode'], use_parallel=options['parallel'], use_staging=options['staging'])
+    wall = time.perf_counter() - start
+    return {
+        'pass': label, 'files': files, 'bytes': total_bytes, 'wall_seconds': round(wall, 3),
+        'files_per_sec': round(files / wall, 1) if wall else None,
+        'mb_per_sec': round(total_bytes / (1024 * 1024) / wall, 2) if wall else None,
+        'phases': stats.pop('timings', {}), 'stats': stats,
+    }
+
+def run_one(workdir, shape, scale, churn, options):
+    """Одна комбинация настроек: полная синхронизация в пустое назначение, затем повторная после churn."""
+    source, dest = Path(workdir, 'source'), Path(workdir, 'dest')
+    generate_tree(source, shape, scale); dest.mkdir()
+    results = [measure_pass(source, dest, options, 'initial')]
+    if churn:
+        churn_counts = apply_churn(source, churn)
+        result = measure_pass(source, dest, options, 'churn'); result['churn'] = churn_counts
+        results.append(result)
+    rss = peak_rss_mb()
+    for result in results: result.update(options, shape=shape, scale=scale, peak_rss_mb=rss)
+    return results
+
+def run_suite(shapes, scale, churn, modes, parallel_values, staging_values, workdir=None, repeat=1):
+    """Запускает каждую комбинацию в отдельном процессе, чтобы пиковый RSS относился только к ней.
+    При repeat > 1 для каждого прохода берется самый быстрый из повторов — это снижает шум."""
+    results = []
+    base = Path(workdir or tempfile.mkdtemp(prefix='sync_bench_'))
+    for shape, mode, parallel, staging in itertools.product(shapes, modes, parallel_values, staging_values):
+        run_dir = base / f"{shape}_{mode}_{'par' if parallel else 'seq'}_{'staging' if staging else 'direct'}"
+        if run_dir.exists(): shutil.rmtree(run_dir)
+        run_dir.mkdir(parents=True)
+        options = {'mode': mode, 'parallel': parallel, 'staging': staging}
+        print(f"Замер: {shape}, {mode}, parallel={parallel}, staging={staging}...", file=sys.stderr)
+        best = {}
+        for _ in range(max(1, repeat)):
+            command = [sys.executable, os.path.abspath(__file__), 'run-one', str(run_dir), shape, str(scale), str(churn), json.dumps(options)]
+            completed = subprocess.run(command, capture_output=True, text=True, encoding='utf-8')
+            if completed.returncode != 0: raise RuntimeError(f"Замер {run_dir.name} завершился с ошибкой:\n{completed.stderr}")
+            for result in json.loads(completed.stdout):
+                if result['pass'] not in best or result['wall_seconds'] < best[result['pass']]['wall_seconds']: best[result['pass']] = result
+            shutil.rmtree(run_dir, ignore_errors=True); run_dir.mkdir()
+        results.extend(best.values())
+        shutil.rmtree(run_dir, ignore_errors=True)
+    if not workdir: shutil.rmtree(base, ignore_errors=True)
+    return {
+        'meta': {'date': datetime.now().isoformat(timespec='seconds'), 'python': platform.python_version(), 'platform': platform.platform(),
+                 'cpu_count': os.cpu_count(), 'scale': scale, 'churn_percent': churn, 'repeat': repeat},
+        'results': results,
+    }
+
+# --- Сравнение результатов ---
+def result_key(result):
+    return (result['shape'], result['mode'], result['parallel'], result['staging'], result['pass'])
+
+def compare_results(baseline, current, threshold):
+    """Возвращает список (ключ, метрика, было, стало, изменение %) для ухудшений больше threshold%."""
+    baseline_by_key = {result_key(r): r for r in baseline['results']}
+    regressions = []
+    for result in current['results']:
+        old = baseline_by_key.get(result_key(result))
+        if not old: continue
+        for metric in LOWER_IS_BETTER + HIGHER_IS_BETTER:
+            before, after = old.get(metric), result.get(metric)
+            if not before or after is None: continue
+            change = (after - before) / before * 100
+            worse = change if metric in LOWER_IS_BETTER else -change
+            if worse > threshold: regressions.append((result_key(result), metric, before, after, round(change, 1)))
+    return regressions
+
+# --- Память карты файлов ---
+def synthetic_entries(count, files_per_dir=50, depth=3):
+    """Генерирует (относительный путь, размер, mtime, хеш) без обращения к диску."""
+    for i in range(count):
+        dir_no = i // files_per_dir
+        parts = [f"dir{(dir_no // (10 ** level)) % 10}" for level in range(depth - 1, 0, -1)] + [f"sub{dir_no}"]
+        yield os.sep.join(parts + [f"file_{i:08d}.dat"]), 1000 + i, 1700000000.0 + i, hashlib.sha256(i.to_bytes(8, 'little')).digest()
+
+def measure(build):
+    gc.collect(); tracemalloc.start()
+    result = build()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return current
+
+def build_legacy(count, accurate):
+    """Прежний формат: словари files_to_process с Path и карта Path -> кортеж или hex-строка."""
+    root = Path('/data/source')
+    files_to_process = []; files_map = {}
+    for rel_path, size, mtime, digest in synthetic_entries(count):
+        path = root / rel_path
+        files_to_process.append({'path': path, 'rel_path': path.relative_to(root), 'size': size, 'mtime': mtime})
+    for item, (_, _, _, digest) in zip(files_to_process, synthetic_entries(count)):
+        files_map[item['rel_path']] = digest.hex() if accurate else (item['size'], item['mtime'], None)
+    return files_to_process, files_map
+
+def build_table(count, accurate):
+    table = sync_logic.FileTable(hashlib.sha256().digest_size if accurate else 0)
+    for rel_path, size, mtime, digest in synthetic_entries(count):
+        table.add(rel_path, size, mtime, digest if accurate else None)
+    return table
+
+def run_memory(count):
+    print(f"Файлов: {count}")
+    print(f"{'Режим':<10} {'Прежний формат':>16} {'FileTable':>12} {'Экономия':>10}")
+    for mode in ('hybrid', 'accurate'):
+        accurate = mode == 'accurate'
+        legacy = measure(lambda: build_legacy(count, accurate)) / count
+        table = measure(lambda: build_table(count, accurate)) / count
+        print(f"{mode:<10} {legacy:>11.0f} Б/ф {table:>7.0f} Б/ф {legacy / table:>9.1f}x")
+
+def print_table(report):
+    print(f"{'Дерево':<6} {'Режим':<9} {'Парал.':<6} {'Staging':<7} {'Проход':<8} {'Время, с':>9} {'Файл/с':>9} {'МБ/с':>8} {'RSS, МБ':>8}  Этапы")
+    for r in report['results']:
+        phases = ", ".join(f"{name} {seconds:.2f}" for name, seconds in r['phases'].items())
+        print(f"{r['shape']:<6} {r['mode']:<9} {str(r['parallel']):<6} {str(r['staging']):<7} {r['pass']:<8} {r['wall_seconds']:>9.2f} "
+              f"{r['files_per_sec'] or 0:>9.1f} {r['mb_per_sec'] or 0:>8.2f} {r['peak_rss_mb'] or 0:>8.1f}  {phases}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Замеры производительности модуля синхронизации.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    memory_parser = subparsers.add_parser("memory", help="Память карты файлов на один файл.")
+    memory_parser.add_argument("--files", type=int, default=100000, help="Количество синтетических файлов.")
+
+    run_parser = subparsers.add_parser("run", help="Замер скорости на синтетических деревьях для всех комбинаций настроек.")
+    run_parser.add_argument("--shapes", nargs='+', choices=list(TREE_SHAPES), default=list(TREE_SHAPES), help="Формы деревьев.")
+    run_parser.add_argument("--scale", type=float, default=1.0, help="Множитель числа файлов в дереве.")
+    run_parser.add_argument("--churn", type=float, default=10.0, help="Процент измененных файлов для повторного прохода (0 — без него).")
+    run_parser.add_argument("--modes", nargs='+', choices=['accurate', 'hybrid'], default=['accurate', 'hybrid'], help="Режимы сравнения.")
+    run_parser.add_argument("--parallel", nargs='+', choices=['on', 'off'], default=['off', 'on'], help="Значения use_parallel.")
+    run_parser.add_argument("--staging", nargs='+', choices=['on', 'off'], default=['off', 'on'], help="Значения use_staging.")
+    run_parser.add_argument("--repeat", type=int, default=1, help="Число повторов каждой комбинации (берется лучший результат).")
+    run_parser.add_argument("--workdir", help="Папка для деревьев (по умолчанию временная).")
+    run_parser.add_argument("--output", help="Файл для результатов в JSON (по умолчанию — только таблица на экране).")
+
+    compare_parser = subparsers.add_parser("compare", help="Сравнить два файла результатов и найти регрессии.")
+    compare_parser.add_argument("baseline", help="Файл результатов до изменения.")
+    compare_parser.add_argument("current", help="Файл результатов после изменения.")
+    compare_parser.add_argument("--threshold", type=float, default=10.0, help="Допустимое ухудшение метрики, %% (по умолчанию 10).")
+
+    # Служебная команда: один замер в отдельном процессе, результат в JSON на stdout.
+    one_parser = subparsers.add_parser("run-one")
+    for name in ("workdir", "shape", "scale", "churn", "options"): one_parser.add_argument(name)
+    args = parser.parse_args()
+
+    if args.command == "memory": run_memory(args.files)
+    elif args.command == "run":
+        report = run_suite(args.shapes, args.scale, args.churn, args.modes, [v == 'on' for v in args.parallel], [v == 'on' for v in args.staging], args.workdir, args.repeat)
+        print_table(report)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f: json.dump(report, f, ensure_ascii=False, indent=2)
+            print(f"Результаты сохранены в {args.output}")
+    elif args.command == "compare":
+        with open(args.baseline, encoding='utf-8') as f: baseline = json.load(f)
+        with open(args.current, encoding='utf-8') as f: current = json.load(f)
+        regressions = compare_results(baseline, current, args.threshold)
+        for key, metric, before, after, change in regressions:
+            print(f"РЕГРЕССИЯ {'/'.join(map(str, key))}: {metric} {before} -> {after} ({change:+.1f}%)")
+        print(f"Регрессий: {len(regressions)} (порог {args.threshold}%)")
+        sys.exit(1 if regressions else 0)
+    elif args.command == "run-one":
+        logging.disable(logging.CRITICAL)
+        print(json.dumps(run_one(args.workdir, args.shape, float(args.scale), float(args.churn), json.loads(args.options))))
@@ -1,7 +1,11 @@
 import argparse
 import sys
+import shutil
+import multiprocessing
 import configparser
 import sync_logic
+import watcher
+import scheduler
 
 def main():
     parser = argparse.ArgumentParser(
@@ -12,20 +16,58 @@ def main():
     parser.add_argument("source", nargs='?', default=None, help="Исходная директория.")
     parser.add_argument("destination", nargs='?', default=None, help="Целевая директория.")
     parser.add_argument("--job", help="Путь к файлу задачи (.ini).")
+    parser.add_argument("--extra-dest", action="append", default=None, metavar="PATH",
+                        help="Дополнительное назначение (можно указать несколько раз): источник сканируется и читается один раз для всех назначений.")
     
     # Опции синхронизации
     parser.add_argument("--no-overwrite", action="store_true", help="Отключить перезапись.")
     parser.add_argument("--delete-removed", action="store_true", help="Удалять лишние файлы.")
     parser.add_argument("--sync-empty-dirs", action="store_true", help="Синхронизировать пустые директории.")
+    parser.add_argument("--no-detect-moves", action="store_true", help="Не распознавать перемещенные файлы (копировать их заново).")
     parser.add_argument("--exclude", nargs='+', help="Список шаблонов для исключения файлов (например, *.log *.tmp).")
 
     # Опции надежности
     parser.add_argument("--use-staging", action="store_true", help="Использовать транзакционное копирование (надежнее).")
     parser.add_argument("--use-trash", action="store_true", help="Использовать безопасное удаление (в корзину).")
     
+    parser.add_argument("--verify-copies", choices=['none', 'trust', 'reread'], default=None,
+                        help="Проверка копий: none (без хеша), trust (хеш при копировании), reread (перечитать копию с диска).")
+    
     # Опции производительности
     parser.add_argument("--comparison-mode", choices=['accurate', 'hybrid'], default=None, help="Режим сравнения файлов: accurate или hybrid.")
     parser.add_argument("--parallel", action="store_true", help="Использовать параллельное сканирование.")
+    parser.add_argument("--streaming", action="store_true", help="Потоковый режим: копирование начинается во время сканирования, память не растет с размером дерева.")
+    parser.add_argument("--copy-workers", type=int, default=None, help="Число параллельных копирований на устройство (по умолчанию 1).")
+    parser.add_argument("--no-hash-index", action="store_true", help="Не использовать постоянный индекс хешей (пересчитывать хеши всех файлов).")
+    parser.add_argument("--no-manifest", action="store_true", help=f"Не вести манифест {sync_logic.MANIFEST_NAME} в корне назначения.")
+    parser.add_argument("--hash-algorithm", choices=list(sync_logic.HASH_ALGORITHMS), default=None, help=f"Алгоритм хеширования (по умолчанию {sync_logic.DEFAULT_HASH_ALGORITHM}).")
+    parser.add_argument("--hash-processes", action="store_true", help="Параллельное хеширование в отдельных процессах вместо потоков.")
+    parser.add_argument("--no-auto-tune", action="store_true", help="Не подстраивать параллельность, буферы и порядок чтения под тип хранилища (HDD/SSD/сеть).")
+    parser.add_argument("--tree-hash-chunk", type=int, default=None, metavar="MB", help="Древовидный хеш: крупные файлы хешируются блоками по MB мегабайт параллельно (0 — выключен).")
+    parser.add_argument("--throttle", type=throttle_spec, default=None, metavar="SPEC",
+                        help="Ограничение скорости копирования и хеширования: read=МБ/с write=МБ/с ops=операций/с, по времени суток — правила через ';', "
+                             "например \"08:00-20:00 read=20 write=20; read=200\" (днем 20 МБ/с, в остальное время 200 МБ/с).")
+    parser.add_argument("--delta-min", type=int, default=None, metavar="MB", help="Блочная дельта: измененные файлы от MB мегабайт обновляются записью только отличающихся блоков (0 — выключена).")
+
+    # Отчеты
+    parser.add_argument("--log-level", choices=list(sync_logic.LOG_LEVELS), default=None,
+                        help="Подробность лога: errors (только предупреждения и ошибки), summary (итоги без строк по файлам), files (каждая операция с файлом), "
+                             f"trace (вдобавок исключения по шаблонам). По умолчанию — из секции [logging] {sync_logic.CONFIG_FILE} или {sync_logic.DEFAULT_LOG_LEVEL}.")
+    parser.add_argument("--no-progress", action="store_true", help="Не показывать строку прогресса (скорость и оставшееся время) под логом в терминале.")
+    parser.add_argument("--metrics-file", default=None, metavar="PATH", help=f"Куда записать отчет метрик сеанса в JSON (по умолчанию {sync_logic.METRICS_FILE}); рядом пишется файл .prom для Prometheus.")
+
+    # Проверка назначения
+    parser.add_argument("--verify", action="store_true", help="Вместо синхронизации проверить назначение по манифесту: перечитать файлы и сверить хеши. "
+                                                              "Назначение берется из файла задачи или из аргумента (единственного или второго).")
+
+    # Пакетный запуск
+    parser.add_argument("--batch", metavar="DIR", help="Выполнить все файлы задач (*.ini) из папки параллельно, с общим отчетом и одним уведомлением.")
+    parser.add_argument("--max-jobs", type=int, default=None, help=f"Сколько задач пакета выполняется одновременно (по умолчанию {scheduler.BATCH_MAX_JOBS}).")
+    parser.add_argument("--per-volume", type=int, default=None, help=f"Сколько задач пакета одновременно работают с одним диском или сетевым ресурсом (по умолчанию {scheduler.BATCH_PER_VOLUME}).")
+
+    # Режим наблюдения
+    parser.add_argument("--watch", action="store_true", help="После полной синхронизации следить за источником (inotify, только Linux) и синхронизировать изменения.")
+    parser.add_argument("--watch-debounce", type=float, default=None, help=f"Пауза без изменений перед синхронизацией пачки, в секундах (по умолчанию {watcher.WATCH_DEBOUNCE_SECONDS:g}).")
 
     # Сетевые опции
     parser.add_argument("--source-user", help="Имя пользователя для исходного сетевого ресурса.")
@@ -34,62 +76,107 @@ def main():
     parser.add_argument("--dest-pass", help="Пароль для целевого сетевого ресурса. ВНИМАНИЕ: будет виден в истории команд!")
 
     args = parser.parse_args()
-    sync_logic.setup_logging()
+    sync_logic.setup_logging(verbosity=args.log_level)
+    # Строка прогресса перерисовывается на месте, поэтому только в терминале; в пакете задачи идут одновременно.
+    progress = console_progress if sys.stdout.isatty() and not args.no_progress and not args.batch else None
+
+    if args.batch:
+        if args.job or args.source or args.watch or args.verify: parser.error("Опция '--batch' не сочетается с '--job', путями, '--watch' и '--verify'.")
+        # Без metrics_file в файле задачи отдельный отчет сеанса не пишется: все попадает в общий отчет пакета.
+        defaults = dict(job_from_args(args), metrics_file='')
+        try:
+            report = scheduler.run_batch(args.batch, defaults, args.max_jobs or scheduler.BATCH_MAX_JOBS, args.per_volume or scheduler.BATCH_PER_VOLUME,
+                                         args.metrics_file or sync_logic.METRICS_FILE)
+        except Exception as e:
+            print(f"\nКРИТИЧЕСКАЯ ОШИБКА: {e}", file=sys.stderr)
+            sys.exit(1)
+        sys.exit(0 if report['status'] == 'success' else 1)
+
+    if args.verify and not args.job:
+        destination = args.destination or args.source
+        if not destination: parser.error("Для --verify укажите папку назначения или опцию '--job'.")
+        run_verify(destination, {'user': args.dest_user, 'password': args.dest_pass} if args.dest_user and args.dest_pass else None,
+                   'process' if args.hash_processes else 'thread', not args.no_auto_tune, progress, args.throttle or '')
 
     if args.job:
-        config = configparser.ConfigParser()
         try:
-            if not config.read(args.job, encoding='utf-8'):
-                raise FileNotFoundError(f"Файл задачи не найден: {args.job}")
-            
-            job = config['SyncJob']
-            source = job.get('source')
-            destination = job.get('destination')
-            no_overwrite = job.getboolean('no_overwrite', fallback=args.no_overwrite)
-            delete_removed = job.getboolean('delete_removed', fallback=args.delete_removed)
-            sync_empty_dirs = job.getboolean('sync_empty_dirs', fallback=args.sync_empty_dirs)
-            
-            exclude_str = job.get('exclude', '')
-            exclude_patterns = [p.strip() for p in exclude_str.split(',') if p.strip()] if exclude_str else (args.exclude or [])
-            
-            comparison_mode = job.get('comparison_mode', fallback=args.comparison_mode or 'accurate')
-            use_parallel = job.getboolean('use_parallel', fallback=args.parallel)
-            use_staging = job.getboolean('use_staging', fallback=args.use_staging)
-            use_trash = job.getboolean('use_trash', fallback=args.use_trash)
-            
-            source_creds = dict(config.items('SourceNetCreds')) if config.has_section('SourceNetCreds') else None
-            dest_creds = dict(config.items('DestNetCreds')) if config.has_section('DestNetCreds') else None
-        except (configparser.Error, KeyError, FileNotFoundError) as e:
+            job = scheduler.read_job(args.job, job_from_args(args))
+        except (configparser.Error, KeyError, FileNotFoundError, ValueError) as e:
             print(f"Ошибка чтения файла задачи '{args.job}': {e}", file=sys.stderr)
             sys.exit(1)
-            
     elif args.source and args.destination:
-        source = args.source
-        destination = args.destination
-        no_overwrite = args.no_overwrite
-        delete_removed = args.delete_removed
-        sync_empty_dirs = args.sync_empty_dirs
-        exclude_patterns = args.exclude
-        comparison_mode = args.comparison_mode or 'accurate'
-        use_parallel = args.parallel
-        use_staging = args.use_staging
-        use_trash = args.use_trash
-        source_creds = {'user': args.source_user, 'password': args.source_pass} if args.source_user and args.source_pass else None
-        dest_creds = {'user': args.dest_user, 'password': args.dest_pass} if args.dest_user and args.dest_pass else None
+        job = job_from_args(args)
     else:
         parser.error("Необходимо указать 'source' и 'destination', либо опцию '--job'.")
 
+    if args.verify: run_verify(job['destinations'][0], job['dest_creds'][0], job['hash_backend'], job['auto_tune'], progress, job['throttle'])
+    if len(job['destinations']) > 1 and job['watch']: parser.error("Режим наблюдения поддерживает только одно назначение.")
+
     try:
-        sync_logic.run_sync_session(
-            source, destination, no_overwrite, delete_removed, sync_empty_dirs, 
-            exclude_patterns, source_creds, dest_creds, None, 
-            comparison_mode, use_parallel, use_staging, use_trash
-        )
+        if job['watch']:
+            watcher.watch_sync_session(
+                job['source'], job['destinations'][0], dest_creds=job['dest_creds'][0], progress_callback=progress, streaming=job['streaming'], debounce=job['watch_debounce'],
+                **{key: job[key] for key in scheduler.SESSION_KEYS}
+            )
+        else:
+            if len(job['destinations']) > 1 and job['streaming']: print("Потоковый режим не используется при нескольких назначениях: источник сканируется один раз для всех.", file=sys.stderr)
+            scheduler.run_job(job, progress_callback=progress)
+    except KeyboardInterrupt:
+        if not job['watch']: raise
+        print("\nНаблюдение остановлено пользователем.", file=sys.stderr)
     except Exception as e:
         # Теперь мы печатаем ошибку в консоль перед выходом!
         print(f"\nКРИТИЧЕСКАЯ ОШИБКА: {e}", file=sys.stderr)
         print("Синхронизация прервана. Подробности смотрите в лог-файле.", file=sys.stderr)
         sys.exit(1)
+    finally:
+        if progress: sync_logic.show_console_status('')
+
+def job_from_args(args):
+    """Параметры задачи из аргументов командной строки; для файлов задач — значения по умолчанию."""
+    destinations = [args.destination] + (args.extra_dest or []) if args.destination else []
+    dest_creds = {'user': args.dest_user, 'password': args.dest_pass} if args.dest_user and args.dest_pass else None
+    return {
+        'name': 'cli', 'path': None, 'priority': 0, 'source': args.source, 'destinations': destinations,
+        'no_overwrite': args.no_overwrite, 'delete_removed': args.delete_removed, 'sync_empty_dirs': args.sync_empty_dirs,
+        'detect_moves_enabled': not args.no_detect_moves, 'exclude_patterns': args.exclude,
+        'comparison_mode': args.comparison_mode or 'accurate', 'use_parallel': args.parallel, 'use_staging': args.use_staging, 'use_trash': args.use_trash,
+        'use_hash_index': not args.no_hash_index, 'use_manifest': not args.no_manifest, 'copy_workers': args.copy_workers or 1,
+        'verify_copies': args.verify_copies or 'none', 'streaming': args.streaming,
+        'hash_algorithm': args.hash_algorithm or sync_logic.DEFAULT_HASH_ALGORITHM, 'hash_backend': 'process' if args.hash_processes else 'thread',
+        'tree_hash_chunk_mb': args.tree_hash_chunk or 0, 'delta_min_mb': args.delta_min or 0, 'auto_tune': not args.no_auto_tune,
+        'watch': args.watch, 'watch_debounce': args.watch_debounce or watcher.WATCH_DEBOUNCE_SECONDS,
+        'metrics_file': args.metrics_file or sync_logic.METRICS_FILE, 'throttle': args.throttle or '',
+        'source_creds': {'user': args.source_user, 'password': args.source_pass} if args.source_user and args.source_pass else None,
+        # Учетные данные --dest-user/--dest-pass относятся только к основному назначению.
+        'dest_creds': [dest_creds] + [None] * max(len(destinations) - 1, 0),
+    }
+
+def throttle_spec(value):
+    """Тип аргумента --throttle: расписание проверяется сразу, чтобы ошибка не всплыла посреди сеанса."""
+    try: sync_logic.parse_throttle(value)
+    except ValueError as e: raise argparse.ArgumentTypeError(str(e))
+    return value
+
+def console_progress(p_type, current, total, message=""):
+    """Компактная строка прогресса под логом: процент, объем, скорость и оставшееся время текущего этапа."""
+    if p_type != 'overall': sync_logic.show_console_status(''); return
+    line = (f"{current * 100 / total:5.1f}% " if total > 1 else "") + message
+    sync_logic.show_console_status(line[:shutil.get_terminal_size().columns - 1])
+
+def run_verify(destination, dest_creds, hash_backend, auto_tune, progress_callback=None, throttle=''):
+    """Проверка назначения по манифесту; код выхода 1, если найдены расхождения или проверка не удалась."""
+    try:
+        results = sync_logic.verify_destination(destination, dest_creds, hash_backend, auto_tune, progress_callback, throttle=throttle)
+    except Exception as e:
+        print(f"\nКРИТИЧЕСКАЯ ОШИБКА: {e}", file=sys.stderr)
+        print("Проверка прервана. Подробности смотрите в лог-файле.", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        if progress_callback: sync_logic.show_console_status('')
+    sys.exit(1 if results['corrupted'] or results['modified'] or results['missing'] or results['unreadable'] else 0)
 
 if __name__ == "__main__":
+    # Процессный пул хеширования в собранном .exe запускает дочерние процессы через этот же файл.
+    multiprocessing.freeze_support()
     main()
\ No newline at end of file
@@ -0,0 +1,356 @@
+import os
+import queue
+import shutil
+import logging
+import sqlite3
+import threading
+import time
+import concurrent.futures
+from pathlib import Path
+from datetime import datetime
+import sync_logic
+
+# --- Константы ---
+# Блоков данных в очереди на каждое назначение: медленное назначение отстает от остальных не больше чем на этот буфер.
+FANOUT_BUFFER_CHUNKS = 16
+FANOUT_CHUNK_SIZE = sync_logic.COPY_BUFFER_SIZE
+
+# --- Назначения ---
+class FanoutTarget:
+    """Одно назначение сеанса раздачи: свои журнал, манифест, метрики и статистика."""
+    def __init__(self, number, destination):
+        self.number = number; self.destination = destination; self.path = Path(destination)
+        self.label = f"[{number}] {destination}"
+        self.index_root = sync_logic.HashIndex.root_key(destination)
+        self.journal = None; self.manifest = None; self.storage = None
+        self.metrics = sync_logic.SyncMetrics(); self.stats = None; self.error = None
+        self.lock = threading.Lock()
+        self.counts = {"copied": 0, "updated": 0, "errors": 0}
+
+    def count(self, key):
+        with self.lock: self.counts[key] += 1
+
+class FanoutWrite:
+    """Запись одного файла в одно назначение. Для крупных файлов данные приходят через ограниченную
+    очередь и пишутся отдельным потоком; ошибка записи выключает только это назначение.
+    Файл назначения открывается (и обрезается) только при первой записи: если источник не прочитался,
+    прежняя копия остается нетронутой."""
+    def __init__(self, copier, target, rel_path, reason, compare_content):
+        self.target = target; self.rel_path = rel_path; self.reason = reason; self.compare_content = compare_content
+        self.dest_file = target.path / rel_path
+        self.target_file = self.dest_file.with_name(self.dest_file.name + sync_logic.STAGING_SUFFIX) if copier.use_staging else self.dest_file
+        self.error = None; self.queue = None; self.thread = None; self.file = None
+        # Совпадение содержимого при разной дате проверяется по хешу источника, вычисленному при раздаче.
+        self.dest_hash = sync_logic.calculate_file_hash_cached(self.dest_file, copier.hash_index, target.index_root, rel_path, hash_engine=copier.hash_engine,
+                                                               metrics=target.metrics, manifest=target.manifest) if compare_content else None
+        if target.journal and copier.use_staging: target.journal.stage(rel_path)
+
+    def open(self):
+        if self.file is None:
+            self.target_file.parent.mkdir(parents=True, exist_ok=True); self.file = open(self.target_file, 'wb')
+
+    def start(self):
+        self.queue = queue.Queue(FANOUT_BUFFER_CHUNKS)
+        self.thread = threading.Thread(target=self._drain, name=f'fanout-{self.target.number}', daemon=True); self.thread.start()
+
+    def _write(self, data):
+        self.open()
+        if isinstance(data, int): self.file.seek(data, os.SEEK_CUR)
+        else: self.file.write(data)
+
+    def _drain(self):
+        # После ошибки очередь дочитывается вхолостую, чтобы чтение источника не встало на этом назначении.
+        while (data := self.queue.get()) is not None:
+            if self.error is None:
+                try: self._write(data)
+                except Exception as e: self.error = e
+
+    def put(self, data):
+        """data — блок данных или число байт дыры разреженного источника: дыра пропускается, и в копии остается дырой."""
+        if self.error is not None: return
+        if self.queue is None:
+            try: self._write(data)
+            except Exception as e: self.error = e
+        else: self.queue.put(data)
+
+    def join(self):
+        if self.thread: self.queue.put(None); self.thread.join(); self.thread = None
+
+    def abort(self, remove=True):
+        self.join()
+        if self.file is None: return  # назначение еще не открывалось — удалять нечего
+        self.file.close()
+        if remove: self.target_file.unlink(missing_ok=True)
+
+class FanoutCopier:
+    """Копирование для нескольких назначений: каждый файл читается и хешируется один раз,
+    а данные раздаются во все назначения, которым он нужен. Файлы копируются параллельно через CopyEngine."""
+    def __init__(self, source_dir, use_staging=False, verify_copies='none', hash_engine=None, hash_index=None, stop_event=None, metrics=None, copy_workers=1, delta_min_size=0, throttle=None):
+        self.source_path = Path(source_dir); self.use_staging = use_staging; self.verify_copies = verify_copies
+        self.hash_engine = hash_engine or sync_logic.DEFAULT_HASH_ENGINE; self.hash_index = hash_index
+        self.stop_event = stop_event; self.metrics = metrics or sync_logic.SyncMetrics(); self.copy_workers = copy_workers
+        self.delta_min_size = delta_min_size; self.throttle = throttle
+        self.lock = threading.Lock()
+        self.requests = {}  # rel_path -> [(назначение, причина, сравнить содержимое)], в порядке первого запроса
+
+    def sink(self, target):
+        """copy_sink для sync_folders этого назначения: забирает копии себе, кроме обновлений блочной дельтой —
+        они зависят от содержимого конкретного назначения и выполняются самим sync_folders."""
+        def claim(rel_path, reason, compare_content):
+            if self.delta_min_size and (target.path / rel_path).is_file():
+                try:
+                    if os.stat(self.source_path / rel_path).st_size >= self.delta_min_size: return False
+                except OSError: pass
+            with self.lock: self.requests.setdefault(rel_path, []).append((target, reason, compare_content))
+            return True
+        return claim
+
+    def run(self, progress_callback=None):
+        """Выполняет собранные копии. Назначения с ошибкой на этапе сравнения пропускаются."""
+        with self.lock: planned = [(rel_path, [claim for claim in claims if claim[0].error is None]) for rel_path, claims in self.requests.items()]
+        planned = [(rel_path, claims) for rel_path, claims in planned if claims]
+        if not planned: return
+        logging.info(f"Раздача: {len(planned)} файлов, записей в назначения: {sum(len(claims) for _, claims in planned)}")
+        devices = {}
+        def stat_of(path):
+            try: return os.stat(path)
+            except OSError: return None
+        # Прогресс считается по байтам источника: каждый файл читается один раз, сколько бы назначений его ни ждало.
+        source_stats = [stat_of(self.source_path / rel_path) for rel_path, _ in planned]
+        progress = sync_logic.ProgressMeter(progress_callback, "Раздача", sum(stat.st_size for stat in source_stats if stat), len(planned))
+        def task(rel_path, claims, size):
+            file_progress = progress.file(size, rel_path)
+            try: self.copy_file(rel_path, claims, file_progress)
+            finally: file_progress.close()
+        copy_engine = sync_logic.CopyEngine(self.copy_workers, self.stop_event)
+        try:
+            for (rel_path, claims), source_stat in zip(planned, source_stats):
+                if self.stop_event and self.stop_event.is_set(): raise sync_logic.SyncCancelledError("Прервано на этапе раздачи файлов.")
+                for target, _, _ in claims:
+                    if target.number not in devices: devices[target.number] = getattr(stat_of(target.path), 'st_dev', None)
+                claim_devices = (getattr(source_stat, 'st_dev', None), *(devices[target.number] for target, _, _ in claims))
+                copy_engine.submit(task, [device for device in claim_devices if device is not None], rel_path, claims, source_stat.st_size if source_stat else 0)
+            copy_engine.wait()
+        finally:
+            copy_engine.shutdown()
+        progress.finish()
+
+    def copy_file(self, rel_path, claims, on_progress=None):
+        source_file = self.source_path / rel_path
+        # Источник открывается до назначений: если он недоступен, ни одна прежняя копия не обрезается.
+        try:
+            with open(source_file, 'rb') as f: self._copy_from(f, rel_path, claims, on_progress)
+        except OSError as e:
+            for target, _, _ in claims: logging.error(f"Ошибка операции с файлом {rel_path} ({target.label}): {e}"); target.count("errors")
+
+    def _copy_from(self, f, rel_path, claims, on_progress=None):
+        source_file = self.source_path / rel_path
+        source_stat = os.fstat(f.fileno()); layout = sync_logic.SparseLayout.probe(f.fileno())
+        source_fingerprint = (source_stat.st_size, source_stat.st_mtime_ns)
+        writes = []
+        for target, reason, compare_content in claims:
+            try: writes.append(FanoutWrite(self, target, rel_path, reason, compare_content))
+            except Exception as e: logging.error(f"Ошибка операции с файлом {rel_path} ({target.label}): {e}"); target.count("errors")
+        if not writes: return
+        # Без промежуточного файла копия не прерывается на середине, чтобы не оставить обрезанный файл.
+        copy_stop = self.stop_event if self.use_staging else None
+        threaded = len(writes) > 1 and source_stat.st_size > FANOUT_CHUNK_SIZE
+        hasher = self.hash_engine.hasher(); started = time.monotonic(); size = 0; throttle = self.throttle
+        if throttle: throttle.op(len(writes))
+        try:
+            if threaded:
+                for write in writes: write.start()
+            while True:
+                if copy_stop and copy_stop.is_set(): raise sync_logic.SyncCancelledError("Прервано во время копирования файла.")
+                if layout is not None and not layout.has_data(size, size + FANOUT_CHUNK_SIZE):
+                    hole = min(FANOUT_CHUNK_SIZE, layout.end - size)
+                    if hole <= 0: break
+                    # Дыра источника не читается и не записывается ни в одно назначение.
+                    f.seek(size + hole); hasher.update_zeros(hole); size += hole
+                    for write in writes: write.put(hole)
+                    continue
+                data = f.read(FANOUT_CHUNK_SIZE)
+                if not data: break
+                # Данные читаются один раз, а пишутся в каждое назначение: лимит записи списывается за все копии.
+                if throttle: throttle.read(len(data)); throttle.write(len(data) * len(writes))
+                hasher.update(data); size += len(data)
+                for write in writes: write.put(data)
+                if on_progress: on_progress(len(data))
+            for write in writes: write.join()
+        except sync_logic.SyncCancelledError:
+            for write in writes: write.abort()
+            raise
+        except Exception as e:
+            # Ошибка чтения источника касается всех назначений этого файла.
+            for write in writes:
+                write.abort(remove=self.use_staging)
+                logging.error(f"Ошибка операции с файлом {rel_path} ({write.target.label}): {e}"); write.target.count("errors")
+            return
+        file_hash = hasher.hexdigest()
+        self.metrics.add(bytes_read=size, bytes_hashed=size)
+        for write in writes: self.finish(write, source_file, source_fingerprint, file_hash, size)
+        self.metrics.file_done('fanout', rel_path, time.monotonic() - started, size)
+
+    def finish(self, write, source_file, source_fingerprint, file_hash, size):
+        """Закрывает копию в одном назначении: проверка, перенос промежуточного файла, журнал, манифест и индекс."""
+        target = write.target; rel_path = write.rel_path
+        try:
+            if write.error is not None: raise write.error
+            write.open()  # пустой источник не дает ни одной записи
+            # Длина копии задается явно: разреженный источник может заканчиваться дырой.
+            write.file.truncate(size)
+            if self.verify_copies == 'reread':
+                write.file.flush(); os.fsync(write.file.fileno())
+                if hasattr(os, 'posix_fadvise'): os.posix_fadvise(write.file.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+            write.file.close()
+            shutil.copystat(source_file, write.target_file)
+            target.metrics.add(bytes_written=size)
+            if self.verify_copies == 'reread':
+                target.metrics.add(bytes_read=size, bytes_hashed=size)
+                if sync_logic.calculate_file_hash(write.target_file, self.hash_engine) != file_hash:
+                    raise IOError(f"Хеш записанной копии не совпадает с хешем источника: {write.target_file}")
+            if write.compare_content and file_hash == write.dest_hash:
+                # Содержимое не изменилось: копия не нужна, с назначения снимаются только атрибуты источника.
+                if self.use_staging: write.target_file.unlink(); shutil.copystat(source_file, write.dest_file)
+                if target.journal: target.journal.done('copy', rel_path, source_fingerprint, file_hash)
+                if target.manifest: stat = write.dest_file.stat(); target.manifest.record(rel_path, stat.st_size, stat.st_mtime_ns, file_hash)
+                sync_logic.file_log.info(f"БЕЗ ИЗМЕНЕНИЙ (совпадает хеш): {rel_path} -> {target.label}"); return
+            if self.use_staging: os.replace(write.target_file, write.dest_file)
+            if target.journal: target.journal.done('copy', rel_path, source_fingerprint, file_hash)
+            sync_logic.file_log.info(f"{write.reason}: {rel_path} -> {target.label} [fanout, {self.hash_engine.name}={file_hash}]")
+            stat = write.dest_file.stat()
+            if target.manifest: target.manifest.record(rel_path, stat.st_size, stat.st_mtime_ns, file_hash)
+            if self.hash_index: self.hash_index.update(target.index_root, [(rel_path, (stat.st_size, stat.st_mtime_ns, stat.st_ino, stat.st_dev), file_hash)])
+            target.count("updated" if "ОБНОВЛЕНИЕ" in write.reason else "copied")
+        except Exception as e:
+            logging.error(f"Ошибка операции с файлом {rel_path} ({target.label}): {e}"); target.count("errors")
+            if write.file and not write.file.closed: write.file.close()
+            if self.use_staging: write.target_file.unlink(missing_ok=True)
+
+# --- Сеанс раздачи ---
+def format_target_stats(stats):
+    return (f"скопировано {stats['copied']}, обновлено {stats['updated']}, перемещено {stats['moved']}, пропущено {stats['skipped']}, "
+            f"удалено {stats['deleted'] + stats['trashed']}, ошибок {stats['errors']}")
+
+def run_fanout_session(source, destinations, no_overwrite, delete_removed, sync_empty_dirs=False, exclude_patterns=None, source_creds=None, dest_creds=None, stop_event=None, comparison_mode='accurate', use_parallel=False, use_staging=False, use_trash=False, progress_callback=None, use_hash_index=True, copy_workers=1, verify_copies='none', detect_moves_enabled=True, hash_algorithm=sync_logic.DEFAULT_HASH_ALGORITHM, hash_backend='thread', tree_hash_chunk_mb=0, auto_tune=True, metrics_file=sync_logic.METRICS_FILE, delta_min_mb=0, use_manifest=True, notify=True, throttle=''):
+    """Синхронизация одного источника с несколькими назначениями. Источник сканируется один раз, затем
+    каждое назначение сравнивается с ним (назначения — параллельно), а каждый нужный файл читается один раз
+    и раздается во все назначения, которым он нужен. dest_creds — список учетных данных по назначениям.
+    Недоступное назначение или ошибка в нем не останавливает остальные; итог по каждому назначению — в уведомлении и отчете.
+    notify=False отключает уведомление в Telegram. throttle — расписание ограничения скорости, общее для всех назначений."""
+    start_time = datetime.now(); metrics = sync_logic.SyncMetrics()
+    targets = [FanoutTarget(number, destination) for number, destination in enumerate(destinations, 1)]
+    dest_creds = list(dest_creds or []) + [None] * (len(targets) - len(dest_creds or []))
+    logging.info("="*50); logging.info("Начало сеанса раздачи в несколько назначений"); logging.info(f"Источник: {source}")
+    for target in targets: logging.info(f"Назначение {target.label}")
+    logging.info(f"Перезапись отключена: {'Да' if no_overwrite else 'Нет'}"); logging.info(f"Удаление лишних файлов: {'Да' if delete_removed else 'Нет'}")
+    logging.info(f"Синхронизация пустых папок: {'Да' if sync_empty_dirs else 'Нет'}"); logging.info(f"Исключения: {exclude_patterns if exclude_patterns else 'Нет'}")
+    logging.info(f"Режим сравнения: {comparison_mode}"); logging.info(f"Параллельное сканирование: {'Да' if use_parallel else 'Нет'}")
+    logging.info(f"Безопасное удаление: {'Да' if use_trash else 'Нет'}"); logging.info(f"Транзакционное копирование: {'Да' if use_staging else 'Нет'}")
+    logging.info(f"Индекс хешей: {sync_logic.HASH_INDEX_FILE if use_hash_index else 'Нет'}"); logging.info(f"Манифест назначения: {sync_logic.MANIFEST_NAME if use_manifest else 'Нет'}")
+    logging.info(f"Потоков копирования на устройство: {copy_workers}"); logging.info(f"Буфер раздачи на назначение: {FANOUT_BUFFER_CHUNKS * FANOUT_CHUNK_SIZE // (1024 * 1024)} МБ")
+    logging.info(f"Проверка копий: {verify_copies}"); logging.info(f"Поиск перемещенных файлов: {'Да' if detect_moves_enabled and delete_removed else 'Нет'}")
+    logging.info(f"Блочная дельта: {f'файлы от {delta_min_mb} МБ' if delta_min_mb else 'Нет'}")
+    logging.info(f"Хеширование: {hash_algorithm}, пул: {hash_backend}, древовидный хеш: {f'блоки по {tree_hash_chunk_mb} МБ' if tree_hash_chunk_mb else 'Нет'}")
+    logging.info(f"Расписание ограничения скорости: {throttle or 'Нет'}"); logging.info(f"Отчет метрик: {metrics_file or 'Нет'}"); logging.info("="*50)
+    hash_index = None; status = 'error'; error = None; limiter = None
+    try:
+        hash_engine = sync_logic.HashEngine(hash_algorithm, hash_backend, int(tree_hash_chunk_mb or 0) * 1024 * 1024)
+        if throttle: limiter = hash_engine.throttle = sync_logic.Throttle(throttle, stop_event)
+        if not sync_logic.ensure_path_is_ready(source, source_creds): raise ConnectionError(f"Исходный путь недоступен: {source}")
+        source_storage = sync_logic.detect_storage(source) if auto_tune else None
+        for target, creds in zip(targets, dest_creds):
+            if not sync_logic.ensure_path_is_ready(target.destination, creds):
+                target.error = f"Целевой путь недоступен: {target.destination}"; logging.error(f"Назначение {target.label} пропущено: {target.error}"); continue
+            if auto_tune: target.storage = sync_logic.detect_storage(target.destination); sync_logic.log_storage_tuning(source_storage, target.storage, use_parallel, copy_workers)
+            try:
+                target.journal = sync_logic.SyncJournal(target.destination, source)
+                if target.journal.resumed_from: logging.info(f"Назначение {target.label}: продолжение прерванного сеанса от {target.journal.resumed_from}")
+            except OSError as e: logging.error(f"Не удалось открыть журнал сеанса в {target.destination}, продолжение после сбоя будет недоступно: {e}")
+            if use_manifest: target.manifest = sync_logic.DestManifest(target.destination, hash_engine)
+        live = [target for target in targets if target.error is None]
+        if not live: raise ConnectionError("Ни одно из назначений не доступно.")
+        if use_hash_index:
+            try: hash_index = sync_logic.HashIndex(sync_logic.HASH_INDEX_FILE, hash_engine.name)
+            except sqlite3.Error as e: logging.error(f"Не удалось открыть индекс хешей {sync_logic.HASH_INDEX_FILE}, работа без индекса: {e}")
+        metrics.end_phase('prepare')
+        exclude_patterns = sync_logic.ExcludeMatcher.compile(exclude_patterns)
+        source_files = sync_logic.get_files_map(source, exclude_patterns, stop_event, comparison_mode, use_parallel, hash_index, progress_callback, None, hash_engine, source_storage, metrics)
+        metrics.end_phase('scan')
+        delta_min_size = int(delta_min_mb or 0) * 1024 * 1024
+        copier = FanoutCopier(source, use_staging, verify_copies, hash_engine, hash_index, stop_event, metrics, copy_workers, delta_min_size, limiter)
+
+        def plan(target):
+            # Сравнение с назначением, перемещения, дельта и удаление выполняет sync_folders; новые копии забирает раздача.
+            try:
+                target.stats = sync_logic.sync_folders(source, target.destination, no_overwrite, delete_removed, sync_empty_dirs, exclude_patterns, stop_event, comparison_mode, use_parallel, use_staging, use_trash, None, hash_index, copy_workers, verify_copies, detect_moves_enabled,
+                                                       hash_engine=hash_engine, source_storage=source_storage, dest_storage=target.storage, metrics=target.metrics, journal=target.journal,
+                                                       delta_min_size=delta_min_size, manifest=target.manifest, source_files=source_files, copy_sink=copier.sink(target), throttle=limiter)
+            except sync_logic.SyncCancelledError: raise
+            except Exception as e:
+                target.error = str(e); logging.error(f"Ошибка назначения {target.label}: {e}", exc_info=True)
+        if progress_callback: progress_callback('overall', 0, 1, f"Сравнение с назначениями: {len(live)}")
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(live), thread_name_prefix='fanout-plan') as executor:
+            for future in [executor.submit(plan, target) for target in live]: future.result()
+        metrics.end_phase('plan')
+        copier.run(progress_callback)
+        metrics.end_phase('copy')
+        for target in live:
+            if target.stats is None: continue
+            for key, value in target.counts.items(): target.stats[key] += value
+            copied = target.counts["copied"] + target.counts["updated"]
+            if copied: target.stats["copy_methods"]["fanout"] = target.stats["copy_methods"].get("fanout", 0) + copied
+        failed = [target for target in targets if target.error is not None]
+        status = 'success' if not failed else 'partial'
+        duration = datetime.now() - start_time
+        summary = (f"{'✅' if not failed else '⚠️'} *Раздача {'успешно завершена' if not failed else 'завершена с ошибками назначений'}!*\n\n"
+                   f"*Источник:* `{source}`\nВремя выполнения: `{duration}`\n")
+        for target in targets:
+            if target.error is not None: summary += f"\n❌ *[{target.number}]* `{target.destination}`: ошибка `{target.error}`"
+            else: summary += f"\n*[{target.number}]* `{target.destination}`: {format_target_stats(target.stats)}"
+        if limiter: summary += f"\n\nОграничение скорости: {sync_logic.format_throttle_waits(limiter.report())}"
+        logging.info("\n" + summary.replace('*', '').replace('`', ''))
+        if notify: sync_logic.send_telegram_notification(summary)
+    except sync_logic.SyncCancelledError as e:
+        status = 'cancelled'; error = str(e)
+        duration = datetime.now() - start_time
+        cancel_message = f"🟡 *Раздача прервана пользователем!*\n\nПроцесс был остановлен после `{duration}`.\nСообщение: `{e}`"
+        logging.warning(cancel_message.replace('*', '').replace('`', ''))
+        if notify: sync_logic.send_telegram_notification(cancel_message)
+        raise e
+    except Exception as e:
+        error = str(e)
+        duration = datetime.now() - start_time
+        error_message = (f"❌ *ОШИБКА РАЗДАЧИ!*\n\nПроизошла критическая ошибка: `{e}`\n"
+                         f"Время выполнения до сбоя: `{duration}`\n\nПодробности смотрите в лог-файле: `{sync_logic.LOG_FILE}`")
+        logging.critical(f"КРИТИЧЕСКАЯ ОШИБКА: {e}", exc_info=True)
+        if notify: sync_logic.send_telegram_notification(error_message)
+        raise e
+    finally:
+        for target in targets:
+            if target.journal:
+                try: target.journal.close(finished=status in ('success', 'partial') and target.error is None)
+                except OSError as e: logging.error(f"Ошибка закрытия журнала сеанса {target.label}: {e}")
+            if target.manifest:
+                try: target.manifest.save()
+                except OSError as e: logging.error(f"Не удалось сохранить манифест назначения {target.label}: {e}")
+            # Записи в назначения и хеширование их файлов учитываются в общем отчете сеанса.
+            metrics.add(**target.metrics.counters)
+        if hash_index:
+            try: hash_index.compact()
+            except sqlite3.Error as e: logging.error(f"Ошибка обслуживания индекса хешей: {e}")
+            hash_index.close()
+        destinations_report = [{'destination': str(target.destination), 'status': 'error' if target.error is not None else status, 'error': target.error,
+                                'stats': {key: value for key, value in (target.stats or {}).items() if key != 'timings'},
+                                'counters': dict(target.metrics.counters), 'phases': dict(target.metrics.phases)} for target in targets]
+        totals = {}
+        for item in destinations_report:
+            for key, value in item['stats'].items():
+                if isinstance(value, int): totals[key] = totals.get(key, 0) + value
+        report = metrics.report(source=str(source), destination=", ".join(str(target.destination) for target in targets), status=status, error=error, mode='fanout',
+                                stats=totals, destinations=destinations_report, throttle=limiter.report() if limiter else None)
+        logging.info("Метрики сеанса:\n" + sync_logic.format_metrics_summary(report))
+        if metrics_file:
+            try: prom_file = sync_logic.write_metrics_report(report, metrics_file); logging.info(f"Отчет метрик сохранен: {metrics_file}, {prom_file}")
+            except OSError as e: logging.error(f"Не удалось сохранить отчет метрик {metrics_file}: {e}")
+    return report
@@ -3,6 +3,7 @@ from tkinter import ttk
 from tkinter import filedialog, messagebox, scrolledtext, Toplevel
 from PIL import Image, ImageTk
 import threading
+import multiprocessing
 import logging
 import queue
 import configparser
@@ -12,10 +13,17 @@ import base64
 import webbrowser
 from tkinter import font
 import sys
+import collections
 
 import sync_logic
 
 APP_STATE_FILE = 'app_state.ini'
+# Лог в окне: сколько строк хранится в виджете (старые вытесняются) и как часто разбирается очередь.
+LOG_VIEW_LINES = 5000
+LOG_POLL_MS = 100
+# Сколько сообщений разбирается за один тик, чтобы поток лога не блокировал интерфейс.
+LOG_POLL_BATCH = 20000
+LOG_PROBLEM_MARKERS = (' - WARNING - ', ' - ERROR - ', ' - CRITICAL - ')
 
 class QueueHandler(logging.Handler):
     """Класс для перенаправления логов в текстовое поле GUI."""
@@ -31,7 +39,7 @@ class SettingsWindow(Toplevel):
         super().__init__(master)
         self.transient(master)
         self.title("Настройки")
-        self.geometry("420x280")
+        self.geometry("420x520")
         self.resizable(False, False)
         self.grab_set()
         
@@ -56,11 +64,61 @@ class SettingsWindow(Toplevel):
         self.notebook.add(perf_frame, text='Производительность')
         self.comparison_mode_var = tk.StringVar(value=self.config.get('performance', 'comparison_mode', fallback='accurate'))
         self.use_parallel_var = tk.BooleanVar(value=self.config.getboolean('performance', 'use_parallel', fallback=False))
+        self.use_hash_index_var = tk.BooleanVar(value=self.config.getboolean('performance', 'use_hash_index', fallback=True))
+        self.use_manifest_var = tk.BooleanVar(value=self.config.getboolean('performance', 'use_manifest', fallback=True))
+        self.streaming_var = tk.BooleanVar(value=self.config.getboolean('performance', 'streaming', fallback=False))
+        self.copy_workers_var = tk.IntVar(value=self.config.getint('performance', 'copy_workers', fallback=1))
+        self.auto_tune_var = tk.BooleanVar(value=self.config.getboolean('performance', 'auto_tune', fallback=True))
+        self.hash_algorithm_var = tk.StringVar(value=self.config.get('performance', 'hash_algorithm', fallback=sync_logic.DEFAULT_HASH_ALGORITHM))
+        self.hash_processes_var = tk.BooleanVar(value=self.config.get('performance', 'hash_backend', fallback='thread') == 'process')
+        self.tree_hash_chunk_var = tk.IntVar(value=self.config.getint('performance', 'tree_hash_chunk_mb', fallback=0))
+        self.delta_min_var = tk.IntVar(value=self.config.getint('performance', 'delta_min_mb', fallback=0))
+        self.throttle_var = tk.StringVar(value=self.config.get('performance', 'throttle', fallback=''))
         tk.Label(perf_frame, text="Метод сравнения файлов:").pack(anchor="w")
         ttk.Radiobutton(perf_frame, text="Точный (по хешу, медленно, надежно)", variable=self.comparison_mode_var, value='accurate').pack(anchor="w", padx=10)
         ttk.Radiobutton(perf_frame, text="Гибридный (дата/размер + хеш, быстро)", variable=self.comparison_mode_var, value='hybrid').pack(anchor="w", padx=10)
         ttk.Separator(perf_frame, orient='horizontal').pack(fill='x', pady=10)
         tk.Checkbutton(perf_frame, text="Использовать параллельное сканирование\n(ускоряет на многоядерных ЦП и SSD)", variable=self.use_parallel_var, justify="left").pack(anchor="w")
+        tk.Checkbutton(perf_frame, text="Использовать индекс хешей\n(не пересчитывать хеши неизмененных файлов)", variable=self.use_hash_index_var, justify="left").pack(anchor="w")
+        tk.Checkbutton(perf_frame, text="Вести манифест в папке назначения\n(хеши копий без чтения, проверка целостности)", variable=self.use_manifest_var, justify="left").pack(anchor="w")
+        tk.Checkbutton(perf_frame, text="Потоковый режим (копирование во время сканирования,\nбез поиска перемещений)", variable=self.streaming_var, justify="left").pack(anchor="w")
+        tk.Checkbutton(perf_frame, text="Автонастройка под тип диска (HDD/SSD/сеть):\nпотоки, буферы и порядок чтения", variable=self.auto_tune_var, justify="left").pack(anchor="w")
+        workers_frame = tk.Frame(perf_frame); workers_frame.pack(anchor="w", pady=(5, 0))
+        tk.Label(workers_frame, text="Параллельных копирований на устройство:").pack(side="left")
+        tk.Spinbox(workers_frame, from_=1, to=64, width=4, textvariable=self.copy_workers_var).pack(side="left", padx=5)
+        ttk.Separator(perf_frame, orient='horizontal').pack(fill='x', pady=10)
+        hash_frame = tk.Frame(perf_frame); hash_frame.pack(anchor="w")
+        tk.Label(hash_frame, text="Алгоритм хеширования:").pack(side="left")
+        ttk.Combobox(hash_frame, textvariable=self.hash_algorithm_var, values=list(sync_logic.HASH_ALGORITHMS), state="readonly", width=10).pack(side="left", padx=5)
+        tk.Checkbutton(perf_frame, text="Хешировать в отдельных процессах\n(параллельное сканирование на всех ядрах ЦП)", variable=self.hash_processes_var, justify="left").pack(anchor="w")
+        tree_frame = tk.Frame(perf_frame); tree_frame.pack(anchor="w", pady=(5, 0))
+        tk.Label(tree_frame, text="Блок древовидного хеша, МБ (0 — выключен):").pack(side="left")
+        tk.Spinbox(tree_frame, from_=0, to=4096, width=5, textvariable=self.tree_hash_chunk_var).pack(side="left", padx=5)
+        delta_frame = tk.Frame(perf_frame); delta_frame.pack(anchor="w", pady=(5, 0))
+        tk.Label(delta_frame, text="Блочная дельта для файлов от, МБ (0 — выключена):").pack(side="left")
+        tk.Spinbox(delta_frame, from_=0, to=1048576, width=7, textvariable=self.delta_min_var).pack(side="left", padx=5)
+        ttk.Separator(perf_frame, orient='horizontal').pack(fill='x', pady=10)
+        tk.Label(perf_frame, text="Ограничение скорости (пусто — без ограничения):").pack(anchor="w")
+        tk.Entry(perf_frame, textvariable=self.throttle_var, width=50).pack(anchor="w", fill="x")
+        tk.Label(perf_frame, text="read=МБ/с write=МБ/с ops=операций/с; по времени суток — правила через ';',\nнапример: 08:00-20:00 read=20 write=20; read=200", fg="grey", justify="left").pack(anchor="w")
+
+        log_frame = tk.Frame(self.notebook, padx=10, pady=10)
+        self.notebook.add(log_frame, text='Журнал')
+        self.log_level_var = tk.StringVar(value=self.config.get('logging', 'level', fallback=sync_logic.DEFAULT_LOG_LEVEL))
+        self.log_max_mb_var = tk.IntVar(value=self.config.getint('logging', 'max_mb', fallback=sync_logic.LOG_MAX_MB))
+        self.log_backups_var = tk.IntVar(value=self.config.getint('logging', 'backup_count', fallback=sync_logic.LOG_BACKUP_COUNT))
+        tk.Label(log_frame, text="Подробность лога:").pack(anchor="w")
+        for value, text in (('errors', "Только предупреждения и ошибки"), ('summary', "Итоги сеанса без строк по файлам"),
+                            ('files', "Каждая операция с файлом"), ('trace', "Подробно (вдобавок исключения по шаблонам)")):
+            ttk.Radiobutton(log_frame, text=text, variable=self.log_level_var, value=value).pack(anchor="w", padx=10)
+        ttk.Separator(log_frame, orient='horizontal').pack(fill='x', pady=10)
+        rotate_frame = tk.Frame(log_frame); rotate_frame.pack(anchor="w")
+        tk.Label(rotate_frame, text="Размер файла лога до ротации, МБ:").pack(side="left")
+        tk.Spinbox(rotate_frame, from_=1, to=10240, width=6, textvariable=self.log_max_mb_var).pack(side="left", padx=5)
+        backups_frame = tk.Frame(log_frame); backups_frame.pack(anchor="w", pady=(5, 0))
+        tk.Label(backups_frame, text="Хранить старых файлов лога:").pack(side="left")
+        tk.Spinbox(backups_frame, from_=0, to=100, width=4, textvariable=self.log_backups_var).pack(side="left", padx=5)
+        tk.Label(log_frame, text="Размер и число файлов применяются после перезапуска.", fg="grey").pack(anchor="w", pady=(5, 0))
 
         btn_frame = tk.Frame(self)
         btn_frame.pack(pady=5)
@@ -68,6 +126,8 @@ class SettingsWindow(Toplevel):
         tk.Button(btn_frame, text="Отмена", command=self.destroy).pack(side="left", padx=5)
 
     def save_settings(self):
+        try: sync_logic.parse_throttle(self.throttle_var.get())
+        except ValueError as e: messagebox.showerror("Ошибка", str(e), parent=self); return
         if not self.config.has_section('telegram'): self.config.add_section('telegram')
         self.config.set('telegram', 'bot_token', self.token_var.get())
         self.config.set('telegram', 'chat_id', self.chat_id_var.get())
@@ -75,8 +135,28 @@ class SettingsWindow(Toplevel):
         if not self.config.has_section('performance'): self.config.add_section('performance')
         self.config.set('performance', 'comparison_mode', self.comparison_mode_var.get())
         self.config.set('performance', 'use_parallel', str(self.use_parallel_var.get()))
+        self.config.set('performance', 'use_hash_index', str(self.use_hash_index_var.get()))
+        self.config.set('performance', 'use_manifest', str(self.use_manifest_var.get()))
+        self.config.set('performance', 'streaming', str(self.streaming_var.get()))
+        self.config.set('performance', 'auto_tune', str(self.auto_tune_var.get()))
+        try: self.config.set('performance', 'copy_workers', str(max(1, self.copy_workers_var.get())))
+        except tk.TclError: self.config.set('performance', 'copy_workers', '1')
+        self.config.set('performance', 'hash_algorithm', self.hash_algorithm_var.get())
+        self.config.set('performance', 'hash_backend', 'process' if self.hash_processes_var.get() else 'thread')
+        try: self.config.set('performance', 'tree_hash_chunk_mb', str(max(0, self.tree_hash_chunk_var.get())))
+        except tk.TclError: self.config.set('performance', 'tree_hash_chunk_mb', '0')
+        try: self.config.set('performance', 'delta_min_mb', str(max(0, self.delta_min_var.get())))
+        except tk.TclError: self.config.set('performance', 'delta_min_mb', '0')
+        self.config.set('performance', 'throttle', self.throttle_var.get().strip())
+        if not self.config.has_section('logging'): self.config.add_section('logging')
+        self.config.set('logging', 'level', self.log_level_var.get())
+        try: self.config.set('logging', 'max_mb', str(max(1, self.log_max_mb_var.get())))
+        except tk.TclError: self.config.set('logging', 'max_mb', str(sync_logic.LOG_MAX_MB))
+        try: self.config.set('logging', 'backup_count', str(max(0, self.log_backups_var.get())))
+        except tk.TclError: self.config.set('logging', 'backup_count', str(sync_logic.LOG_BACKUP_COUNT))
         with open(sync_logic.CONFIG_FILE, 'w', encoding='utf-8') as configfile:
             self.config.write(configfile)
+        sync_logic.set_log_verbosity(self.log_level_var.get())
         messagebox.showinfo("Сохранено", "Настройки успешно сохранены.", parent=self)
         self.destroy()
 
@@ -118,6 +198,25 @@ class AboutWindow(Toplevel):
         close_button = tk.Button(self, text="Закрыть", command=self.destroy)
         close_button.pack(pady=(0, 15))
 
+class MetricsWindow(Toplevel):
+    """Сводка метрик сеанса: этапы, объемы данных, кеш хешей и самые медленные файлы."""
+    def __init__(self, master, report, metrics_file=None):
+        super().__init__(master)
+        self.transient(master)
+        self.title("Отчет о синхронизации")
+        self.geometry("600x420")
+
+        stats = report.get('stats') or {}
+        header = (f"Источник: {report.get('source')}\nНазначение: {report.get('destination')}\n"
+                  f"Начало: {report['started']}, длительность: {report['duration_seconds']:.1f} с\n"
+                  f"Скопировано: {stats.get('copied', 0)}, обновлено: {stats.get('updated', 0)}, перемещено: {stats.get('moved', 0)}, "
+                  f"удалено: {stats.get('deleted', 0) + stats.get('trashed', 0)}, ошибок: {stats.get('errors', 0)}\n")
+        text = scrolledtext.ScrolledText(self, wrap=tk.NONE, height=15)
+        text.pack(fill="both", expand=True, padx=10, pady=(10, 5))
+        text.insert(tk.END, header + "\n" + sync_logic.format_metrics_summary(report) + (f"\n\nПолный отчет: {os.path.abspath(metrics_file)}" if metrics_file else ""))
+        text.configure(state='disabled')
+        tk.Button(self, text="Закрыть", command=self.destroy).pack(pady=(0, 10))
+
 class SyncApp:
     def __init__(self, master):
         self.master = master
@@ -137,6 +236,7 @@ class SyncApp:
         self.no_overwrite_var = tk.BooleanVar()
         self.delete_removed_var = tk.BooleanVar()
         self.sync_empty_dirs_var = tk.BooleanVar()
+        self.detect_moves_var = tk.BooleanVar(value=True)
         self.exclude_patterns_var = tk.StringVar()
         self.source_is_network_var = tk.BooleanVar()
         self.dest_is_network_var = tk.BooleanVar()
@@ -148,9 +248,16 @@ class SyncApp:
         self.dest_show_pass_var = tk.BooleanVar()
         self.save_passwords_var = tk.BooleanVar()
         self.use_staging_var = tk.BooleanVar(value=True)
+        self.verify_copies_var = tk.StringVar(value='none')
         self.use_trash_var = tk.BooleanVar(value=True)
         self.status_text_var = tk.StringVar()
+        self.log_filter_var = tk.StringVar()
+        self.log_problems_var = tk.BooleanVar(value=False)
         self.stop_event = None
+        self.last_report = None
+        self.log_lines = collections.deque(maxlen=LOG_VIEW_LINES)
+        self.log_filter = None
+        self.log_search_id = 0
 
     def _create_widgets(self):
         self.main_frame = tk.Frame(self.master)
@@ -189,9 +296,14 @@ class SyncApp:
         tk.Checkbutton(options_frame, text="Не перезаписывать измененные файлы", variable=self.no_overwrite_var).pack(anchor="w")
         tk.Checkbutton(options_frame, text="Удалять лишние файлы в назначении", variable=self.delete_removed_var).pack(anchor="w")
         tk.Checkbutton(options_frame, text="Синхронизировать пустые папки", variable=self.sync_empty_dirs_var).pack(anchor="w")
+        tk.Checkbutton(options_frame, text="Распознавать перемещенные файлы (переименовывать вместо копирования)", variable=self.detect_moves_var).pack(anchor="w")
         ttk.Separator(options_frame, orient='horizontal').pack(fill='x', pady=5)
         tk.Checkbutton(options_frame, text="Использовать безопасное удаление (в корзину)", variable=self.use_trash_var).pack(anchor="w")
         tk.Checkbutton(options_frame, text="Использовать транзакционное копирование (надежнее)", variable=self.use_staging_var).pack(anchor="w")
+        verify_frame = tk.Frame(options_frame); verify_frame.pack(anchor="w")
+        tk.Label(verify_frame, text="Проверка копий:").pack(side="left")
+        ttk.Combobox(verify_frame, textvariable=self.verify_copies_var, values=('none', 'trust', 'reread'), state="readonly", width=8).pack(side="left", padx=5)
+        tk.Label(verify_frame, text="(trust — хеш при копировании, reread — перечитать копию с диска)").pack(side="left")
         
         exclude_frame = tk.LabelFrame(self.main_frame, text="Исключения", padx=10, pady=10)
         exclude_frame.grid(row=2, column=0, sticky="ew", pady=5)
@@ -211,10 +323,18 @@ class SyncApp:
 
         self.log_frame = tk.LabelFrame(self.main_frame, text="Лог выполнения", padx=10, pady=10)
         self.log_frame.grid(row=5, column=0, sticky="nsew")
-        self.log_frame.rowconfigure(0, weight=1)
+        self.log_frame.rowconfigure(1, weight=1)
         self.log_frame.columnconfigure(0, weight=1)
+        filter_frame = tk.Frame(self.log_frame); filter_frame.grid(row=0, column=0, sticky="ew", pady=(0, 5))
+        tk.Label(filter_frame, text="Поиск в файле лога:").pack(side="left")
+        filter_entry = tk.Entry(filter_frame, textvariable=self.log_filter_var)
+        filter_entry.pack(side="left", fill="x", expand=True, padx=5)
+        filter_entry.bind("<Return>", lambda event: self.apply_log_filter())
+        tk.Checkbutton(filter_frame, text="Только предупреждения и ошибки", variable=self.log_problems_var, command=self.apply_log_filter).pack(side="left")
+        tk.Button(filter_frame, text="Найти", command=self.apply_log_filter).pack(side="left", padx=(5, 0))
+        tk.Button(filter_frame, text="Сброс", command=self.reset_log_filter).pack(side="left", padx=(5, 0))
         self.log_area = scrolledtext.ScrolledText(self.log_frame, state='disabled', wrap=tk.WORD, bg="#2b2b2b", fg="#a9b7c6")
-        self.log_area.grid(row=0, column=0, sticky="nsew")
+        self.log_area.grid(row=1, column=0, sticky="nsew")
 
     def _setup_background_tasks(self):
         self.create_menu()
@@ -222,7 +342,7 @@ class SyncApp:
         self._load_state()
         self.log_queue = queue.Queue()
         sync_logic.setup_logging(QueueHandler(self.log_queue))
-        self.master.after(100, self.poll_log_queue)
+        self.master.after(LOG_POLL_MS, self.poll_log_queue)
 
     def create_menu(self):
         menubar = tk.Menu(self.master); self.master.config(menu=menubar)
@@ -231,6 +351,8 @@ class SyncApp:
         file_menu.add_command(label="Экспорт задачи...", command=self.export_job_file)
         file_menu.add_separator()
         file_menu.add_command(label="Настройки", command=self.open_settings)
+        file_menu.add_command(label="Отчет о последней синхронизации", command=self.show_last_report)
+        file_menu.add_command(label="Проверить назначение по манифесту", command=self.start_verify_thread)
         file_menu.add_separator()
         file_menu.add_command(label="Выход", command=self.on_closing)
         menubar.add_cascade(label="Файл", menu=file_menu)
@@ -254,6 +376,7 @@ class SyncApp:
             if 'SyncJob' not in job_config: raise configparser.NoSectionError('SyncJob')
             job = job_config['SyncJob']; self.source_var.set(job.get('source', '')); self.dest_var.set(job.get('destination', '')); self.no_overwrite_var.set(job.getboolean('no_overwrite', False)); self.delete_removed_var.set(job.getboolean('delete_removed', False)); self.sync_empty_dirs_var.set(job.getboolean('sync_empty_dirs', False)); self.exclude_patterns_var.set(job.get('exclude', ''))
             self.use_staging_var.set(job.getboolean('use_staging', fallback=True)); self.use_trash_var.set(job.getboolean('use_trash', fallback=True))
+            self.verify_copies_var.set(job.get('verify_copies', fallback='none')); self.detect_moves_var.set(job.getboolean('detect_moves', fallback=True))
             if 'SourceNetCreds' in job_config: self.source_is_network_var.set(True); s_creds = job_config['SourceNetCreds']; self.source_user_var.set(s_creds.get('user', '')); self.source_pass_var.set(s_creds.get('password', ''))
             else: self.source_is_network_var.set(False)
             if 'DestNetCreds' in job_config: self.dest_is_network_var.set(True); d_creds = job_config['DestNetCreds']; self.dest_user_var.set(d_creds.get('user', '')); self.dest_pass_var.set(d_creds.get('password', ''))
@@ -267,8 +390,20 @@ class SyncApp:
         job_config = configparser.ConfigParser(); job_config.add_section('SyncJob')
         job_config.set('SyncJob', 'source', self.source_var.get()); job_config.set('SyncJob', 'destination', self.dest_var.get()); job_config.set('SyncJob', 'no_overwrite', str(self.no_overwrite_var.get()).lower()); job_config.set('SyncJob', 'delete_removed', str(self.delete_removed_var.get()).lower()); job_config.set('SyncJob', 'sync_empty_dirs', str(self.sync_empty_dirs_var.get()).lower()); job_config.set('SyncJob', 'exclude', self.exclude_patterns_var.get())
         job_config.set('SyncJob', 'use_staging', str(self.use_staging_var.get()).lower()); job_config.set('SyncJob', 'use_trash', str(self.use_trash_var.get()).lower())
+        job_config.set('SyncJob', 'verify_copies', self.verify_copies_var.get()); job_config.set('SyncJob', 'detect_moves', str(self.detect_moves_var.get()).lower())
         config = configparser.ConfigParser(); config.read(sync_logic.CONFIG_FILE)
         job_config.set('SyncJob', 'comparison_mode', config.get('performance', 'comparison_mode', fallback='accurate')); job_config.set('SyncJob', 'use_parallel', config.get('performance', 'use_parallel', fallback='false'))
+        job_config.set('SyncJob', 'use_hash_index', config.get('performance', 'use_hash_index', fallback='true').lower())
+        job_config.set('SyncJob', 'copy_workers', config.get('performance', 'copy_workers', fallback='1'))
+        job_config.set('SyncJob', 'streaming', config.get('performance', 'streaming', fallback='false').lower())
+        job_config.set('SyncJob', 'hash_algorithm', config.get('performance', 'hash_algorithm', fallback=sync_logic.DEFAULT_HASH_ALGORITHM))
+        job_config.set('SyncJob', 'hash_backend', config.get('performance', 'hash_backend', fallback='thread'))
+        job_config.set('SyncJob', 'tree_hash_chunk_mb', config.get('performance', 'tree_hash_chunk_mb', fallback='0'))
+        job_config.set('SyncJob', 'auto_tune', config.get('performance', 'auto_tune', fallback='true').lower())
+        job_config.set('SyncJob', 'metrics_file', config.get('performance', 'metrics_file', fallback=sync_logic.METRICS_FILE))
+        job_config.set('SyncJob', 'delta_min_mb', config.get('performance', 'delta_min_mb', fallback='0'))
+        job_config.set('SyncJob', 'use_manifest', config.get('performance', 'use_manifest', fallback='true').lower())
+        job_config.set('SyncJob', 'throttle', config.get('performance', 'throttle', fallback=''))
         if self.source_is_network_var.get() and self.source_user_var.get(): job_config.add_section('SourceNetCreds'); job_config.set('SourceNetCreds', 'user', self.source_user_var.get()); job_config.set('SourceNetCreds', 'password', self.source_pass_var.get())
         if self.dest_is_network_var.get() and self.dest_user_var.get(): job_config.add_section('DestNetCreds'); job_config.set('DestNetCreds', 'user', self.dest_user_var.get()); job_config.set('DestNetCreds', 'password', self.dest_pass_var.get())
         try:
@@ -304,6 +439,7 @@ class SyncApp:
                 self.source_is_network_var.set(state.getboolean('source_is_network', fallback=False)); self.dest_is_network_var.set(state.getboolean('dest_is_network', fallback=False))
                 self.save_passwords_var.set(state.getboolean('save_passwords', fallback=False))
                 self.use_staging_var.set(state.getboolean('use_staging', fallback=True)); self.use_trash_var.set(state.getboolean('use_trash', fallback=True))
+                self.verify_copies_var.set(state.get('verify_copies', fallback='none')); self.detect_moves_var.set(state.getboolean('detect_moves', fallback=True))
                 if self.save_passwords_var.get():
                     try:
                         self.source_user_var.set(base64.b64decode(state.get('s_user', '')).decode('utf-8')); self.source_pass_var.set(base64.b64decode(state.get('s_pass', '')).decode('utf-8'))
@@ -317,7 +453,8 @@ class SyncApp:
             'last_source': self.source_var.get(), 'last_destination': self.dest_var.get(),
             'last_exclusions': self.exclude_patterns_var.get(), 'sync_empty_dirs': str(self.sync_empty_dirs_var.get()),
             'source_is_network': str(self.source_is_network_var.get()), 'dest_is_network': str(self.dest_is_network_var.get()),
-            'save_passwords': str(self.save_passwords_var.get()), 'use_staging': str(self.use_staging_var.get()), 'use_trash': str(self.use_trash_var.get())}
+            'save_passwords': str(self.save_passwords_var.get()), 'use_staging': str(self.use_staging_var.get()), 'use_trash': str(self.use_trash_var.get()),
+            'verify_copies': self.verify_copies_var.get(), 'detect_moves': str(self.detect_moves_var.get())}
         if self.save_passwords_var.get():
             state = config['State']
             state['s_user'] = base64.b64encode(self.source_user_var.get().encode('utf-8')).decode('utf-8'); state['s_pass'] = base64.b64encode(self.source_pass_var.get().encode('utf-8')).decode('utf-8')
@@ -342,6 +479,17 @@ class SyncApp:
         config = configparser.ConfigParser(); config.read(sync_logic.CONFIG_FILE)
         comparison_mode = config.get('performance', 'comparison_mode', fallback='accurate')
         use_parallel = config.getboolean('performance', 'use_parallel', fallback=False)
+        use_hash_index = config.getboolean('performance', 'use_hash_index', fallback=True)
+        copy_workers = config.getint('performance', 'copy_workers', fallback=1)
+        streaming = config.getboolean('performance', 'streaming', fallback=False)
+        hash_algorithm = config.get('performance', 'hash_algorithm', fallback=sync_logic.DEFAULT_HASH_ALGORITHM)
+        hash_backend = config.get('performance', 'hash_backend', fallback='thread')
+        tree_hash_chunk_mb = config.getint('performance', 'tree_hash_chunk_mb', fallback=0)
+        auto_tune = config.getboolean('performance', 'auto_tune', fallback=True)
+        metrics_file = config.get('performance', 'metrics_file', fallback=sync_logic.METRICS_FILE)
+        delta_min_mb = config.getint('performance', 'delta_min_mb', fallback=0)
+        use_manifest = config.getboolean('performance', 'use_manifest', fallback=True)
+        throttle = config.get('performance', 'throttle', fallback='')
         
         self.stop_event = threading.Event()
         self.sync_button.config(text="Остановить", command=self.stop_sync_thread, bg="#e74c3c")
@@ -351,17 +499,49 @@ class SyncApp:
         thread_args = (
             source, dest, self.no_overwrite_var.get(), self.delete_removed_var.get(), self.sync_empty_dirs_var.get(),
             exclude_list, source_creds, dest_creds, self.stop_event, comparison_mode, use_parallel,
-            self.use_staging_var.get(), self.use_trash_var.get(), progress_callback
+            self.use_staging_var.get(), self.use_trash_var.get(), progress_callback, use_hash_index, copy_workers, self.verify_copies_var.get(), self.detect_moves_var.get(), streaming,
+            hash_algorithm, hash_backend, tree_hash_chunk_mb, auto_tune, metrics_file, delta_min_mb, use_manifest, throttle
         )
         threading.Thread(target=self.run_sync_task, args=thread_args, daemon=True).start()
     
+    def start_verify_thread(self):
+        dest = self.dest_var.get()
+        if not dest: messagebox.showerror("Ошибка", "Необходимо указать целевую директорию."); return
+        if self.stop_event: messagebox.showwarning("Проверка", "Дождитесь завершения синхронизации."); return
+        dest_creds = {'user': self.dest_user_var.get(), 'password': self.dest_pass_var.get()} if self.dest_is_network_var.get() and self.dest_user_var.get() else None
+        config = configparser.ConfigParser(); config.read(sync_logic.CONFIG_FILE)
+        hash_backend = config.get('performance', 'hash_backend', fallback='thread'); auto_tune = config.getboolean('performance', 'auto_tune', fallback=True)
+        throttle = config.get('performance', 'throttle', fallback='')
+        self.progress_frame.grid(row=4, column=0, sticky="ew", pady=(5,0))
+        self.update_progress('overall', 0, 1, "Проверка назначения...")
+        self.stop_event = threading.Event()
+        self.sync_button.config(text="Остановить", command=self.stop_sync_thread, bg="#e74c3c")
+        progress_callback = lambda *args: self.log_queue.put(('progress', args))
+        threading.Thread(target=self.run_verify_task, args=(dest, dest_creds, hash_backend, auto_tune, progress_callback, self.stop_event, throttle), daemon=True).start()
+
+    def run_verify_task(self, dest, dest_creds, hash_backend, auto_tune, progress_callback, stop_event, throttle):
+        try:
+            results = sync_logic.verify_destination(dest, dest_creds, hash_backend, auto_tune, progress_callback, stop_event, throttle)
+            problems = results['corrupted'] + results['modified'] + results['missing'] + results['unreadable']
+            self.log_queue.put(('progress', ('reset', 0, 0, f"Найдены расхождения: {problems}" if problems else 'Проверка пройдена')))
+            if problems: messagebox.showwarning("Проверка назначения", f"Найдены расхождения с манифестом: {problems}.\n\nПодробности в логе.")
+        except sync_logic.SyncCancelledError:
+            self.log_queue.put(('progress', ('reset', 0, 0, 'Прервано')))
+        except Exception as e:
+            self.log_queue.put(('progress', ('reset', 0, 0, 'Ошибка!')))
+            messagebox.showerror("Ошибка проверки", f"Проверка назначения не удалась:\n\n{e}\n\nПодробности в логе.")
+        finally:
+            self.progress_frame.grid_remove()
+            self.sync_button.config(state="normal", text="Начать синхронизацию", command=self.start_sync_thread, bg="#4CAF50")
+            self.stop_event = None
+
     def stop_sync_thread(self):
         if self.stop_event: logging.info("Подан сигнал на остановку синхронизации..."); self.stop_event.set(); self.sync_button.config(state="disabled", text="Остановка...")
     
-    def run_sync_task(self, source, dest, no_overwrite, delete_removed, sync_empty_dirs, exclude_patterns, source_creds, dest_creds, stop_event, comparison_mode, use_parallel, use_staging, use_trash, progress_callback):
+    def run_sync_task(self, source, dest, no_overwrite, delete_removed, sync_empty_dirs, exclude_patterns, source_creds, dest_creds, stop_event, comparison_mode, use_parallel, use_staging, use_trash, progress_callback, use_hash_index, copy_workers, verify_copies, detect_moves, streaming, hash_algorithm, hash_backend, tree_hash_chunk_mb, auto_tune, metrics_file, delta_min_mb, use_manifest, throttle):
         try:
-            sync_logic.run_sync_session(source, dest, no_overwrite, delete_removed, sync_empty_dirs, exclude_patterns, source_creds, dest_creds, stop_event, comparison_mode, use_parallel, use_staging, use_trash, progress_callback)
-            self.log_queue.put(('progress', ('reset', 0, 0, 'Готово!')))
+            report = sync_logic.run_sync_session(source, dest, no_overwrite, delete_removed, sync_empty_dirs, exclude_patterns, source_creds, dest_creds, stop_event, comparison_mode, use_parallel, use_staging, use_trash, progress_callback, use_hash_index, copy_workers, verify_copies, detect_moves, streaming, hash_algorithm, hash_backend, tree_hash_chunk_mb, auto_tune, metrics_file, delta_min_mb, use_manifest, throttle=throttle)
+            self.log_queue.put(('progress', ('reset', 0, 0, 'Готово!'))); self.log_queue.put(('metrics', (report, metrics_file)))
         except sync_logic.SyncCancelledError as e:
             self.log_queue.put(('progress', ('reset', 0, 0, 'Прервано')))
             logging.warning(f"Процесс синхронизации был корректно остановлен: {e}")
@@ -383,22 +563,78 @@ class SyncApp:
 
     def open_settings(self): SettingsWindow(self.master)
     def show_about(self): AboutWindow(self.master)
+    def show_last_report(self):
+        if self.last_report: MetricsWindow(self.master, *self.last_report)
+        else: messagebox.showinfo("Отчет", "В этом запуске программы синхронизация еще не выполнялась.")
     def browse_source(self): self.source_var.set(filedialog.askdirectory() or self.source_var.get())
     def browse_dest(self): self.dest_var.set(filedialog.askdirectory() or self.dest_var.get())
     
     def poll_log_queue(self):
-        while True:
-            try:
-                message = self.log_queue.get(block=False)
-                if isinstance(message, tuple) and message[0] == 'progress': _, args = message; self.update_progress(*args)
-                else: self.display_log(message)
+        # За тик: новые строки копятся в кольцевом буфере и вставляются одним вызовом, из событий прогресса применяется последнее.
+        new_lines = collections.deque(maxlen=LOG_VIEW_LINES); progress = None
+        for _ in range(LOG_POLL_BATCH):
+            try: message = self.log_queue.get(block=False)
             except queue.Empty: break
-        self.master.after(100, self.poll_log_queue)
+            if isinstance(message, tuple) and message[0] == 'progress': progress = message[1]
+            elif isinstance(message, tuple) and message[0] == 'metrics': _, self.last_report = message; MetricsWindow(self.master, *self.last_report)
+            elif isinstance(message, tuple) and message[0] == 'search': self.show_log_search(*message[1])
+            else: new_lines.append(message)
+        if new_lines:
+            self.log_lines.extend(new_lines)
+            self.append_log_lines([line for line in new_lines if self.log_filter is None or self.log_line_matches(line, *self.log_filter)])
+        if progress: self.update_progress(*progress)
+        self.master.after(LOG_POLL_MS, self.poll_log_queue)
+
+    def append_log_lines(self, lines):
+        if not lines: return
+        at_end = self.log_area.yview()[1] >= 1.0
+        self.log_area.configure(state='normal'); self.log_area.insert(tk.END, "\n".join(lines) + "\n")
+        excess = int(self.log_area.index('end-1c').split('.')[0]) - 1 - LOG_VIEW_LINES
+        if excess > 0: self.log_area.delete('1.0', f'{excess + 1}.0')
+        self.log_area.configure(state='disabled')
+        if at_end: self.log_area.yview(tk.END)
+
+    def set_log_text(self, lines):
+        self.log_area.configure(state='normal'); self.log_area.delete('1.0', tk.END)
+        self.log_area.configure(state='disabled'); self.append_log_lines(list(lines)); self.log_area.yview(tk.END)
+
+    @staticmethod
+    def log_line_matches(line, text, problems_only):
+        return (not text or text in line.lower()) and (not problems_only or any(marker in line for marker in LOG_PROBLEM_MARKERS))
+
+    def apply_log_filter(self):
+        text = self.log_filter_var.get().strip().lower(); problems_only = self.log_problems_var.get()
+        if not text and not problems_only: self.reset_log_filter(); return
+        self.log_filter = (text, problems_only); self.log_search_id += 1
+        self.set_log_text([f"Поиск в {sync_logic.LOG_FILE}..."])
+        threading.Thread(target=self.search_log_files, args=(self.log_search_id, text, problems_only), daemon=True).start()
+
+    def reset_log_filter(self):
+        self.log_filter = None; self.log_search_id += 1
+        self.log_filter_var.set(''); self.log_problems_var.set(False); self.set_log_text(self.log_lines)
+
+    def search_log_files(self, search_id, text, problems_only):
+        """Ищет строки в файле лога и его ротированных копиях (от старых к новым), оставляя последние LOG_VIEW_LINES совпадений."""
+        log_dir = os.path.dirname(os.path.abspath(sync_logic.LOG_FILE)); prefix = os.path.basename(sync_logic.LOG_FILE) + '.'
+        try: backups = sorted((name for name in os.listdir(log_dir) if name.startswith(prefix) and name[len(prefix):].isdigit()), key=lambda name: -int(name[len(prefix):]))
+        except OSError: backups = []
+        matches = collections.deque(maxlen=LOG_VIEW_LINES); total = 0
+        for path in [os.path.join(log_dir, name) for name in backups] + [sync_logic.LOG_FILE]:
+            try:
+                with open(path, 'r', encoding='utf-8', errors='replace') as f:
+                    for line in f:
+                        if self.log_line_matches(line, text, problems_only): matches.append(line.rstrip('\n')); total += 1
+            except OSError: continue
+        self.log_queue.put(('search', (search_id, list(matches), total)))
 
-    def display_log(self, record):
-        self.log_area.configure(state='normal'); self.log_area.insert(tk.END, record + '\n'); self.log_area.configure(state='disabled'); self.log_area.yview(tk.END)
+    def show_log_search(self, search_id, matches, total):
+        if search_id != self.log_search_id: return
+        status = f"--- Найдено строк: {total}" + (f", показаны последние {len(matches)}" if total > len(matches) else "") + " ---"
+        self.set_log_text(matches + [status])
 
 if __name__ == "__main__":
+    # Процессный пул хеширования в собранном .exe запускает дочерние процессы через этот же файл.
+    multiprocessing.freeze_support()
     root = tk.Tk()
     try:
         if getattr(sys, 'frozen', False): base_path = sys._MEIPASS
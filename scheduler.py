@@ -0,0 +1,221 @@
+import os
+import re
+import json
+import time
+import logging
+import threading
+import configparser
+import concurrent.futures
+from pathlib import Path
+from datetime import datetime
+import sync_logic
+import fanout
+
+# --- Константы ---
+BATCH_MAX_JOBS = 2
+# Сколько задач одновременно работают с одним томом (диском или сетевым ресурсом); 1 — задачи одного тома идут по очереди.
+BATCH_PER_VOLUME = 1
+BATCH_POLL_SECONDS = 0.5
+JOB_FILE_PATTERN = '*.ini'
+# Параметры задачи, которые передаются в run_sync_session / run_fanout_session как есть.
+SESSION_KEYS = ('no_overwrite', 'delete_removed', 'sync_empty_dirs', 'exclude_patterns', 'source_creds', 'comparison_mode', 'use_parallel', 'use_staging', 'use_trash',
+                'use_hash_index', 'copy_workers', 'verify_copies', 'detect_moves_enabled', 'hash_algorithm', 'hash_backend', 'tree_hash_chunk_mb', 'auto_tune',
+                'metrics_file', 'delta_min_mb', 'use_manifest', 'throttle')
+
+# --- Файлы задач ---
+def read_job(path, defaults):
+    """Читает файл задачи ([SyncJob] и секции учетных данных) в словарь параметров.
+    Ключи, которых нет в файле, берутся из defaults (параметров командной строки)."""
+    config = configparser.ConfigParser()
+    if not config.read(path, encoding='utf-8'): raise FileNotFoundError(f"Файл задачи не найден: {path}")
+    job = config['SyncJob']
+    destination = job.get('destination')
+    # Несколько назначений: ключ destinations, по одному пути в строке (destination, если задан, идет первым).
+    destinations = ([destination] if destination else []) + [d.strip() for d in job.get('destinations', '').splitlines() if d.strip()]
+    if not job.get('source') or not destinations: raise KeyError("не заданы source и destination (или destinations)")
+    exclude_str = job.get('exclude', '')
+    dest_creds = dict(config.items('DestNetCreds')) if config.has_section('DestNetCreds') else None
+    throttle = job.get('throttle', fallback=defaults['throttle']).strip()
+    sync_logic.parse_throttle(throttle)  # ошибка в расписании — ValueError при чтении задачи, а не посреди сеанса
+    return {
+        'name': Path(path).stem, 'path': str(path), 'priority': job.getint('priority', fallback=defaults['priority']),
+        'source': job.get('source'), 'destinations': destinations,
+        'no_overwrite': job.getboolean('no_overwrite', fallback=defaults['no_overwrite']),
+        'delete_removed': job.getboolean('delete_removed', fallback=defaults['delete_removed']),
+        'sync_empty_dirs': job.getboolean('sync_empty_dirs', fallback=defaults['sync_empty_dirs']),
+        'detect_moves_enabled': job.getboolean('detect_moves', fallback=defaults['detect_moves_enabled']),
+        'exclude_patterns': [p.strip() for p in exclude_str.split(',') if p.strip()] if exclude_str else (defaults['exclude_patterns'] or []),
+        'comparison_mode': job.get('comparison_mode', fallback=defaults['comparison_mode']),
+        'use_parallel': job.getboolean('use_parallel', fallback=defaults['use_parallel']),
+        'use_staging': job.getboolean('use_staging', fallback=defaults['use_staging']),
+        'use_trash': job.getboolean('use_trash', fallback=defaults['use_trash']),
+        'use_hash_index': job.getboolean('use_hash_index', fallback=defaults['use_hash_index']),
+        'use_manifest': job.getboolean('use_manifest', fallback=defaults['use_manifest']),
+        'copy_workers': job.getint('copy_workers', fallback=defaults['copy_workers']),
+        'verify_copies': job.get('verify_copies', fallback=defaults['verify_copies']),
+        'streaming': job.getboolean('streaming', fallback=defaults['streaming']),
+        'hash_algorithm': job.get('hash_algorithm', fallback=defaults['hash_algorithm']),
+        'hash_backend': job.get('hash_backend', fallback=defaults['hash_backend']),
+        'tree_hash_chunk_mb': job.getint('tree_hash_chunk_mb', fallback=defaults['tree_hash_chunk_mb']),
+        'delta_min_mb': job.getint('delta_min_mb', fallback=defaults['delta_min_mb']),
+        'auto_tune': job.getboolean('auto_tune', fallback=defaults['auto_tune']),
+        'watch': job.getboolean('watch', fallback=defaults['watch']),
+        'watch_debounce': job.getfloat('watch_debounce', fallback=defaults['watch_debounce']),
+        'metrics_file': job.get('metrics_file', fallback=defaults['metrics_file']), 'throttle': throttle,
+        'source_creds': dict(config.items('SourceNetCreds')) if config.has_section('SourceNetCreds') else None,
+        # Учетные данные остальных назначений — в секциях DestNetCreds2, DestNetCreds3 и т.д.
+        'dest_creds': [dest_creds] + [dict(config.items(f'DestNetCreds{n}')) if config.has_section(f'DestNetCreds{n}') else None for n in range(2, len(destinations) + 1)],
+    }
+
+def run_job(job, stop_event=None, notify=True, progress_callback=None):
+    """Полный сеанс задачи: одно назначение — run_sync_session, несколько — раздача. Возвращает отчет сеанса."""
+    session = {key: job[key] for key in SESSION_KEYS}
+    if len(job['destinations']) > 1:
+        return fanout.run_fanout_session(job['source'], job['destinations'], dest_creds=job['dest_creds'], stop_event=stop_event, progress_callback=progress_callback, notify=notify, **session)
+    return sync_logic.run_sync_session(job['source'], job['destinations'][0], dest_creds=job['dest_creds'][0], stop_event=stop_event, progress_callback=progress_callback,
+                                       streaming=job['streaming'], notify=notify, **session)
+
+def volume_key(path):
+    """Ключ тома для лимита параллельных задач: сервер и ресурс UNC-пути, иначе устройство пути
+    (или ближайшей существующей родительской папки, если самого пути еще нет)."""
+    unc = re.match(r'^[\\/]{2}([^\\/]+)[\\/]+([^\\/]+)', path)
+    if unc: return f"//{unc.group(1)}/{unc.group(2)}".lower()
+    current = os.path.abspath(path)
+    while True:
+        try: return os.stat(current).st_dev
+        except OSError:
+            parent = os.path.dirname(current)
+            if parent == current: return current
+            current = parent
+
+# --- Планировщик ---
+class BatchEntry:
+    """Задача пакета и ее результат."""
+    def __init__(self, name, path, job=None, error=None):
+        self.name = name; self.path = path; self.job = job
+        self.priority = job['priority'] if job else 0
+        self.volumes = {volume_key(p) for p in [job['source'], *job['destinations']]} if job else set()
+        self.status = 'pending' if job else 'error'; self.error = error; self.report = None
+        self.queued = time.monotonic(); self.started = self.finished = None
+
+class BatchScheduler:
+    """Запускает задачи в общем пуле из max_jobs потоков. Задача стартует, только если ни один из ее томов
+    (источник и назначения) не занят per_volume другими задачами; из готовых к запуску первой берется
+    задача с большим приоритетом, а задачи свободных томов обгоняют ждущие."""
+    def __init__(self, entries, max_jobs=BATCH_MAX_JOBS, per_volume=BATCH_PER_VOLUME, stop_event=None):
+        self.entries = entries; self.max_jobs = max(1, int(max_jobs)); self.per_volume = max(1, int(per_volume))
+        self.stop_event = stop_event or threading.Event()
+        self.cond = threading.Condition(); self.running = 0; self.volume_use = {}
+
+    def _run(self, entry):
+        entry.started = time.monotonic()
+        logging.info(f"Пакет: запуск задачи {entry.name} (приоритет {entry.priority}, ожидание в очереди {entry.started - entry.queued:.1f} с)")
+        if entry.job['watch']: logging.warning(f"Пакет: режим наблюдения задачи {entry.name} не используется, выполняется один полный проход.")
+        try:
+            entry.report = run_job(entry.job, self.stop_event, notify=False); entry.status = entry.report.get('status', 'success')
+        except sync_logic.SyncCancelledError as e: entry.status = 'cancelled'; entry.error = str(e)
+        except Exception as e: entry.status = 'error'; entry.error = str(e)
+        finally:
+            entry.finished = time.monotonic()
+            logging.info(f"Пакет: задача {entry.name} завершена ({entry.status}) за {entry.finished - entry.started:.1f} с")
+            with self.cond:
+                self.running -= 1
+                for volume in entry.volumes: self.volume_use[volume] -= 1
+                self.cond.notify_all()
+
+    def run(self):
+        """Выполняет все задачи; Ctrl+C останавливает запущенные, а оставшиеся в очереди не запускаются."""
+        pending = sorted((entry for entry in self.entries if entry.status == 'pending'), key=lambda entry: (-entry.priority, entry.name))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_jobs, thread_name_prefix='job') as pool:
+            try:
+                with self.cond:
+                    while pending or self.running:
+                        if self.stop_event.is_set(): break
+                        for entry in list(pending):
+                            if self.running >= self.max_jobs: break
+                            if any(self.volume_use.get(volume, 0) >= self.per_volume for volume in entry.volumes): continue
+                            pending.remove(entry); self.running += 1
+                            for volume in entry.volumes: self.volume_use[volume] = self.volume_use.get(volume, 0) + 1
+                            pool.submit(self._run, entry)
+                        self.cond.wait(BATCH_POLL_SECONDS)
+            except KeyboardInterrupt:
+                logging.warning("Пакет прерван пользователем: запущенные задачи останавливаются."); self.stop_event.set()
+            for entry in pending: entry.status = 'skipped'
+        return self.entries
+
+# --- Пакетный запуск ---
+def _merge_prometheus(texts):
+    """Сводит отчеты Prometheus нескольких сеансов в один файл: описание метрики — один раз, затем все ее значения."""
+    headers = {}; samples = {}
+    for text in texts:
+        for line in text.splitlines():
+            if line.startswith('# '):
+                name = line.split()[2]; lines = headers.setdefault(name, [])
+                if line not in lines: lines.append(line)
+            elif line: samples.setdefault(line.split('{', 1)[0], []).append(line)
+    return "".join(line + "\n" for name, lines in headers.items() for line in lines + samples.get(name, []))
+
+def write_batch_report(report, report_file):
+    """Пишет общий отчет пакета в JSON и рядом .prom с метриками всех сеансов. Возвращает путь к файлу .prom."""
+    prom_file = os.path.splitext(report_file)[0] + '.prom'
+    counts = {}
+    for job in report['jobs']: counts[job['status']] = counts.get(job['status'], 0) + 1
+    batch_text = ("# HELP file_sync_batch_jobs Задачи последнего пакетного запуска по результату.\n# TYPE file_sync_batch_jobs gauge\n"
+                  + "".join(f'file_sync_batch_jobs{{result="{status}"}} {n}\n' for status, n in sorted(counts.items()))
+                  + f"# HELP file_sync_batch_duration_seconds Длительность последнего пакетного запуска.\n# TYPE file_sync_batch_duration_seconds gauge\n"
+                  + f"file_sync_batch_duration_seconds {report['duration_seconds']}\n")
+    prom_text = batch_text + _merge_prometheus(sync_logic._prometheus_text(job['report']) for job in report['jobs'] if job['report'])
+    for path, text in ((report_file, json.dumps(report, ensure_ascii=False, indent=2)), (prom_file, prom_text)):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}{sync_logic.STAGING_SUFFIX}"
+        with open(temp_path, 'w', encoding='utf-8') as f: f.write(text)
+        os.replace(temp_path, path)
+    return prom_file
+
+def run_batch(job_dir, defaults, max_jobs=BATCH_MAX_JOBS, per_volume=BATCH_PER_VOLUME, report_file=sync_logic.METRICS_FILE, stop_event=None):
+    """Пакетный запуск всех файлов задач из папки job_dir с общим лимитом параллельных задач и лимитом на том.
+    Сеансы задач не шлют собственных уведомлений: по итогам отправляется одно общее, и пишется общий отчет
+    report_file (задачи пишут свои отчеты метрик, только если metrics_file задан в файле задачи). Возвращает отчет."""
+    start_time = datetime.now(); started = time.monotonic()
+    entries = []
+    for path in sorted(Path(job_dir).glob(JOB_FILE_PATTERN)):
+        try: entries.append(BatchEntry(path.stem, str(path), read_job(path, defaults)))
+        except (configparser.Error, KeyError, FileNotFoundError, ValueError) as e:
+            logging.error(f"Ошибка чтения файла задачи '{path}': {e}"); entries.append(BatchEntry(path.stem, str(path), error=f"Ошибка чтения файла задачи: {e}"))
+    if not entries: raise FileNotFoundError(f"В папке {job_dir} нет файлов задач ({JOB_FILE_PATTERN}).")
+    logging.info("="*50); logging.info(f"Пакетный запуск задач: {job_dir}"); logging.info(f"Задач: {len(entries)}, одновременно: {max_jobs}, на один том: {per_volume}")
+    for entry in sorted(entries, key=lambda entry: (-entry.priority, entry.name)):
+        logging.info(f"Задача {entry.name}: приоритет {entry.priority}" + (f", {entry.job['source']} -> {', '.join(entry.job['destinations'])}" if entry.job else f", {entry.error}"))
+    logging.info(f"Общий отчет: {report_file or 'Нет'}"); logging.info("="*50)
+    BatchScheduler(entries, max_jobs, per_volume, stop_event).run()
+    duration = datetime.now() - start_time
+    jobs = [{'name': entry.name, 'file': entry.path, 'priority': entry.priority, 'status': entry.status, 'error': entry.error,
+             'wait_seconds': round(entry.started - entry.queued, 3) if entry.started else None,
+             'duration_seconds': round(entry.finished - entry.started, 3) if entry.started and entry.finished else None,
+             'report': entry.report} for entry in entries]
+    totals = {}
+    for job in jobs:
+        for key, value in ((job['report'] or {}).get('stats') or {}).items():
+            if isinstance(value, int): totals[key] = totals.get(key, 0) + value
+    succeeded = sum(job['status'] == 'success' for job in jobs); failed = sum(job['status'] in ('error', 'partial') for job in jobs)
+    not_finished = len(jobs) - succeeded - failed
+    status = 'success' if succeeded == len(jobs) else 'cancelled' if not failed else 'error'
+    report = {'mode': 'batch', 'job_dir': str(job_dir), 'status': status, 'started': start_time.isoformat(timespec='seconds'),
+              'finished_timestamp': round(time.time(), 3), 'duration_seconds': round(time.monotonic() - started, 3),
+              'max_jobs': max_jobs, 'per_volume': per_volume, 'stats': totals, 'jobs': jobs}
+    icon = {'success': '✅', 'cancelled': '🟡', 'error': '⚠️'}[status]
+    summary = (f"{icon} *Пакет задач завершен!*\n\n*Папка задач:* `{job_dir}`\nВремя выполнения: `{duration}`\n"
+               f"Задач: *{len(jobs)}*, успешно: *{succeeded}*, с ошибками: *{failed}*, прервано или не запущено: *{not_finished}*\n"
+               f"Всего: скопировано *{totals.get('copied', 0)}*, обновлено *{totals.get('updated', 0)}*, "
+               f"удалено *{totals.get('deleted', 0) + totals.get('trashed', 0)}*, ошибок *{totals.get('errors', 0)}*\n")
+    for job in sorted(jobs, key=lambda job: job['name']):
+        stats = (job['report'] or {}).get('stats')
+        if job['status'] in ('success', 'partial') and stats:
+            summary += (f"\n{'✅' if job['status'] == 'success' else '⚠️'} `{job['name']}`: скопировано {stats.get('copied', 0)}, обновлено {stats.get('updated', 0)}, "
+                        f"удалено {stats.get('deleted', 0) + stats.get('trashed', 0)}, ошибок {stats.get('errors', 0)} ({job['duration_seconds']:.0f} с)")
+        else: summary += f"\n{'❌' if job['status'] == 'error' else '🟡'} `{job['name']}`: {job['status']}" + (f" — `{job['error']}`" if job['error'] else "")
+    logging.info("\n" + summary.replace('*', '').replace('`', '')); sync_logic.send_telegram_notification(summary)
+    if report_file:
+        try: prom_file = write_batch_report(report, report_file); logging.info(f"Общий отчет пакета сохранен: {report_file}, {prom_file}")
+        except OSError as e: logging.error(f"Не удалось сохранить отчет пакета {report_file}: {e}")
+    return report
@@ -3,33 +3,1234 @@ import sys
 import hashlib
 import shutil
 import logging
+import logging.handlers
+import queue
+import atexit
 import configparser
 import subprocess
-import fnmatch
+import errno
+import re
+import json
+import heapq
+import bisect
+import functools
+import struct
+import sqlite3
+import threading
+import ctypes
+import time
 import concurrent.futures
+import multiprocessing
+from collections import deque
+from array import array
 from pathlib import Path
+from stat import S_ISREG
 from datetime import datetime
 import requests
+try: import fcntl
+except ImportError: fcntl = None  # Windows
+try: import xxhash
+except ImportError: xxhash = None  # необязательная зависимость: быстрые некриптографические хеши
 
 # --- Константы ---
 LOG_FILE = 'sync_log.txt'
+# Подробность лога: errors — только предупреждения и ошибки, summary — настройки и итоги сеанса без строк по файлам,
+# files — каждая операция с файлом, trace — вдобавок исключения по шаблонам.
+LOG_LEVELS = ('errors', 'summary', 'files', 'trace')
+DEFAULT_LOG_LEVEL = 'files'
+# Ротация лога по размеру: sync_log.txt, sync_log.txt.1 ... sync_log.txt.N.
+LOG_MAX_MB = 10
+LOG_BACKUP_COUNT = 5
 CONFIG_FILE = 'config.ini'
-HASH_ALGORITHM = hashlib.sha256
-READ_BUFFER_SIZE = 65536
+HASH_INDEX_FILE = 'hash_index.db'
+# Отчет о последнем сеансе (JSON); рядом пишется файл .prom для textfile-коллектора Prometheus.
+METRICS_FILE = 'sync_metrics.json'
+# Доступные алгоритмы хеширования; xxhash добавляется, только если пакет установлен.
+HASH_ALGORITHMS = {'sha256': hashlib.sha256, 'blake2b': hashlib.blake2b}
+if xxhash: HASH_ALGORITHMS.update({'xxh3_128': xxhash.xxh3_128, 'xxh64': xxhash.xxh64})
+DEFAULT_HASH_ALGORITHM = 'sha256'
+HASH_BACKENDS = ('thread', 'process')
+READ_BUFFER_SIZE = 1024 * 1024
+# Файлы, измененные менее чем за столько секунд до сканирования, не кешируются в индексе:
+# их mtime может не измениться при повторной записи в пределах точности файловой системы.
+HASH_INDEX_RACY_SECONDS = 2
+HASH_INDEX_BATCH_SIZE = 1000
+STAGING_SUFFIX = '.tmp'
+# Журнал операций сеанса в корне назначения: по нему прерванный сеанс продолжается с места остановки.
+JOURNAL_NAME = '.sync_journal'
+JOURNAL_SYNC_SECONDS = 2
+# Манифест в корне назначения: размер, mtime и хеш каждого файла копии; хранится вместе с назначением.
+MANIFEST_NAME = '.sync_manifest'
+MANIFEST_VERSION = 1
+# Служебные папки в корне назначения, которые никогда не сканируются и не синхронизируются.
+SERVICE_NAMES = {'.sync_trash', JOURNAL_NAME, MANIFEST_NAME, MANIFEST_NAME + STAGING_SUFFIX}
+# Прогресс: обратный вызов не чаще раза в PROGRESS_INTERVAL секунд, скорость — по окну последних PROGRESS_RATE_WINDOW секунд
+# (и не раньше, чем наберется PROGRESS_RATE_MIN_SECONDS замера).
+PROGRESS_INTERVAL = 0.25
+PROGRESS_RATE_WINDOW = 10
+PROGRESS_RATE_MIN_SECONDS = 1
+# Ограничение скорости: чтение и запись в МБ/с, файловые операции в секунду; расписание перечитывается раз в THROTTLE_CHECK_SECONDS.
+THROTTLE_KINDS = ('read', 'write', 'ops')
+THROTTLE_BURST_SECONDS = 1
+THROTTLE_CHECK_SECONDS = 30
+# Блок copy_file_range/sendfile под ограничением: без него 64 МБ уходили бы одним всплеском на полной скорости.
+THROTTLE_CHUNK_SIZE = 4 * 1024 * 1024
+# Сколько самых медленных файлов попадает в отчет и как часто (в секундах) снимается точка пропускной способности.
+METRICS_SLOWEST_FILES = 10
+METRICS_SAMPLE_SECONDS = 5
+# Файлы от этого размера копируются в промежуточный файл блоками с контрольными точками в журнале,
+# чтобы после сбоя докопировать только недостающий хвост.
+RESUME_MIN_SIZE = 128 * 1024 * 1024
+RESUME_CHUNK_SIZE = 32 * 1024 * 1024
+# Блочная дельта для крупных измененных файлов: файлы сравниваются блоками, в назначение пишутся только отличающиеся.
+# Дайджесты блоков копии хранятся в индексе хешей, чтобы в следующий раз не перечитывать назначение.
+DELTA_BLOCK_SIZE = 1024 * 1024
+DELTA_DIGEST_SIZE = 16
+COPY_BUFFER_SIZE = 1024 * 1024
+# Объем одного системного вызова copy_file_range/sendfile: между вызовами проверяется отмена.
+COPY_CHUNK_SIZE = 64 * 1024 * 1024
+FICLONE = 0x40049409  # ioctl для reflink-копии на btrfs/XFS (Linux)
+FALLOC_FL_KEEP_SIZE = 0x01; FALLOC_FL_PUNCH_HOLE = 0x02  # флаги fallocate(2) для пробивания дыр (Linux)
+FS_IOC_FIEMAP = 0xC020660B  # ioctl карты физических экстентов файла (Linux)
+FIEMAP_HEADER = struct.Struct('QQIIII'); FIEMAP_EXTENT = struct.Struct('QQQQQIIII')
+# Файловые системы, которые считаются сетевыми при определении типа хранилища.
+NETWORK_FS_TYPES = {'nfs', 'nfs4', 'cifs', 'smb3', 'smbfs', 'ncpfs', 'afs', '9p', 'ceph', 'glusterfs', 'lustre', 'gpfs',
+                    'davfs', 'fuse.sshfs', 'fuse.rclone', 'fuse.s3fs', 'fuse.glusterfs'}
+# Предварительное выделение места (posix_fallocate) под копии от этого размера — только на ФС, где оно выполняется
+# на уровне ФС: в остальных glibc эмулирует его записью в каждый блок, что удваивает ввод-вывод.
+PREALLOCATE_MIN_SIZE = 64 * 1024 * 1024
+PREALLOCATE_FS_TYPES = frozenset({'ext4', 'xfs', 'btrfs', 'f2fs', 'ocfs2', 'gfs2', 'bcachefs'})
+# Ошибки, означающие, что способ копирования не поддерживается для этой пары файлов.
+COPY_FALLBACK_ERRNOS = {errno.EXDEV, errno.EINVAL, errno.ENOTTY, errno.EOPNOTSUPP, errno.ENOSYS, errno.EBADF, errno.EPERM, errno.ENOTSOCK}
 
 # --- Исключения ---
 class SyncCancelledError(Exception):
     """Исключение, вызываемое, когда пользователь отменяет синхронизацию."""
     pass
 
+class LinkedStopEvent:
+    """Событие остановки, которое срабатывает и от собственного set(), и от родительского stop_event."""
+    def __init__(self, parent=None):
+        self.parent = parent
+        self.event = threading.Event()
+    def set(self): self.event.set()
+    def is_set(self): return self.event.is_set() or bool(self.parent and self.parent.is_set())
+
+# --- Параллельное копирование ---
+class CopyEngine:
+    """Пул потоков для этапа копирования. С одним устройством (источника или назначения) одновременно
+    работает не больше workers копий (или меньше — по device_limits); число ожидающих задач ограничено,
+    чтобы не раздувать очередь."""
+    def __init__(self, workers=1, stop_event=None, device_limits=None):
+        self.workers = max(1, int(workers))
+        self.device_limits = device_limits or {}
+        self.stop_event = stop_event
+        self.lock = threading.Lock()
+        self.device_slots = {}
+        self.pending = threading.BoundedSemaphore(self.workers * 4)
+        self.futures = set()
+        # Потоков вдвое больше лимита на устройство, чтобы копии между разными парами устройств не ждали друг друга.
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers * 2 if self.workers > 1 else 1, thread_name_prefix='copy')
+
+    def _cancelled(self): return bool(self.stop_event and self.stop_event.is_set())
+
+    def _device_slot(self, device):
+        with self.lock:
+            if device not in self.device_slots: self.device_slots[device] = threading.BoundedSemaphore(min(self.workers, self.device_limits.get(device, self.workers)))
+            return self.device_slots[device]
+
+    def _run(self, task, devices, args):
+        if self._cancelled(): return
+        # Семафоры берутся в одном порядке, чтобы задачи с разными парами устройств не заблокировали друг друга.
+        slots = [self._device_slot(device) for device in sorted(set(devices))]
+        for slot in slots: slot.acquire()
+        try:
+            if not self._cancelled(): task(*args)
+        finally:
+            for slot in reversed(slots): slot.release()
+
+    def _done(self, future):
+        with self.lock: self.futures.discard(future)
+        self.pending.release()
+
+    def submit(self, task, devices, *args):
+        while not self.pending.acquire(timeout=0.1):
+            if self._cancelled(): raise SyncCancelledError("Прервано на этапе копирования файлов.")
+        future = self.executor.submit(self._run, task, devices, args)
+        with self.lock: self.futures.add(future)
+        future.add_done_callback(self._done)
+
+    def wait(self):
+        while True:
+            if self._cancelled(): raise SyncCancelledError("Прервано на этапе копирования файлов.")
+            with self.lock: futures = list(self.futures)
+            if not futures: return
+            concurrent.futures.wait(futures, timeout=0.1)
+
+    def shutdown(self): self.executor.shutdown(wait=True, cancel_futures=True)
+
+# --- Ограничение скорости ---
+def parse_throttle(spec):
+    """Разбирает расписание ограничений: правила через ';' или с новой строки, в каждом — необязательный интервал
+    времени суток и лимиты, например '08:00-20:00 read=20 write=20 ops=200; read=100'. Возвращает список
+    (интервал в минутах суток или None, {вид: лимит}); read/write — МБ/с, ops — операций в секунду, 0 — без ограничения."""
+    rules = []
+    for part in re.split(r'[;\n]', spec or ''):
+        tokens = [token for token in re.split(r'[\s,]+', part.strip()) if token]
+        if not tokens: continue
+        window = None
+        match = re.fullmatch(r'(\d{1,2}):(\d{2})-(\d{1,2}):(\d{2})', tokens[0])
+        if match:
+            hours_from, minutes_from, hours_to, minutes_to = map(int, match.groups())
+            if hours_from > 24 or hours_to > 24 or minutes_from > 59 or minutes_to > 59: raise ValueError(f"Неверный интервал времени в ограничении скорости: {tokens[0]}")
+            window = (hours_from * 60 + minutes_from, hours_to * 60 + minutes_to); tokens = tokens[1:]
+        limits = {}
+        for token in tokens:
+            kind, _, value = token.partition('=')
+            if kind not in THROTTLE_KINDS or not value: raise ValueError(f"Неверный лимит в ограничении скорости: {token} (ожидается {', '.join(kind + '=N' for kind in THROTTLE_KINDS)})")
+            try: limits[kind] = float(value)
+            except ValueError: raise ValueError(f"Неверное значение лимита: {token}") from None
+            if limits[kind] < 0: raise ValueError(f"Лимит не может быть отрицательным: {token}")
+        rules.append((window, limits))
+    return rules
+
+def throttle_limits(rules, now=None):
+    """Лимиты, действующие в момент now: первое правило, в интервал которого попадает время, иначе правило без интервала."""
+    now = now or datetime.now(); minute = now.hour * 60 + now.minute; default = {}
+    for window, limits in rules:
+        if window is None: default = default or limits; continue
+        start, end = window
+        if (start <= minute < end) if start <= end else (minute >= start or minute < end): return limits
+    return default
+
+def describe_throttle(limits):
+    parts = [f"чтение {limits['read']:g} МБ/с" if limits.get('read') else None, f"запись {limits['write']:g} МБ/с" if limits.get('write') else None,
+             f"{limits['ops']:g} операций/с" if limits.get('ops') else None]
+    return ", ".join(part for part in parts if part) or "без ограничения"
+
+class TokenBucket:
+    """Корзина токенов с долгом: take() списывает сразу и возвращает, сколько секунд подождать, чтобы средняя скорость
+    всех потоков вместе не превышала rate. После простоя копится запас на THROTTLE_BURST_SECONDS. rate=0 — без ограничения."""
+    def __init__(self, rate=0):
+        self.lock = threading.Lock(); self.rate = 0; self.tokens = 0.0; self.stamp = time.monotonic()
+        self.set_rate(rate)
+
+    def _refill(self, now):
+        if self.rate: self.tokens = min(self.rate * THROTTLE_BURST_SECONDS, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def set_rate(self, rate):
+        with self.lock:
+            self._refill(time.monotonic())
+            if rate and not self.rate: self.tokens = rate * THROTTLE_BURST_SECONDS
+            self.rate = rate; self.tokens = min(self.tokens, rate * THROTTLE_BURST_SECONDS)
+
+    def take(self, amount):
+        with self.lock:
+            if not self.rate: return 0
+            self._refill(time.monotonic()); self.tokens -= amount
+            return -self.tokens / self.rate if self.tokens < 0 else 0
+
+class Throttle:
+    """Ограничение скорости сеанса, общее для всех потоков сканирования, хеширования и копирования: отдельные корзины
+    для прочитанных байт, записанных байт и файловых операций. Лимиты берутся из расписания (parse_throttle) и
+    переключаются по времени суток. Суммарное время ожидания по каждому виду попадает в отчет сеанса."""
+    def __init__(self, spec, stop_event=None):
+        self.spec = spec; self.rules = parse_throttle(spec); self.stop_event = stop_event
+        self.buckets = {kind: TokenBucket() for kind in THROTTLE_KINDS}
+        self.lock = threading.Lock(); self.waited = dict.fromkeys(THROTTLE_KINDS, 0.0)
+        self.limits = None; self.next_check = 0.0
+        self._refresh()
+
+    def _refresh(self):
+        now = time.monotonic()
+        if now < self.next_check: return
+        with self.lock:
+            if now < self.next_check: return
+            self.next_check = now + THROTTLE_CHECK_SECONDS
+            limits = throttle_limits(self.rules)
+            if limits == self.limits: return
+            self.limits = limits
+        for kind, bucket in self.buckets.items(): bucket.set_rate(limits.get(kind, 0) * (1024 * 1024 if kind != 'ops' else 1))
+        logging.info(f"Ограничение скорости: {describe_throttle(limits)}")
+
+    def _take(self, kind, amount):
+        self._refresh()
+        delay = self.buckets[kind].take(amount)
+        if delay <= 0: return
+        with self.lock: self.waited[kind] += delay
+        # Ожидание прерывается остановкой сеанса; долг корзины при этом остается за ней.
+        deadline = time.monotonic() + delay
+        while (remaining := deadline - time.monotonic()) > 0:
+            if self.stop_event and self.stop_event.is_set(): return
+            time.sleep(min(remaining, 0.2))
+
+    def read(self, nbytes): self._take('read', nbytes)
+    def write(self, nbytes): self._take('write', nbytes)
+    def op(self, count=1): self._take('ops', count)
+
+    def data_hook(self, on_progress=None):
+        """Обертка над on_progress(байт, записано=None) копирования: данные списываются с лимитов чтения и записи."""
+        def hook(amount, written=None):
+            self.read(amount); self.write(amount if written is None else written)
+            if on_progress: on_progress(amount)
+        return hook
+
+    def report(self):
+        with self.lock: return {'schedule': self.spec, 'waited_seconds': {kind: round(seconds, 3) for kind, seconds in self.waited.items()}}
+
+# --- Таблица файлов ---
+class FileTable:
+    """Компактная таблица файлов одного дерева. Префиксы папок интернированы, размеры и mtime хранятся
+    в массивах, хеши — в двоичном виде в одном bytearray; файл адресуется целым id."""
+    __slots__ = ('digest_size', 'dir_names', 'dir_ids', 'dir_entries', 'file_dirs', 'names', 'sizes', 'mtimes', 'digests', 'live')
+
+    def __init__(self, digest_size=0):
+        self.digest_size = digest_size
+        self.dir_names = []    # префикс папки ('' — корень, иначе с завершающим разделителем)
+        self.dir_ids = {}      # префикс -> id папки
+        self.dir_entries = []  # для каждой папки: имя файла -> id файла
+        self.file_dirs = array('I'); self.names = []
+        self.sizes = array('q'); self.mtimes = array('d')
+        self.digests = bytearray()
+        self.live = 0
+
+    def add(self, rel_path, size, mtime, digest=None):
+        split = rel_path.rfind(os.sep) + 1
+        prefix, name = rel_path[:split], rel_path[split:]
+        dir_id = self.dir_ids.get(prefix)
+        if dir_id is None:
+            dir_id = self.dir_ids[prefix] = len(self.dir_names); self.dir_names.append(prefix); self.dir_entries.append({})
+        entries = self.dir_entries[dir_id]
+        file_id = entries.get(name)
+        if file_id is None:
+            file_id = entries[name] = len(self.names); self.live += 1
+            self.file_dirs.append(dir_id); self.names.append(name); self.sizes.append(size); self.mtimes.append(mtime)
+            if self.digest_size: self.digests.extend(bytes(self.digest_size))
+        else:
+            self.sizes[file_id] = size; self.mtimes[file_id] = mtime
+        if digest: self.set_digest(file_id, digest)
+        return file_id
+
+    def get(self, rel_path):
+        split = rel_path.rfind(os.sep) + 1
+        dir_id = self.dir_ids.get(rel_path[:split])
+        return None if dir_id is None else self.dir_entries[dir_id].get(rel_path[split:])
+
+    def discard(self, rel_path):
+        split = rel_path.rfind(os.sep) + 1
+        dir_id = self.dir_ids.get(rel_path[:split])
+        if dir_id is not None and self.dir_entries[dir_id].pop(rel_path[split:], None) is not None: self.live -= 1
+
+    def rel_path(self, file_id): return self.dir_names[self.file_dirs[file_id]] + self.names[file_id]
+
+    def set_digest(self, file_id, digest):
+        offset = file_id * self.digest_size; self.digests[offset:offset + self.digest_size] = digest
+
+    def digest(self, file_id):
+        if not self.digest_size: return None
+        offset = file_id * self.digest_size; return bytes(self.digests[offset:offset + self.digest_size])
+
+    def record(self, file_id):
+        """(размер, mtime, двоичный хеш или None) — формат, с которым работает сравнение в sync_folders."""
+        return self.sizes[file_id], self.mtimes[file_id], self.digest(file_id)
+
+    def items(self):
+        for prefix, entries in zip(self.dir_names, self.dir_entries):
+            for name, file_id in entries.items(): yield prefix + name, file_id
+
+    def __iter__(self): return (rel_path for rel_path, _ in self.items())
+    def __contains__(self, rel_path): return self.get(rel_path) is not None
+    def __len__(self): return self.live
+
+# --- Правила исключения файлов ---
+def _glob_to_regex(pattern):
+    """Переводит glob-шаблон .gitignore в регулярное выражение: '*' и '?' не пересекают '/',
+    '**/' — любое число папок (в том числе ноль), завершающий '/**' — все содержимое папки."""
+    parts = []; i = 0; n = len(pattern)
+    while i < n:
+        at_segment_start = i == 0 or pattern[i - 1] == '/'
+        if pattern.startswith('**/', i) and at_segment_start: parts.append('(?:.*/)?'); i += 3; continue
+        if pattern.startswith('**', i) and at_segment_start and i + 2 == n: parts.append('.*'); i += 2; continue
+        char = pattern[i]; i += 1
+        if char == '*':
+            while i < n and pattern[i] == '*': i += 1
+            parts.append('[^/]*')
+        elif char == '?': parts.append('[^/]')
+        elif char == '\\' and i < n: parts.append(re.escape(pattern[i])); i += 1
+        elif char == '[':
+            end = i + (1 if i < n and pattern[i] in '!^' else 0)
+            end = pattern.find(']', end + 1 if end < n and pattern[end] == ']' else end)
+            if end < 0: parts.append('\\['); continue
+            body = pattern[i:end].replace('\\', '\\\\'); i = end + 1
+            if body[:1] in ('!', '^'): body = '^' + body[1:]
+            parts.append(f'(?!/)[{body}]')
+        else: parts.append(re.escape(char))
+    return ''.join(parts)
+
+class ExcludeMatcher:
+    """Правила исключения в стиле .gitignore, скомпилированные один раз на сеанс.
+    Шаблон без '/' сравнивается с именем на любой глубине, шаблон с '/' — с путем от корня
+    ('/build' — только в корне); завершающий '/' — правило только для папок; '!' возвращает
+    исключенное ранее; из нескольких подходящих правил действует последнее.
+    Имена без спецсимволов ищутся в словаре, остальные правила объединены в два регулярных
+    выражения (по имени и по пути), поэтому проверка стоит почти одинаково при любом числе шаблонов."""
+    def __init__(self, patterns=()):
+        self.patterns = []; self.negated = []
+        # Для папок действуют все правила, для файлов — все, кроме правил только для папок.
+        names = ({}, {}); suffixes = ({}, {}); name_rules = ([], []); path_rules = ([], [])
+        for raw in patterns:
+            pattern = raw.strip()
+            if os.sep == '\\': pattern = pattern.replace('\\', '/')
+            if not pattern or pattern.startswith('#'): continue
+            negated = pattern.startswith('!')
+            if negated or pattern.startswith('\\!') or pattern.startswith('\\#'): pattern = pattern[1:]
+            dir_only = pattern.endswith('/'); pattern = pattern.rstrip('/')
+            if not pattern: continue
+            anchored = '/' in pattern; pattern = pattern.lstrip('/')
+            rule = len(self.patterns); self.patterns.append(raw); self.negated.append(negated)
+            for for_dirs in ((True,) if dir_only else (True, False)):
+                if not anchored and not any(char in pattern for char in '*?[\\'): names[for_dirs][pattern] = rule
+                elif not anchored and pattern.startswith('*.') and not any(char in pattern[1:] for char in '*?[\\'): suffixes[for_dirs][pattern[1:]] = rule
+                else: (path_rules if anchored else name_rules)[for_dirs].append((rule, _glob_to_regex(pattern)))
+        flags = re.IGNORECASE if os.path.normcase('A') == 'a' else 0
+        self.names = {False: names[0], True: names[1]}; self.suffixes = {False: suffixes[0], True: suffixes[1]}
+        self.name_regex = {for_dirs: self._combine(name_rules[for_dirs], flags) for for_dirs in (False, True)}
+        self.path_regex = {for_dirs: self._combine(path_rules[for_dirs], flags) for for_dirs in (False, True)}
+        if flags:
+            self.names = {for_dirs: {name.lower(): rule for name, rule in table.items()} for for_dirs, table in self.names.items()}
+            self.suffixes = {for_dirs: {suffix.lower(): rule for suffix, rule in table.items()} for for_dirs, table in self.suffixes.items()}
+        self.fold_case = bool(flags)
+
+    @staticmethod
+    def _combine(rules, flags):
+        """Одно выражение на все правила группы. Альтернативы идут от последнего правила к первому:
+        re выбирает первую подходящую, то есть последнее правило, а номер группы указывает на него."""
+        if not rules: return None
+        rules = rules[::-1]
+        return re.compile('|'.join(f'({regex})' for _, regex in rules), flags), [rule for rule, _ in rules]
+
+    @classmethod
+    def compile(cls, exclude_patterns):
+        """Принимает список шаблонов или уже готовый ExcludeMatcher; для пустого списка возвращает None."""
+        if not exclude_patterns or isinstance(exclude_patterns, cls): return exclude_patterns or None
+        return cls(exclude_patterns) or None
+
+    def __bool__(self): return bool(self.patterns)
+
+    def match(self, rel_path, is_dir=False):
+        """Исключен ли путь rel_path (относительно корня) по самим правилам, без учета родительских папок."""
+        if os.sep != '/': rel_path = rel_path.replace(os.sep, '/')
+        name = rel_path.rpartition('/')[2]
+        key = name.lower() if self.fold_case else name
+        rule = self.names[is_dir].get(key, -1)
+        suffixes = self.suffixes[is_dir]
+        if suffixes:
+            # '*.tar.gz' подходит и к 'a.tar.gz', поэтому проверяется каждый хвост имени, начиная с точки.
+            dot = key.find('.')
+            while dot >= 0:
+                rule = max(rule, suffixes.get(key[dot:], -1)); dot = key.find('.', dot + 1)
+        for compiled, subject in ((self.name_regex[is_dir], name), (self.path_regex[is_dir], rel_path)):
+            if not compiled: continue
+            found = compiled[0].fullmatch(subject)
+            if found: rule = max(rule, compiled[1][found.lastindex - 1])
+        return rule >= 0 and not self.negated[rule]
+
+    def excludes_path(self, rel_path, is_dir=False):
+        """Как match, но с учетом родительских папок: содержимое исключенной папки исключено целиком."""
+        parts = rel_path.split(os.sep)
+        if any(self.match(os.sep.join(parts[:i + 1]), is_dir=True) for i in range(len(parts) - 1)): return True
+        return self.match(rel_path, is_dir)
+
+# --- Хеширование ---
+_read_buffers = threading.local()
+
+def _read_buffer(size=READ_BUFFER_SIZE):
+    """Буфер чтения для хеширования, один на поток (или процесс пула) и переиспользуемый между файлами."""
+    buffer = getattr(_read_buffers, 'buffer', None)
+    if buffer is None or len(buffer) != size: buffer = _read_buffers.buffer = bytearray(size)
+    return buffer
+
+_ZERO_BLOCK = bytes(READ_BUFFER_SIZE)
+
+def _hash_zeros(hasher, count):
+    """Подает в хешер count нулевых байт — содержимое дыры разреженного файла, которое не читается с диска."""
+    view = memoryview(_ZERO_BLOCK)
+    while count > 0: hasher.update(view[:min(count, len(view))]); count -= len(view)
+
+@functools.lru_cache(maxsize=16)
+def _zero_digest(algorithm, length):
+    """Хеш участка из нулей: блок древовидного хеша целиком в дыре не хешируется заново."""
+    hasher = HASH_ALGORITHMS[algorithm](); _hash_zeros(hasher, length)
+    return hasher.digest()
+
+def _hash_range(path, algorithm, offset=0, length=None, buffer_size=READ_BUFFER_SIZE, on_progress=None):
+    """Возвращает двоичный хеш участка файла (length=None — до конца). Функция верхнего уровня,
+    чтобы ее можно было выполнять в процессном пуле; on_progress(байт) — только вне процессного пула.
+    Дыры разреженного файла не читаются: вместо них хешируются нули, и on_progress их не получает."""
+    hasher = HASH_ALGORITHMS[algorithm](); buffer = _read_buffer(buffer_size); view = memoryview(buffer)
+    with open(path, 'rb', buffering=0) as f:
+        layout = SparseLayout.probe(f.fileno(), offset, None if length is None else offset + length)
+        if layout is not None:
+            if not layout.extents: return _zero_digest(algorithm, max(0, layout.end - offset))
+            position = offset
+            for start, end in layout.extents:
+                _hash_zeros(hasher, start - position); f.seek(start)
+                while start < end:
+                    n = f.readinto(view[:min(len(buffer), end - start)])
+                    if not n: break
+                    hasher.update(view[:n]); start += n
+                    if on_progress: on_progress(n)
+                position = end
+            _hash_zeros(hasher, layout.end - position)
+            return hasher.digest()
+        if offset: f.seek(offset)
+        remaining = length
+        while remaining is None or remaining > 0:
+            n = f.readinto(view if remaining is None or remaining >= len(buffer) else view[:remaining])
+            if not n: break
+            hasher.update(view[:n])
+            if on_progress: on_progress(n)
+            if remaining is not None: remaining -= n
+    return hasher.digest()
+
+def _combine_leaves(algorithm, leaves):
+    """Корень древовидного хеша: файл из одного блока хешируется как обычно, иначе — хеш от хешей блоков."""
+    return leaves[0] if len(leaves) == 1 else HASH_ALGORITHMS[algorithm](b''.join(leaves)).digest()
+
+class StreamHasher:
+    """Потоковый хешер той же схемы, что и HashEngine. Нужен копированию с хешированием,
+    чтобы хеш копии совпадал с хешем, вычисленным при сканировании."""
+    def __init__(self, algorithm=DEFAULT_HASH_ALGORITHM, tree_chunk_size=0):
+        self.algorithm = algorithm; self.factory = HASH_ALGORITHMS[algorithm]; self.tree_chunk_size = tree_chunk_size
+        self.leaf = self.factory(); self.leaf_bytes = 0; self.leaves = []
+
+    def update(self, data):
+        if not self.tree_chunk_size: self.leaf.update(data); return
+        view = memoryview(data)
+        while len(view):
+            take = min(len(view), self.tree_chunk_size - self.leaf_bytes)
+            self.leaf.update(view[:take]); self.leaf_bytes += take; view = view[take:]
+            if self.leaf_bytes == self.tree_chunk_size: self.leaves.append(self.leaf.digest()); self.leaf = self.factory(); self.leaf_bytes = 0
+
+    def update_zeros(self, count):
+        """Как update(bytes(count)), но целые блоки древовидного хеша из нулей берутся из кеша."""
+        if self.tree_chunk_size and self.leaf_bytes:
+            take = min(count, self.tree_chunk_size - self.leaf_bytes); _hash_zeros(self, take); count -= take
+        while self.tree_chunk_size and count >= self.tree_chunk_size:
+            self.leaves.append(_zero_digest(self.algorithm, self.tree_chunk_size)); count -= self.tree_chunk_size
+        _hash_zeros(self, count)
+
+    def digest(self):
+        leaves = self.leaves + [self.leaf.digest()] if self.leaf_bytes or not self.leaves else self.leaves
+        return _combine_leaves(self.algorithm, leaves)
+
+    def hexdigest(self): return self.digest().hex()
+
+class HashEngine:
+    """Схема и пулы хеширования: алгоритм, бэкенд пула ('thread' или 'process') и размер блока древовидного
+    хеша (0 — файл хешируется целиком). В древовидном режиме большой файл делится на блоки, которые считаются
+    параллельно разными исполнителями. Имя схемы (name) хранится в индексе хешей и пишется в лог:
+    хеши разных схем между собой не сравниваются."""
+    def __init__(self, algorithm=DEFAULT_HASH_ALGORITHM, backend='thread', tree_chunk_size=0, workers=None):
+        if algorithm not in HASH_ALGORITHMS: raise ValueError(f"Неизвестный алгоритм хеширования: {algorithm} (доступны: {', '.join(HASH_ALGORITHMS)})")
+        if backend not in HASH_BACKENDS: raise ValueError(f"Неизвестный бэкенд хеширования: {backend}")
+        self.algorithm = algorithm; self.backend = backend
+        self.tree_chunk_size = max(0, int(tree_chunk_size or 0))
+        self.workers = workers or os.cpu_count() or 1
+        self.digest_size = HASH_ALGORITHMS[algorithm]().digest_size
+        self.name = f"{algorithm}-tree{self.tree_chunk_size}" if self.tree_chunk_size else algorithm
+        self.throttle = None  # Throttle сеанса: чтение при хешировании списывается с его лимитов
+
+    def hasher(self): return StreamHasher(self.algorithm, self.tree_chunk_size)
+
+    def executor(self, workers=None):
+        """Новый пул для параллельного хеширования; закрывает его вызывающий код."""
+        if self.backend == 'process':
+            # spawn, а не fork: процесс многопоточный, и fork мог бы унаследовать захваченные блокировки.
+            return concurrent.futures.ProcessPoolExecutor(workers or self.workers, mp_context=multiprocessing.get_context('spawn'))
+        return concurrent.futures.ThreadPoolExecutor(workers or self.workers, thread_name_prefix='hash')
+
+    def ranges(self, path):
+        """Участки (offset, length) для древовидного хеша; None — файл хешируется целиком."""
+        if not self.tree_chunk_size: return None
+        size = os.path.getsize(path)
+        if size <= self.tree_chunk_size: return None
+        return [(offset, self.tree_chunk_size) for offset in range(0, size, self.tree_chunk_size)]
+
+    def hash_file(self, path, buffer_size=READ_BUFFER_SIZE, on_progress=None):
+        throttle = self.throttle
+        if throttle:
+            throttle.op(); report = on_progress
+            def on_progress(n):
+                throttle.read(n)
+                if report: report(n)
+        try:
+            ranges = self.ranges(path)
+            if ranges is None: return _hash_range(path, self.algorithm, buffer_size=buffer_size, on_progress=on_progress).hex()
+            return _combine_leaves(self.algorithm, [_hash_range(path, self.algorithm, offset, length, buffer_size, on_progress) for offset, length in ranges]).hex()
+        except (IOError, PermissionError) as e: logging.error(f"Не удалось прочитать файл {path}: {e}"); return None
+
+    def hash_many(self, paths, executor=None, buffer_size=READ_BUFFER_SIZE, on_progress=None):
+        """Выдает hex-хеш (или None при ошибке чтения) для каждого пути в исходном порядке.
+        С пулом файлы и блоки крупных файлов считаются параллельно; число файлов в работе ограничено.
+        on_progress(байт) вызывается по ходу чтения только без пула: результаты пула приходят по файлу целиком."""
+        if executor is None:
+            for path in paths: yield self.hash_file(path, buffer_size, on_progress)
+            return
+        pending = deque(); window = self.workers * 4
+        def submit(path):
+            try: ranges = self.ranges(path)
+            except OSError: ranges = None  # ошибка повторится при чтении и будет записана в лог
+            if self.throttle:
+                # Чтение в пуле не видно по блокам, поэтому лимит списывается целиком до отправки файла.
+                self.throttle.op()
+                try: self.throttle.read(os.path.getsize(path))
+                except OSError: pass
+            if ranges is None: return [executor.submit(_hash_range, path, self.algorithm, 0, None, buffer_size)]
+            return [executor.submit(_hash_range, path, self.algorithm, offset, length, buffer_size) for offset, length in ranges]
+        def collect(path, futures):
+            try: return _combine_leaves(self.algorithm, [future.result() for future in futures]).hex()
+            except (IOError, PermissionError) as e: logging.error(f"Не удалось прочитать файл {path}: {e}"); return None
+        for path in paths:
+            pending.append((path, submit(path)))
+            if len(pending) > window: yield collect(*pending.popleft())
+        while pending: yield collect(*pending.popleft())
+
+DEFAULT_HASH_ENGINE = HashEngine()
+
+# --- Индекс хешей ---
+class HashIndex:
+    """Постоянный индекс хешей в SQLite. Хеш файла берется из индекса, пока не изменился
+    его отпечаток (размер, mtime_ns, inode, устройство) и схема хеширования."""
+    def __init__(self, db_path=HASH_INDEX_FILE, algorithm=DEFAULT_HASH_ALGORITHM):
+        self.db_path = db_path; self.algorithm = algorithm
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL"); self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS files (root TEXT NOT NULL, rel_path TEXT NOT NULL, size INTEGER, mtime_ns INTEGER, "
+                          "inode INTEGER, device INTEGER, hash TEXT, algorithm TEXT NOT NULL DEFAULT 'sha256', PRIMARY KEY (root, rel_path)) WITHOUT ROWID")
+        if 'algorithm' not in {row[1] for row in self.conn.execute("PRAGMA table_info(files)")}:
+            # Индексы прежних версий содержат только хеши SHA-256.
+            self.conn.execute("ALTER TABLE files ADD COLUMN algorithm TEXT NOT NULL DEFAULT 'sha256'")
+        # Дайджесты блоков для дельта-копирования (по DELTA_DIGEST_SIZE байт подряд) не зависят от схемы хеширования.
+        self.conn.execute("CREATE TABLE IF NOT EXISTS blocks (root TEXT NOT NULL, rel_path TEXT NOT NULL, size INTEGER, mtime_ns INTEGER, "
+                          "inode INTEGER, device INTEGER, block_size INTEGER, digests BLOB, PRIMARY KEY (root, rel_path)) WITHOUT ROWID")
+        self.conn.commit()
+
+    @staticmethod
+    def root_key(directory): return os.path.normcase(os.path.abspath(directory))
+
+    def load(self, root):
+        with self.lock:
+            rows = self.conn.execute("SELECT rel_path, size, mtime_ns, inode, device, hash FROM files WHERE root = ? AND algorithm = ?", (root, self.algorithm))
+            return {rel_path: (size, mtime_ns, inode, device, file_hash) for rel_path, size, mtime_ns, inode, device, file_hash in rows}
+
+    def get(self, root, rel_path, fingerprint):
+        with self.lock:
+            row = self.conn.execute("SELECT size, mtime_ns, inode, device, hash FROM files WHERE root = ? AND rel_path = ? AND algorithm = ?", (root, rel_path, self.algorithm)).fetchone()
+        return row[4] if row and tuple(row[:4]) == tuple(fingerprint) else None
+
+    def update(self, root, entries):
+        """Сохраняет пачку записей (rel_path, (size, mtime_ns, inode, device), hash) одной транзакцией."""
+        rows = [(root, rel_path, *fingerprint, file_hash, self.algorithm) for rel_path, fingerprint, file_hash in entries
+                if time.time() - fingerprint[1] / 1e9 >= HASH_INDEX_RACY_SECONDS]
+        if not rows: return
+        with self.lock, self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO files (root, rel_path, size, mtime_ns, inode, device, hash, algorithm) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def get_blocks(self, root, rel_path, fingerprint, block_size):
+        """Дайджесты блоков файла, если они сняты с того же содержимого (отпечаток) и тем же размером блока."""
+        with self.lock:
+            row = self.conn.execute("SELECT size, mtime_ns, inode, device, block_size, digests FROM blocks WHERE root = ? AND rel_path = ?", (root, rel_path)).fetchone()
+        return bytes(row[5]) if row and tuple(row[:4]) == tuple(fingerprint) and row[4] == block_size else None
+
+    def update_blocks(self, root, rel_path, fingerprint, block_size, digests):
+        if time.time() - fingerprint[1] / 1e9 < HASH_INDEX_RACY_SECONDS: return
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO blocks (root, rel_path, size, mtime_ns, inode, device, block_size, digests) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                              (root, rel_path, *fingerprint, block_size, bytes(digests)))
+
+    def prune(self, root, seen_rel_paths):
+        """Удаляет записи о файлах, которых больше нет в дереве. Вызывается только после полного сканирования."""
+        removed = {}
+        with self.lock:
+            for table in ('files', 'blocks'):
+                stale = [(root, rel_path) for (rel_path,) in self.conn.execute(f"SELECT rel_path FROM {table} WHERE root = ?", (root,)) if rel_path not in seen_rel_paths]
+                if stale:
+                    with self.conn: self.conn.executemany(f"DELETE FROM {table} WHERE root = ? AND rel_path = ?", stale)
+                removed[table] = len(stale)
+        return removed['files']
+
+    def compact(self, max_free_ratio=0.25):
+        with self.lock:
+            page_count = self.conn.execute("PRAGMA page_count").fetchone()[0]
+            free_count = self.conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if page_count and free_count / page_count > max_free_ratio:
+                logging.info(f"Сжатие индекса хешей {self.db_path} ({free_count} из {page_count} страниц свободны)...")
+                self.conn.execute("VACUUM")
+            self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def close(self):
+        with self.lock: self.conn.close()
+
+# --- Тип хранилища ---
+class StorageInfo:
+    """Тип хранилища пути ('hdd', 'ssd', 'network' или 'unknown') и выбранные под него параметры ввода-вывода.
+    Для 'unknown' параметры не меняются: действуют настройки пользователя."""
+    BUFFER_SIZES = {'hdd': 8 * 1024 * 1024, 'network': 4 * 1024 * 1024}
+
+    def __init__(self, kind='unknown', device=None, fs_type=None):
+        self.kind = kind; self.device = device; self.fs_type = fs_type
+
+    @property
+    def seek_order(self):
+        """На вращающемся диске файлы читаются в порядке физического размещения, а не обхода."""
+        return self.kind == 'hdd'
+
+    @property
+    def buffer_size(self): return self.BUFFER_SIZES.get(self.kind, COPY_BUFFER_SIZE)
+
+    def hash_workers(self, default):
+        """Параллельные случайные чтения гоняют головки HDD, а по сети наоборот выгодно держать больше запросов в полете."""
+        if self.kind == 'hdd': return 1
+        if self.kind == 'network': return max(default, 8)
+        return default
+
+    def copy_limit(self, workers): return 1 if self.kind == 'hdd' else workers
+
+    def describe(self):
+        details = ", ".join(x for x in (self.device, self.fs_type) if x)
+        return f"{self.kind.upper() if self.kind != 'unknown' else 'не определен'}" + (f" ({details})" if details else "")
+
+def _unescape_mountinfo(field): return re.sub(r'\\([0-7]{3})', lambda m: chr(int(m.group(1), 8)), field)
+
+def _find_mount(path):
+    """Точка монтирования, содержащая path, по /proc/self/mountinfo: (тип ФС, источник) или (None, None)."""
+    real = os.path.realpath(path); best = None
+    try:
+        with open('/proc/self/mountinfo', encoding='utf-8', errors='replace') as f:
+            for line in f:
+                fields = line.split(); separator = fields.index('-')
+                mount_point = _unescape_mountinfo(fields[4])
+                if real == mount_point or real.startswith(mount_point.rstrip('/') + '/'):
+                    if best is None or len(mount_point) >= len(best[0]): best = (mount_point, fields[separator + 1], fields[separator + 2])
+    except (OSError, ValueError, IndexError): return None, None
+    return (best[1], best[2]) if best else (None, None)
+
+def _block_device_rotational(device_number):
+    """(имя диска, вращающийся ли) по sysfs для номера устройства; для раздела берется родительский диск."""
+    sys_path = os.path.realpath(f"/sys/dev/block/{os.major(device_number)}:{os.minor(device_number)}")
+    for candidate in (sys_path, os.path.dirname(sys_path)):
+        try:
+            with open(os.path.join(candidate, 'queue', 'rotational')) as f: return os.path.basename(candidate), f.read().strip() == '1'
+        except OSError: continue
+    return None, None
+
+def detect_storage(path):
+    """Определяет тип хранилища пути: UNC-пути и сетевые диски/ФС — 'network', на Linux блочное
+    устройство проверяется через sysfs (queue/rotational). Ошибки определения дают 'unknown'."""
+    path = os.fspath(path)
+    if path.startswith('\\\\') or (sys.platform == 'win32' and path.startswith('//')): return StorageInfo('network')
+    if sys.platform == 'win32':
+        try:
+            drive = os.path.splitdrive(os.path.abspath(path))[0]
+            if drive and ctypes.windll.kernel32.GetDriveTypeW(drive + '\\') == 4: return StorageInfo('network', drive)  # DRIVE_REMOTE
+        except (AttributeError, OSError): pass
+        return StorageInfo()
+    if not sys.platform.startswith('linux'): return StorageInfo()
+    fs_type, mount_source = _find_mount(path)
+    if fs_type in NETWORK_FS_TYPES: return StorageInfo('network', mount_source, fs_type)
+    try: device, rotational = _block_device_rotational(os.stat(path).st_dev)
+    except OSError: device, rotational = None, None
+    if rotational is None and mount_source and mount_source.startswith('/dev/'):
+        # btrfs и некоторые другие ФС выдают анонимный st_dev — тогда устройство берется из источника монтирования.
+        try: device, rotational = _block_device_rotational(os.stat(mount_source).st_rdev)
+        except OSError: pass
+    if rotational is None: return StorageInfo('unknown', device, fs_type)
+    return StorageInfo('hdd' if rotational else 'ssd', device, fs_type)
+
+def physical_offset(path, fallback=0):
+    """Физическое смещение первого экстента файла (FIEMAP) для упорядочивания чтения на HDD.
+    Если FIEMAP недоступен, возвращается fallback (обычно номер inode — он тоже растет вдоль диска)."""
+    if not fcntl or not sys.platform.startswith('linux'): return fallback
+    request = bytearray(FIEMAP_HEADER.size + FIEMAP_EXTENT.size)
+    FIEMAP_HEADER.pack_into(request, 0, 0, 0xFFFFFFFFFFFFFFFF, 0, 0, 1, 0)
+    try:
+        fd = os.open(path, os.O_RDONLY)
+        try: fcntl.ioctl(fd, FS_IOC_FIEMAP, request)
+        finally: os.close(fd)
+    except OSError: return fallback
+    if not FIEMAP_HEADER.unpack_from(request)[3]: return fallback
+    return FIEMAP_EXTENT.unpack_from(request, FIEMAP_HEADER.size)[1]
+
+# --- Метрики сеанса ---
+class SyncMetrics:
+    """Инструментирование сеанса: длительность этапов, объемы прочитанных, хешированных и записанных данных,
+    пропускная способность во времени, самые медленные файлы и попадания в кеш хешей.
+    Счетчики пополняются из пулов сканирования и копирования, поэтому все изменения идут под блокировкой."""
+    COUNTERS = ('bytes_read', 'bytes_hashed', 'bytes_written', 'files_hashed', 'hash_cache_hits', 'hash_cache_misses')
+
+    def __init__(self, slowest_files=METRICS_SLOWEST_FILES, sample_interval=METRICS_SAMPLE_SECONDS):
+        self.lock = threading.Lock()
+        self.started = self.phase_start = time.monotonic(); self.started_at = time.time(); self.finished = None
+        self.phases = {}
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+        # Точки (секунды от начала, прочитано, хешировано, записано) нарастающим итогом.
+        self.samples = [(0.0, 0, 0, 0)]
+        self.sample_interval = sample_interval; self.next_sample = self.started + sample_interval
+        # Мин-куча (секунды, номер, операция, путь, байты): в вершине — самый быстрый из попавших в отчет.
+        self.slowest_limit = slowest_files; self.slowest = []; self.sequence = 0
+
+    def end_phase(self, name):
+        """Закрывает этап, начавшийся в конце предыдущего."""
+        with self.lock:
+            now = time.monotonic(); self.phases[name] = round(self.phases.get(name, 0) + now - self.phase_start, 3); self.phase_start = now
+
+    def add_time(self, name, seconds):
+        """Время вложенного этапа (обход, хеширование); у одновременно сканируемых сторон оно суммируется."""
+        with self.lock: self.phases[name] = round(self.phases.get(name, 0) + seconds, 3)
+
+    def add(self, **amounts):
+        with self.lock:
+            for key, value in amounts.items(): self.counters[key] += value
+            now = time.monotonic()
+            if now >= self.next_sample: self._sample(now); self.next_sample = now + self.sample_interval
+
+    def _sample(self, now):
+        counters = self.counters
+        self.samples.append((round(now - self.started, 3), counters['bytes_read'], counters['bytes_hashed'], counters['bytes_written']))
+
+    def file_done(self, operation, rel_path, seconds, size=0):
+        if self.slowest_limit <= 0: return
+        with self.lock:
+            self.sequence += 1; item = (seconds, self.sequence, operation, str(rel_path), size)
+            if len(self.slowest) < self.slowest_limit: heapq.heappush(self.slowest, item)
+            elif seconds > self.slowest[0][0]: heapq.heapreplace(self.slowest, item)
+
+    def finish(self):
+        with self.lock:
+            if self.finished is None: self.finished = time.monotonic(); self._sample(self.finished)
+
+    def report(self, **session):
+        """Завершает замер и возвращает отчет в виде словаря (для JSON); session — описание сеанса."""
+        self.finish()
+        with self.lock:
+            duration = self.finished - self.started
+            throughput = []
+            for previous, current in zip(self.samples, self.samples[1:]):
+                elapsed = current[0] - previous[0]
+                if elapsed <= 0: continue
+                rates = [round((now - before) / elapsed) for now, before in zip(current[1:], previous[1:])]
+                throughput.append({'elapsed_seconds': current[0], 'read_bytes_per_sec': rates[0], 'hashed_bytes_per_sec': rates[1], 'written_bytes_per_sec': rates[2]})
+            return {
+                **session,
+                'started': datetime.fromtimestamp(self.started_at).isoformat(timespec='seconds'),
+                'finished_timestamp': round(self.started_at + duration, 3),
+                'duration_seconds': round(duration, 3),
+                'phases': dict(self.phases),
+                'counters': dict(self.counters),
+                'throughput': throughput,
+                'slowest_files': [{'path': path, 'operation': operation, 'seconds': round(seconds, 3), 'bytes': size}
+                                  for seconds, _, operation, path, size in sorted(self.slowest, reverse=True)],
+            }
+
+def format_size(size):
+    for unit in ('Б', 'КБ', 'МБ', 'ГБ'):
+        if size < 1024: return f"{size:.0f} {unit}" if unit == 'Б' else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} ТБ"
+
+def format_throttle_waits(report):
+    """Сводка Throttle.report(): сколько потоки суммарно ждали из-за каждого лимита."""
+    waited = report['waited_seconds']; names = {'read': 'чтение', 'write': 'запись', 'ops': 'операции'}
+    return "ожидание " + ", ".join(f"{names[kind]} {waited[kind]:.1f} с" for kind in THROTTLE_KINDS) + " (суммарно по потокам)"
+
+def format_metrics_summary(report):
+    """Краткая текстовая сводка отчета SyncMetrics для лога и GUI."""
+    counters = report['counters']; duration = report['duration_seconds']
+    lines = ["Этапы: " + (", ".join(f"{name} {seconds:.2f} с" for name, seconds in report['phases'].items()) or "нет")]
+    speed = f" (в среднем {format_size(counters['bytes_written'] / duration)}/с)" if duration > 0 and counters['bytes_written'] else ""
+    lines.append(f"Данные: прочитано {format_size(counters['bytes_read'])}, хешировано {format_size(counters['bytes_hashed'])}, записано {format_size(counters['bytes_written'])}{speed}")
+    lines.append(f"Кеш хешей: попаданий {counters['hash_cache_hits']}, промахов {counters['hash_cache_misses']} (хешировано файлов: {counters['files_hashed']})")
+    if report.get('throttle'): lines.append(f"Ограничение скорости ({report['throttle']['schedule']}): {format_throttle_waits(report['throttle'])}")
+    if report['slowest_files']:
+        lines.append("Самые медленные файлы:")
+        lines.extend(f"  {item['seconds']:.2f} с  {item['operation']}  {format_size(item['bytes'])}  {item['path']}" for item in report['slowest_files'])
+    return "\n".join(lines)
+
+def _prometheus_text(report):
+    """Отчет в текстовом формате Prometheus (для textfile-коллектора node_exporter)."""
+    escape = lambda value: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    session_labels = {'source': report.get('source', ''), 'destination': report.get('destination', '')}
+    lines = []
+    def metric(name, help_text, samples):
+        lines.append(f"# HELP file_sync_{name} {help_text}"); lines.append(f"# TYPE file_sync_{name} gauge")
+        for labels, value in samples:
+            label_text = ",".join(f'{key}="{escape(label)}"' for key, label in {**session_labels, **labels}.items())
+            lines.append(f"file_sync_{name}{{{label_text}}} {value}")
+    counters = report['counters']; stats = report.get('stats') or {}
+    metric('last_run_timestamp_seconds', "Время завершения последнего сеанса (Unix).", [({}, report['finished_timestamp'])])
+    metric('last_run_success', "1, если последний сеанс завершился успешно.", [({}, int(report.get('status') == 'success'))])
+    metric('duration_seconds', "Длительность последнего сеанса.", [({}, report['duration_seconds'])])
+    metric('phase_duration_seconds', "Длительность этапов последнего сеанса.", [({'phase': name}, seconds) for name, seconds in report['phases'].items()])
+    metric('bytes', "Объем данных за последний сеанс.", [({'operation': operation}, counters[f'bytes_{operation}']) for operation in ('read', 'hashed', 'written')])
+    metric('hash_cache_lookups', "Обращения к кешу хешей за последний сеанс.", [({'result': 'hit'}, counters['hash_cache_hits']), ({'result': 'miss'}, counters['hash_cache_misses'])])
+    metric('files', "Результаты обработки файлов за последний сеанс.", [({'result': key}, value) for key, value in stats.items() if isinstance(value, int)])
+    if report.get('throttle'):
+        metric('throttle_wait_seconds', "Время ожидания из-за ограничения скорости за последний сеанс.", [({'kind': kind}, seconds) for kind, seconds in report['throttle']['waited_seconds'].items()])
+    metric('slowest_file_seconds', "Самые медленные файлы последнего сеанса.", [({'operation': item['operation'], 'path': item['path']}, item['seconds']) for item in report['slowest_files']])
+    return "\n".join(lines) + "\n"
+
+def write_metrics_report(report, metrics_file=METRICS_FILE):
+    """Пишет отчет в JSON и рядом, с расширением .prom, — для Prometheus. Файлы заменяются атомарно,
+    чтобы коллектор не прочитал недописанный файл. Возвращает путь к файлу .prom."""
+    prom_file = os.path.splitext(metrics_file)[0] + '.prom'
+    for path, text in ((metrics_file, json.dumps(report, ensure_ascii=False, indent=2)), (prom_file, _prometheus_text(report))):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}{STAGING_SUFFIX}"
+        with open(temp_path, 'w', encoding='utf-8') as f: f.write(text)
+        os.replace(temp_path, path)
+    return prom_file
+
+# --- Прогресс ---
+def format_eta(seconds):
+    seconds = int(seconds); hours, rest = divmod(seconds, 3600); minutes, seconds = divmod(rest, 60)
+    return f"{hours}:{minutes:02}:{seconds:02}" if hours else f"{minutes}:{seconds:02}"
+
+class ProgressMeter:
+    """Прогресс одного этапа (обход, хеширование, копирование) в байтах: сделано из total, скорость по скользящему окну
+    и оценка оставшегося времени. advance() можно вызывать из любых потоков сколь угодно часто, а callback(p_type, current, total, message)
+    вызывается не чаще раза в interval секунд (под блокировкой, чтобы сообщения не обгоняли друг друга).
+    total=0 — объем заранее не известен; sizes=False — этап считается в файлах."""
+    def __init__(self, callback, label, total=0, files=0, sizes=True, interval=PROGRESS_INTERVAL):
+        self.callback = callback; self.label = label; self.sizes = sizes; self.interval = interval
+        self.lock = threading.Lock()
+        self.total = total; self.files = files; self.done = 0; self.files_done = 0; self.item = None
+        self.next_emit = 0.0; self.window = deque([(time.monotonic(), 0)])
+
+    def add_total(self, amount, files=0):
+        if not self.callback: return
+        with self.lock: self.total += amount; self.files += files
+
+    def advance(self, amount=0, files=0, item=None):
+        if not self.callback: return
+        with self.lock:
+            self.done += amount; self.files_done += files
+            if item is not None: self.item = item
+            now = time.monotonic()
+            if now < self.next_emit: return
+            self.next_emit = now + self.interval; self.callback('overall', *self._snapshot(now))
+
+    def finish(self):
+        """Итоговое сообщение этапа, без ограничения частоты."""
+        if not self.callback: return
+        with self.lock: self.item = None; self.callback('overall', *self._snapshot(time.monotonic()))
+
+    def file(self, size, item=None): return FileProgress(self, size, item)
+
+    def _rate(self, now):
+        window = self.window; window.append((now, self.done))
+        while len(window) > 2 and window[1][0] <= now - PROGRESS_RATE_WINDOW: window.popleft()
+        elapsed = now - window[0][0]
+        return (self.done - window[0][1]) / elapsed if elapsed >= PROGRESS_RATE_MIN_SECONDS else 0
+
+    def _snapshot(self, now):
+        amount = format_size if self.sizes else str
+        parts = [f"{amount(self.done)} из {amount(self.total)}" if self.total else amount(self.done)]
+        if self.sizes and (self.files or self.files_done): parts.append(f"файлов {self.files_done}" + (f" из {self.files}" if self.files else ""))
+        rate = self._rate(now) if self.total else 0
+        if rate > 0:
+            parts.append(f"{format_size(rate)}/с" if self.sizes else f"{rate:.0f}/с")
+            if self.total > self.done: parts.append(f"осталось {format_eta((self.total - self.done) / rate)}")
+        message = f"{self.label}: " + ", ".join(parts) + (f" — {self.item}" if self.item else "")
+        # Неизвестный объем передается как 0 из 1, чтобы индикатор не заполнялся.
+        return (min(self.done, self.total), self.total, message) if self.total else (0, 1, message)
+
+class FileProgress:
+    """Прогресс внутри одного файла: вызывается с числом байт по ходу чтения, close() засчитывает файл
+    и досчитывает остаток до size (reflink, пропуск, ошибка), чтобы этап сходился к итогу."""
+    def __init__(self, meter, size, item=None): self.meter = meter; self.size = size; self.item = item; self.done = 0
+
+    def __call__(self, amount, written=None):
+        amount = min(amount, self.size - self.done)
+        if amount > 0: self.done += amount; self.meter.advance(amount, item=self.item)
+
+    def close(self): self.meter.advance(max(0, self.size - self.done), files=1, item=self.item); self.done = self.size
+
+# --- Журнал операций ---
+class SyncJournal:
+    """Журнал сеанса в корне назначения (строки JSON): план, начатые промежуточные файлы,
+    контрольные точки крупных копий и выполненные операции. Успешный сеанс удаляет журнал;
+    если он остался, следующий сеанс с тем же источником продолжает работу по нему.
+    Записи не требуют fsync для корректности: блоки промежуточного файла перед продолжением
+    сверяются с дайджестами, поэтому потерянный хвост журнала лишь уменьшает сохраненный прогресс."""
+    def __init__(self, dest_dir, source_dir):
+        self.path = os.path.join(dest_dir, JOURNAL_NAME); self.source = os.path.abspath(source_dir)
+        self.lock = threading.Lock(); self.last_sync = time.monotonic()
+        self.planned = set(); self.completed = {}; self.staged = set(); self.chunks = {}
+        self.resumed_from = self._load()
+        self.file = open(self.path, 'a' if self.resumed_from else 'w', encoding='utf-8')
+        if not self.resumed_from: self._write({'op': 'session', 'source': self.source, 'started': datetime.now().isoformat(timespec='seconds')}, sync=True)
+
+    def _load(self):
+        """Читает журнал прерванного сеанса; возвращает время его начала или None, если продолжать нечего."""
+        try:
+            with open(self.path, encoding='utf-8') as f: lines = f.readlines()
+        except FileNotFoundError: return None
+        except OSError as e: logging.error(f"Не удалось прочитать журнал {self.path}: {e}"); return None
+        header = None
+        for line in lines:
+            try: record = json.loads(line)
+            except ValueError: continue  # недописанная последняя строка после сбоя
+            op = record.get('op')
+            if header is None:
+                if op != 'session' or record.get('source') != self.source: return None
+                header = record; continue
+            path = record.get('path')
+            if op == 'plan': self.planned.add(path)
+            elif op == 'stage': self.staged.add(path)
+            elif op == 'chunk':
+                fingerprint = tuple(record['source']); chunks = self.chunks.get(path)
+                # Блоки пишутся по порядку; первый блок или блок другой версии источника начинает цепочку заново.
+                if not chunks or chunks[0] != fingerprint or record['index'] == 0: chunks = self.chunks[path] = [fingerprint, []]
+                if record['index'] == len(chunks[1]): chunks[1].append(record['digest'])
+            elif op == 'done':
+                self.staged.discard(path); self.chunks.pop(path, None)
+                if record.get('action') == 'copy' and record.get('source'): self.completed[path] = tuple(record['source'])
+                else: self.completed.pop(path, None)
+        return header and header.get('started')
+
+    def _write(self, record, sync=False):
+        with self.lock:
+            if self.file.closed: return
+            self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            # Сброс на диск — раз в JOURNAL_SYNC_SECONDS, а не на каждую запись: на мелких файлах записей много.
+            now = time.monotonic()
+            if sync or now - self.last_sync >= JOURNAL_SYNC_SECONDS: self.file.flush(); os.fsync(self.file.fileno()); self.last_sync = now
+
+    def plan(self, rel_path, reason):
+        if rel_path not in self.planned: self.planned.add(rel_path); self._write({'op': 'plan', 'path': rel_path, 'reason': reason})
+
+    def stage(self, rel_path):
+        """Отмечает начало записи промежуточного файла: без отметки 'done' он считается брошенным."""
+        self.staged.add(rel_path); self._write({'op': 'stage', 'path': rel_path})
+
+    def chunk(self, rel_path, source_fingerprint, index, digest):
+        self._write({'op': 'chunk', 'path': rel_path, 'source': list(source_fingerprint), 'index': index, 'digest': digest})
+
+    def done(self, op, rel_path, source_fingerprint=None, file_hash=None):
+        self.staged.discard(rel_path)
+        self._write({'op': 'done', 'action': op, 'path': rel_path, 'source': list(source_fingerprint) if source_fingerprint else None, 'hash': file_hash})
+
+    def resume_chunks(self, rel_path, source_fingerprint):
+        """Дайджесты блоков, уже записанных в промежуточный файл для этой версии источника."""
+        chunks = self.chunks.get(rel_path)
+        return list(chunks[1]) if chunks and chunks[0] == tuple(source_fingerprint) else []
+
+    def is_done(self, rel_path, source_fingerprint):
+        """Файл уже скопирован прерванным сеансом, и источник с тех пор не менялся."""
+        return self.completed.get(rel_path) == tuple(source_fingerprint)
+
+    def cleanup_staging(self, dest_dir, source_dir):
+        """Разбирает промежуточные файлы прерванного сеанса: файл с контрольными точками для неизменного
+        источника оставляется для докопирования, остальные удаляются. Возвращает множество оставленных
+        промежуточных файлов (относительные пути)."""
+        kept = set()
+        for rel_path in sorted(self.staged):
+            target = os.path.join(dest_dir, rel_path + STAGING_SUFFIX)
+            if not os.path.exists(target): continue
+            try: stat = os.stat(os.path.join(source_dir, rel_path)); fingerprint = (stat.st_size, stat.st_mtime_ns)
+            except OSError: fingerprint = None
+            if fingerprint and self.resume_chunks(rel_path, fingerprint):
+                file_log.info(f"ПРОДОЛЖЕНИЕ: промежуточный файл {rel_path}{STAGING_SUFFIX} будет докопирован."); kept.add(rel_path + STAGING_SUFFIX); continue
+            try: os.unlink(target); file_log.info(f"Удален незавершенный промежуточный файл: {rel_path}{STAGING_SUFFIX}")
+            except OSError as e: logging.error(f"Не удалось удалить промежуточный файл {target}: {e}")
+        return kept
+
+    def close(self, finished=False):
+        """Закрывает журнал; после успешного сеанса он удаляется, иначе сохраняется для продолжения."""
+        with self.lock:
+            if self.file.closed: return
+            if not finished: self.file.flush(); os.fsync(self.file.fileno())
+            self.file.close()
+        if finished:
+            try: os.unlink(self.path)
+            except OSError as e: logging.error(f"Не удалось удалить журнал {self.path}: {e}")
+
+# --- Манифест назначения ---
+class DestManifest:
+    """Манифест в корне назначения (строки JSON): заголовок со схемой хеширования и записи
+    [путь, размер, mtime_ns, хеш] для файлов, записанных синхронизацией или хешированных при сканировании.
+    Пока размер и mtime файла совпадают с записью, хеш берется из манифеста без чтения файла.
+    В отличие от индекса хешей манифест лежит в самом назначении и не зависит от машины, с которой
+    идет синхронизация. Пути хранятся через '/', файл заменяется атомарно.
+    hash_engine=None — схема берется из заголовка (для проверки назначения)."""
+    def __init__(self, dest_dir, hash_engine=None):
+        self.path = os.path.join(dest_dir, MANIFEST_NAME)
+        self.lock = threading.Lock(); self.entries = {}; self.dirty = False; self.updated = None
+        header = self._load(hash_engine)
+        if hash_engine is None:
+            if not header: raise FileNotFoundError(f"Манифест не найден: {self.path}")
+            hash_engine = HashEngine(header['algorithm'], tree_chunk_size=header.get('tree_chunk_size', 0))
+        self.hash_engine = hash_engine
+
+    def _load(self, hash_engine):
+        """Читает манифест; записи другой схемы хеширования отбрасываются. Возвращает заголовок или None."""
+        try: f = open(self.path, encoding='utf-8')
+        except FileNotFoundError: return None
+        except OSError as e: logging.error(f"Не удалось прочитать манифест {self.path}: {e}"); return None
+        with f:
+            try: header = json.loads(f.readline())
+            except ValueError: header = None
+            if not isinstance(header, dict) or header.get('version') != MANIFEST_VERSION or header.get('algorithm') not in HASH_ALGORITHMS:
+                logging.warning(f"Манифест {self.path} поврежден или записан другой версией и будет построен заново."); return None
+            if hash_engine and header.get('scheme') != hash_engine.name:
+                logging.info(f"Манифест {self.path} записан схемой {header.get('scheme')} и будет построен заново для {hash_engine.name}."); self.dirty = True; return header
+            for line in f:
+                try: rel_path, size, mtime_ns, file_hash = json.loads(line)
+                except ValueError: continue
+                self.entries[rel_path.replace('/', os.sep)] = (size, mtime_ns, file_hash)
+        self.updated = header.get('updated')
+        return header
+
+    def get(self, rel_path, size, mtime_ns):
+        entry = self.entries.get(rel_path)
+        return entry[2] if entry and entry[0] == size and entry[1] == mtime_ns else None
+
+    def record(self, rel_path, size, mtime_ns, file_hash):
+        entry = (size, mtime_ns, file_hash)
+        with self.lock:
+            if self.entries.get(rel_path) != entry: self.entries[rel_path] = entry; self.dirty = True
+
+    def discard(self, rel_path):
+        with self.lock:
+            if self.entries.pop(rel_path, None) is not None: self.dirty = True
+
+    def prune(self, seen_rel_paths):
+        """Удаляет записи о файлах, которых больше нет в назначении. Только после полного сканирования."""
+        with self.lock:
+            stale = [rel_path for rel_path in self.entries if rel_path not in seen_rel_paths]
+            for rel_path in stale: del self.entries[rel_path]
+            if stale: self.dirty = True
+
+    def save(self):
+        """Записывает манифест во временный файл и заменяет им прежний, если были изменения."""
+        with self.lock:
+            if not self.dirty: return False
+            header = {'version': MANIFEST_VERSION, 'scheme': self.hash_engine.name, 'algorithm': self.hash_engine.algorithm,
+                      'tree_chunk_size': self.hash_engine.tree_chunk_size, 'updated': datetime.now().isoformat(timespec='seconds')}
+            temp_path = self.path + STAGING_SUFFIX
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                f.write(json.dumps(header) + "\n")
+                for rel_path, (size, mtime_ns, file_hash) in self.entries.items():
+                    f.write(json.dumps([rel_path.replace(os.sep, '/'), size, mtime_ns, file_hash], ensure_ascii=False) + "\n")
+                f.flush(); os.fsync(f.fileno())
+            os.replace(temp_path, self.path)
+            self.dirty = False; self.updated = header['updated']
+        return True
+
+# --- Лог ---
+# Строки об операциях с отдельными файлами; их подробность настраивается отдельно от итогов сеанса.
+file_log = logging.getLogger('sync.files')
+_log_listener = None
+
+class DirectQueueHandler(logging.handlers.QueueHandler):
+    """Кладет запись в очередь как есть: очередь живет внутри процесса, а форматирование выполняет поток записи лога."""
+    def prepare(self, record): return record
+
+class BatchingQueueListener(logging.handlers.QueueListener):
+    """Фоновый поток записи лога. Буферы обработчиков сбрасываются, когда очередь опустела:
+    под потоком записей строки уходят на диск пачками, а в паузах — сразу."""
+    def __init__(self, log_queue, *handlers): super().__init__(log_queue, *handlers, respect_handler_level=True)
+
+    def handle(self, record):
+        super().handle(record)
+        if self.queue.empty():
+            for handler in self.handlers: handler.flush()
+
+class BufferedStreamHandler(logging.StreamHandler):
+    """Вывод без сброса буфера на каждой строке: его сбрасывает BatchingQueueListener, а предупреждения и ошибки — сразу.
+    Строка состояния (show_status) держится под последней строкой лога и перерисовывается после каждой записи."""
+    status = ''
+
+    def emit(self, record):
+        try:
+            self.stream.write(('\r\x1b[K' if self.status else '') + self.format(record) + self.terminator + self.status)
+            if record.levelno >= logging.WARNING: self.flush()
+        except RecursionError: raise
+        except Exception: self.handleError(record)
+
+    def show_status(self, text):
+        self.acquire()
+        try: self.status = text; self.stream.write('\r\x1b[K' + text); self.stream.flush()
+        finally: self.release()
+
+class BufferedRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """Файл лога с ротацией по размеру и пакетной записью. Файл открыт в двоичном режиме, строка кодируется один раз,
+    и размер считается по записанным байтам, а не форматированием записи заново и позиционированием в файле,
+    как в RotatingFileHandler."""
+    def __init__(self, filename, max_bytes=LOG_MAX_MB * 1024 * 1024, backup_count=LOG_BACKUP_COUNT):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+        try: self.size = os.path.getsize(self.baseFilename)
+        except OSError: self.size = 0
+
+    def _open(self): return open(self.baseFilename, 'ab')
+
+    def emit(self, record):
+        try:
+            line = (self.format(record) + self.terminator).encode('utf-8', 'replace')
+            if self.maxBytes and self.size and self.size + len(line) > self.maxBytes: self.doRollover(); self.size = 0
+            if self.stream is None: self.stream = self._open()
+            self.stream.write(line); self.size += len(line)
+            if record.levelno >= logging.WARNING: self.flush()
+        except RecursionError: raise
+        except Exception: self.handleError(record)
+
+def show_console_status(text):
+    """Строка состояния (прогресс) под логом в консоли; пустая строка убирает ее."""
+    for handler in _log_listener.handlers if _log_listener else ():
+        if isinstance(handler, BufferedStreamHandler): handler.show_status(text)
+
+def set_log_verbosity(verbosity):
+    """Подробность лога (одно из LOG_LEVELS); меняется на лету."""
+    if verbosity not in LOG_LEVELS: raise ValueError(f"Неизвестная подробность лога: {verbosity} (допустимо: {', '.join(LOG_LEVELS)})")
+    logging.getLogger().setLevel(logging.WARNING if verbosity == 'errors' else logging.INFO)
+    file_log.setLevel({'errors': logging.WARNING, 'summary': logging.WARNING, 'files': logging.INFO, 'trace': logging.DEBUG}[verbosity])
+
+def stop_logging():
+    """Дописывает накопленные записи и останавливает поток записи лога."""
+    global _log_listener
+    if _log_listener is None: return
+    _log_listener.stop()
+    for handler in _log_listener.handlers: handler.close()
+    _log_listener = None
+
+atexit.register(stop_logging)
+
 # --- Функции ---
-def setup_logging(gui_log_handler=None):
-    handlers = [
-        logging.FileHandler(LOG_FILE, encoding='utf-8'),
-        logging.StreamHandler(sys.stdout)
-    ]
+def setup_logging(gui_log_handler=None, verbosity=None):
+    """Лог пишется фоновым потоком: вызовы logging в рабочих потоках только кладут запись в очередь.
+    Подробность и ротация берутся из секции [logging] config.ini; verbosity переопределяет подробность."""
+    config = configparser.ConfigParser()
+    config.read(CONFIG_FILE, encoding='utf-8')
+    verbosity = verbosity or config.get('logging', 'level', fallback=DEFAULT_LOG_LEVEL)
+    max_bytes = int(config.getfloat('logging', 'max_mb', fallback=LOG_MAX_MB) * 1024 * 1024)
+    backup_count = config.getint('logging', 'backup_count', fallback=LOG_BACKUP_COUNT)
+    stop_logging()
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+    handlers = [BufferedRotatingFileHandler(LOG_FILE, max_bytes, backup_count), BufferedStreamHandler(sys.stdout)]
     if gui_log_handler: handlers.append(gui_log_handler)
-    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', handlers=handlers, force=True)
+    for handler in handlers:
+        if handler.formatter is None: handler.setFormatter(formatter)
+    root = logging.getLogger()
+    for handler in root.handlers[:]: root.removeHandler(handler); handler.close()
+    log_queue = queue.SimpleQueue()
+    root.addHandler(DirectQueueHandler(log_queue))
+    global _log_listener
+    _log_listener = BatchingQueueListener(log_queue, *handlers); _log_listener.start()
+    try: set_log_verbosity(verbosity)
+    except ValueError as e: set_log_verbosity(DEFAULT_LOG_LEVEL); logging.warning(f"{e}; используется {DEFAULT_LOG_LEVEL}.")
 
 def send_telegram_notification(message):
     config = configparser.ConfigParser()
@@ -62,53 +1263,608 @@ def ensure_path_is_ready(path_str, net_creds=None):
         else: logging.warning(f"Автоматическое подключение не реализовано для {sys.platform}."); return False
     except (subprocess.CalledProcessError, FileNotFoundError) as e: logging.error(f"Не удалось подключить сетевой диск '{path_str}': {e}"); return False
 
-def calculate_file_hash(file_path):
-    hasher = HASH_ALGORITHM()
+def calculate_file_hash(file_path, hash_engine=None):
+    return (hash_engine or DEFAULT_HASH_ENGINE).hash_file(file_path)
+
+class SparseLayout:
+    """Участки с данными [(начало, конец)] разреженного файла в пределах [start, end), найденные через
+    SEEK_DATA/SEEK_HOLE; между ними — дыры, которые не нужно ни читать, ни записывать."""
+    def __init__(self, extents, end):
+        self.extents = extents; self.end = end; self.ends = [stop for _, stop in extents]
+
+    @classmethod
+    def probe(cls, fd, start=0, end=None):
+        """Карта участков файла fd или None, если файл не разрежен (все блоки выделены) или ФС не умеет искать дыры.
+        Позиция fd не меняется."""
+        if not hasattr(os, 'SEEK_DATA'): return None
+        stat = os.fstat(fd)
+        if not S_ISREG(stat.st_mode) or getattr(stat, 'st_blocks', None) is None or stat.st_blocks * 512 >= stat.st_size: return None
+        end = stat.st_size if end is None else min(end, stat.st_size)
+        position = os.lseek(fd, 0, os.SEEK_CUR); extents = []; offset = start
+        try:
+            while offset < end:
+                try: data = os.lseek(fd, offset, os.SEEK_DATA)
+                except OSError as e:
+                    if e.errno == errno.ENXIO: break  # дальше до конца файла одна дыра
+                    raise
+                if data >= end: break
+                hole = min(os.lseek(fd, data, os.SEEK_HOLE), end)
+                extents.append((data, hole)); offset = hole
+        except OSError as e:
+            if e.errno in (errno.EINVAL, errno.EOPNOTSUPP): return None
+            raise
+        finally: os.lseek(fd, position, os.SEEK_SET)
+        return cls(extents, end)
+
+    def data_in(self, start, end):
+        """Участки с данными, пересекающие [start, end), обрезанные по его границам."""
+        for data, hole in self.extents[bisect.bisect_right(self.ends, start):]:
+            if data >= end: break
+            yield max(data, start), min(hole, end)
+
+    def has_data(self, start, end): return next(self.data_in(start, end), None) is not None
+
+@functools.lru_cache(maxsize=4)
+def _zero_chunk_digest(length): return _chunk_digest(bytes(length))
+
+@functools.lru_cache(maxsize=4)
+def _zero_delta_digest(length): return hashlib.blake2b(bytes(length), digest_size=DELTA_DIGEST_SIZE).digest()
+
+def _copy_extents(fsrc, fdst, layout, stop_event=None, buffer_size=COPY_BUFFER_SIZE, on_progress=None, chunk_size=COPY_CHUNK_SIZE, hasher=None):
+    """Копирует только участки с данными разреженного файла, оставляя на месте дыр дыры в копии.
+    Без хешера данные переносит copy_file_range, иначе они читаются, а дыры подаются в хешер нулями.
+    on_progress получает только байты данных. Позиции обоих файлов в конце — на конце файла."""
+    in_fd, out_fd = fsrc.fileno(), fdst.fileno()
+    copy_range = getattr(os, 'copy_file_range', None) if hasher is None else None
+    view = None; position = 0
+    for start, end in layout.extents:
+        if hasher: hasher.update_zeros(start - position)
+        while start < end:
+            if stop_event and stop_event.is_set(): raise SyncCancelledError("Прервано во время копирования файла.")
+            n = 0
+            if copy_range:
+                try: n = copy_range(in_fd, out_fd, min(chunk_size, end - start), start, start)
+                except OSError as e:
+                    if e.errno not in COPY_FALLBACK_ERRNOS: raise
+                    copy_range = None
+            if not n:
+                if view is None: view = memoryview(bytearray(buffer_size))
+                n = os.preadv(in_fd, [view[:min(buffer_size, end - start)]], start)
+                if not n: break  # источник укоротился во время копирования
+                os.pwrite(out_fd, view[:n], start)
+                if hasher: hasher.update(view[:n])
+            start += n
+            if on_progress: on_progress(n)
+        position = end
+    if hasher: hasher.update_zeros(layout.end - position)
+    os.ftruncate(out_fd, layout.end)
+    os.lseek(in_fd, layout.end, os.SEEK_SET); os.lseek(out_fd, layout.end, os.SEEK_SET)
+
+def _preallocate(in_fd, out_fd, offset, length):
+    """Резервирует место под копию (posix_fallocate): файл ложится меньшим числом экстентов, а нехватка места
+    обнаруживается до копирования. Внутри одной ФС не выполняется: там copy_file_range может склонировать блоки.
+    Возвращает True, если место выделено — тогда после копирования лишний хвост нужно отрезать."""
+    if length < PREALLOCATE_MIN_SIZE or not hasattr(os, 'posix_fallocate') or os.fstat(in_fd).st_dev == os.fstat(out_fd).st_dev: return False
+    try: os.posix_fallocate(out_fd, offset, length); return True
+    except OSError as e:
+        if e.errno in (errno.EOPNOTSUPP, errno.EINVAL, errno.ENOSYS): return False
+        raise
+
+@functools.lru_cache(maxsize=None)
+def _libc_fallocate():
+    """fallocate(2) из libc (в os есть только posix_fallocate без флагов) или None, если недоступен."""
+    if not sys.platform.startswith('linux'): return None
+    try:
+        libc = ctypes.CDLL(None, use_errno=True); fallocate = getattr(libc, 'fallocate64', None) or libc.fallocate
+    except (OSError, AttributeError): return None
+    fallocate.argtypes = (ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64); fallocate.restype = ctypes.c_int
+    return fallocate
+
+def _punch_hole(fd, offset, length):
+    """Освобождает блоки [offset, offset + length) файла, не меняя его размер: участок читается как нули.
+    Часть за текущим концом файла не трогается — там дыру создаст последующее расширение файла.
+    Возвращает False, если ФС или платформа не умеет пробивать дыры: тогда нули нужно записать."""
+    size = os.fstat(fd).st_size
+    if offset >= size: return True
+    fallocate = _libc_fallocate()
+    if fallocate is None: return False
+    if fallocate(fd, FALLOC_FL_PUNCH_HOLE | FALLOC_FL_KEEP_SIZE, offset, min(length, size - offset)) == 0: return True
+    error = ctypes.get_errno()
+    if error in (errno.EOPNOTSUPP, errno.EINVAL, errno.ENOSYS): return False
+    raise OSError(error, os.strerror(error))
+
+def _copy_data(fsrc, fdst, stop_event=None, buffer_size=COPY_BUFFER_SIZE, on_progress=None, chunk_size=COPY_CHUNK_SIZE, preallocate=False):
+    """Копирует содержимое самым быстрым доступным способом и возвращает его название:
+    reflink -> sparse (только участки с данными разреженного файла) -> copy_file_range -> sendfile -> readinto.
+    on_progress(байт) вызывается после каждого блока; chunk_size — блок copy_file_range/sendfile;
+    preallocate — заранее выделить место под крупную копию (см. _preallocate)."""
+    if fcntl and sys.platform.startswith('linux'):
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno()); return 'reflink'
+        except OSError as e:
+            if e.errno not in COPY_FALLBACK_ERRNOS: raise
+    in_fd, out_fd = fsrc.fileno(), fdst.fileno()
+    layout = SparseLayout.probe(in_fd)
+    if layout is not None: _copy_extents(fsrc, fdst, layout, stop_event, buffer_size, on_progress, chunk_size); return 'sparse'
+    preallocated = preallocate and _preallocate(in_fd, out_fd, 0, os.fstat(in_fd).st_size)
+    method = None
+    for name, call in (('copy_file_range', getattr(os, 'copy_file_range', None)), ('sendfile', getattr(os, 'sendfile', None) if sys.platform.startswith('linux') else None)):
+        if not call: continue
+        try:
+            copied = 0
+            while True:
+                if stop_event and stop_event.is_set(): raise SyncCancelledError("Прервано во время копирования файла.")
+                sent = call(in_fd, out_fd, chunk_size) if name == 'copy_file_range' else call(out_fd, in_fd, None, chunk_size)
+                if not sent: break
+                copied += sent
+                if on_progress: on_progress(sent)
+            # Нулевой результат сразу бывает на псевдофайлах (/proc и т.п.) — тогда дочитываем обычным способом.
+            if copied or os.fstat(in_fd).st_size == 0: method = name; break
+        except OSError as e:
+            # Позиции обоих файлов согласованы, поэтому следующий способ продолжает с того же места.
+            if e.errno not in COPY_FALLBACK_ERRNOS: raise
+    if not method:
+        buffer = bytearray(buffer_size); view = memoryview(buffer); method = 'readinto'
+        while n := fsrc.readinto(buffer):
+            if stop_event and stop_event.is_set(): raise SyncCancelledError("Прервано во время копирования файла.")
+            fdst.write(view[:n])
+            if on_progress: on_progress(n)
+    if preallocated:
+        # Источник мог укоротиться во время копирования: выделенный сверх данных хвост отрезается.
+        fdst.flush(); os.ftruncate(out_fd, os.lseek(out_fd, 0, os.SEEK_CUR))
+    return method
+
+def copy_file(source_file, target_file, stop_event=None, buffer_size=COPY_BUFFER_SIZE, on_progress=None, chunk_size=COPY_CHUNK_SIZE, preallocate=False):
+    """Замена shutil.copy2: копирует данные через _copy_data, затем время изменения и права доступа."""
+    with open(source_file, 'rb') as fsrc, open(target_file, 'wb') as fdst: method = _copy_data(fsrc, fdst, stop_event, buffer_size, on_progress, chunk_size, preallocate)
+    shutil.copystat(source_file, target_file)
+    return method
+
+def copy_file_hashed(source_file, target_file, stop_event=None, verify='trust', hash_engine=None, buffer_size=COPY_BUFFER_SIZE, on_progress=None, preallocate=False):
+    """Копирует файл за один проход чтения, одновременно вычисляя хеш данных.
+    verify='reread' после записи сбрасывает кеш и перечитывает копию с диска для сверки хеша.
+    Разреженный файл копируется с дырами (_copy_extents); preallocate — как у _copy_data."""
+    hasher = (hash_engine or DEFAULT_HASH_ENGINE).hasher()
+    with open(source_file, 'rb') as fsrc, open(target_file, 'wb') as fdst:
+        layout = SparseLayout.probe(fsrc.fileno())
+        if layout is not None: _copy_extents(fsrc, fdst, layout, stop_event, buffer_size, on_progress, hasher=hasher)
+        else:
+            preallocated = preallocate and _preallocate(fsrc.fileno(), fdst.fileno(), 0, os.fstat(fsrc.fileno()).st_size)
+            buffer = bytearray(buffer_size); view = memoryview(buffer)
+            while n := fsrc.readinto(buffer):
+                if stop_event and stop_event.is_set(): raise SyncCancelledError("Прервано во время копирования файла.")
+                hasher.update(view[:n]); fdst.write(view[:n])
+                if on_progress: on_progress(n)
+            if preallocated: fdst.truncate()
+        if verify == 'reread':
+            fdst.flush(); os.fsync(fdst.fileno())
+            if hasattr(os, 'posix_fadvise'): os.posix_fadvise(fdst.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+    shutil.copystat(source_file, target_file)
+    file_hash = hasher.hexdigest()
+    if verify == 'reread' and calculate_file_hash(target_file, hash_engine) != file_hash:
+        raise IOError(f"Хеш записанной копии не совпадает с хешем источника: {target_file}")
+    return file_hash
+
+def _read_full(f, view):
+    """Заполняет view данными из f целиком (readinto может вернуть меньше); возвращает число байт."""
+    total = 0
+    while total < len(view):
+        n = f.readinto(view[total:])
+        if not n: break
+        total += n
+    return total
+
+def _chunk_digest(data): return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+def copy_file_resumable(source_file, target_file, stop_event=None, verify='none', hash_engine=None, chunks=(), on_chunk=None, on_progress=None, preallocate=False):
+    """Копирует крупный файл в промежуточный target_file блоками по RESUME_CHUNK_SIZE, вызывая после каждого
+    on_chunk(номер, дайджест) для контрольной точки. chunks — дайджесты блоков, записанных прерванным сеансом:
+    совпадающий префикс target_file не копируется заново, копия продолжается с первого несовпавшего блока.
+    verify — как у copy_file_hashed ('none' — без хеша файла). on_progress(байт, записано=None) для проверенного префикса
+    получает записано=0. Блоки разреженного источника, целиком попавшие в дыру, не читаются и остаются дырами в копии;
+    preallocate — как у _copy_data. Возвращает (способ, хеш или None, байт из прошлого сеанса)."""
+    hasher = (hash_engine or DEFAULT_HASH_ENGINE).hasher() if verify != 'none' else None
+    resume = bool(chunks) and os.path.exists(target_file)
+    method = None; offset = 0
+    with open(source_file, 'rb') as fsrc, open(target_file, 'r+b' if resume else 'wb') as fdst:
+        if not resume and not hasher and fcntl and sys.platform.startswith('linux'):
+            # Мгновенной reflink-копии контрольные точки не нужны.
+            try: fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno()); method = 'reflink'
+            except OSError as e:
+                if e.errno not in COPY_FALLBACK_ERRNOS: raise
+        if not method:
+            buffer = bytearray(RESUME_CHUNK_SIZE); view = memoryview(buffer)
+            index = 0; method = 'chunked'; layout = SparseLayout.probe(fsrc.fileno())
+            for digest in chunks if resume else ():
+                n = _read_full(fdst, view)
+                if not n or _chunk_digest(view[:n]) != digest: break
+                if hasher: hasher.update(view[:n])
+                if on_progress: on_progress(n, 0)
+                index += 1; offset += n; method = 'resumed'
+            # Все, что дальше проверенного префикса, могло быть записано не полностью — копируется заново.
+            fsrc.seek(offset); fdst.seek(offset); fdst.truncate(); position = offset
+            if layout is None and preallocate: _preallocate(fsrc.fileno(), fdst.fileno(), offset, os.fstat(fsrc.fileno()).st_size - offset)
+            while True:
+                if stop_event and stop_event.is_set(): raise SyncCancelledError("Прервано во время копирования файла.")
+                if layout is not None and not layout.has_data(position, position + RESUME_CHUNK_SIZE):
+                    n = min(RESUME_CHUNK_SIZE, layout.end - position)
+                    if n <= 0: break
+                    # Блок целиком в дыре источника: не читается и не пишется, в копии на его месте тоже дыра.
+                    if hasher: hasher.update_zeros(n)
+                    fsrc.seek(position + n); fdst.seek(position + n)
+                    if on_chunk: on_chunk(index, _zero_chunk_digest(n))
+                else:
+                    n = _read_full(fsrc, view)
+                    if not n: break
+                    if hasher: hasher.update(view[:n])
+                    if layout is None: fdst.write(view[:n])
+                    else:
+                        # Нули из дыр внутри блока тоже не пишутся: в копию попадают только участки с данными.
+                        for start, end in layout.data_in(position, position + n): fdst.seek(start); fdst.write(view[start - position:end - position])
+                        fdst.seek(position + n)
+                    fdst.flush()
+                    if on_chunk: on_chunk(index, _chunk_digest(view[:n]))
+                    if on_progress: on_progress(n)
+                index += 1; position += n
+            # Длина копии — по источнику: дыра в конце файла и выделенный заранее хвост задаются здесь.
+            fdst.truncate(position)
+            if verify == 'reread':
+                os.fsync(fdst.fileno())
+                if hasattr(os, 'posix_fadvise'): os.posix_fadvise(fdst.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+    shutil.copystat(source_file, target_file)
+    file_hash = hasher.hexdigest() if hasher else None
+    if verify == 'reread' and calculate_file_hash(target_file, hash_engine) != file_hash:
+        raise IOError(f"Хеш записанной копии не совпадает с хешем источника: {target_file}")
+    return method, file_hash, offset
+
+def copy_file_delta(source_file, dest_file, target_file, stop_event=None, verify='none', hash_engine=None, signature=None, block_size=DELTA_BLOCK_SIZE, on_progress=None):
+    """Обновляет крупный файл назначения блочной дельтой: источник читается блоками по block_size, а в target_file
+    записываются только блоки, отличающиеся от блоков dest_file. signature — дайджесты блоков dest_file из индекса
+    хешей, тогда назначение не читается; None — блоки назначения читаются и сравниваются побайтно.
+    Промежуточный target_file (не равный dest_file) сначала заполняется копией назначения через _copy_data,
+    то есть reflink или копированием на стороне сервера, где они доступны. verify — как у copy_file_hashed.
+    on_progress(байт, записано) получает записано=0 для совпавших блоков. Блоки в дырах разреженного источника
+    не читаются (их содержимое — нули) и в on_progress не попадают; измененные такие блоки не записываются,
+    а пробиваются дырой в target_file (см. _punch_hole) и входят только в байты измененных блоков.
+    Возвращает (хеш или None, прочитано байт, записано байт, байт в измененных блоках, дайджесты блоков новой копии)."""
+    hasher = (hash_engine or DEFAULT_HASH_ENGINE).hasher() if verify != 'none' else None
+    read_bytes = written_bytes = changed_bytes = 0
+    if os.path.abspath(target_file) != os.path.abspath(dest_file):
+        with open(dest_file, 'rb') as fsrc, open(target_file, 'wb') as fdst:
+            method = _copy_data(fsrc, fdst, stop_event)
+            # Разреженная копия переносит только участки с данными — их объем виден по выделенным блокам.
+            if method != 'reflink': written_bytes = read_bytes = os.fstat(fdst.fileno()).st_blocks * 512 if method == 'sparse' else fdst.tell()
+    buffer = bytearray(block_size); view = memoryview(buffer)
+    old_view = memoryview(bytearray(block_size)) if signature is None else None
+    digests = bytearray(); offset = index = 0
+    with open(source_file, 'rb') as fsrc, open(target_file, 'r+b') as fdst:
+        layout = SparseLayout.probe(fsrc.fileno()); zeros = memoryview(bytes(block_size)) if layout is not None else None
+        while True:
+            if stop_event and stop_event.is_set(): raise SyncCancelledError("Прервано во время копирования файла.")
+            hole = layout is not None and not layout.has_data(offset, offset + block_size)
+            if hole:
+                n = min(block_size, layout.end - offset)
+                if n <= 0: break
+                data = zeros[:n]; fsrc.seek(offset + n)
+                if hasher: hasher.update_zeros(n)
+                digest = _zero_delta_digest(n)
+            else:
+                n = _read_full(fsrc, view)
+                if not n: break
+                data = view[:n]; read_bytes += n
+                if hasher: hasher.update(data)
+                digest = hashlib.blake2b(data, digest_size=DELTA_DIGEST_SIZE).digest()
+            digests += digest
+            if signature is not None: changed = signature[index * DELTA_DIGEST_SIZE:(index + 1) * DELTA_DIGEST_SIZE] != digest
+            else:
+                fdst.seek(offset); old = _read_full(fdst, old_view[:n]); read_bytes += old
+                changed = old != n or old_view[:n] != data
+            if changed:
+                changed_bytes += n
+                if hole: fdst.flush()
+                if not (hole and _punch_hole(fdst.fileno(), offset, n)): fdst.seek(offset); fdst.write(data); written_bytes += n
+            if on_progress and not hole: on_progress(n, n if changed else 0)
+            offset += n; index += 1
+        # Хвост назначения за концом источника отрезается.
+        fdst.truncate(offset)
+        if verify == 'reread':
+            fdst.flush(); os.fsync(fdst.fileno())
+            if hasattr(os, 'posix_fadvise'): os.posix_fadvise(fdst.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+    shutil.copystat(source_file, target_file)
+    file_hash = hasher.hexdigest() if hasher else None
+    if verify == 'reread' and calculate_file_hash(target_file, hash_engine) != file_hash:
+        raise IOError(f"Хеш записанной копии не совпадает с хешем источника: {target_file}")
+    return file_hash, read_bytes, written_bytes, changed_bytes, digests
+
+def _measured_hash(file_path, hash_engine=None, metrics=None):
+    """calculate_file_hash с учетом прочитанных байт и времени в метриках сеанса."""
+    if not metrics: return calculate_file_hash(file_path, hash_engine)
+    started = time.monotonic(); file_hash = calculate_file_hash(file_path, hash_engine)
+    if not file_hash: return file_hash
+    try: size = os.path.getsize(file_path)
+    except OSError: size = 0
+    metrics.add(bytes_read=size, bytes_hashed=size, files_hashed=1, hash_cache_misses=1)
+    metrics.file_done('hash', file_path, time.monotonic() - started, size)
+    return file_hash
+
+def calculate_file_hash_cached(file_path, hash_index=None, index_root=None, rel_path=None, compute=True, hash_engine=None, metrics=None, manifest=None):
+    """Хеш файла из манифеста назначения или индекса хешей, а при их промахе — вычисленный (если compute)."""
+    if not hash_index and not manifest: return _measured_hash(file_path, hash_engine, metrics) if compute else None
+    try: stat = os.stat(file_path)
+    except OSError: return _measured_hash(file_path, hash_engine, metrics) if compute else None
+    rel_path = str(rel_path); fingerprint = (stat.st_size, stat.st_mtime_ns, stat.st_ino, stat.st_dev)
+    file_hash = manifest.get(rel_path, stat.st_size, stat.st_mtime_ns) if manifest else None
+    if not file_hash and hash_index: file_hash = hash_index.get(index_root, rel_path, fingerprint)
+    if file_hash and metrics: metrics.add(hash_cache_hits=1)
+    if file_hash or not compute: return file_hash
+    file_hash = _measured_hash(file_path, hash_engine, metrics)
+    if file_hash and hash_index: hash_index.update(index_root, [(rel_path, fingerprint, file_hash)])
+    if file_hash and manifest: manifest.record(rel_path, stat.st_size, stat.st_mtime_ns, file_hash)
+    return file_hash
+
+def _list_dir(abs_dir, sort=False):
     try:
-        with open(file_path, 'rb') as f:
-            while chunk := f.read(READ_BUFFER_SIZE): hasher.update(chunk)
-        return hasher.hexdigest()
-    except (IOError, PermissionError) as e: logging.error(f"Не удалось прочитать файл {file_path}: {e}"); return None
-
-def get_files_map(directory, exclude_patterns=None, stop_event=None, comparison_mode='accurate', use_parallel=False):
-    files_map = {}
-    root_path = Path(directory)
-    logging.info(f"Сканирование директории: {directory} (Режим: {comparison_mode}, Параллельно: {use_parallel})")
-    files_to_process = []
-    for file_path in root_path.rglob('*'):
-        if stop_event and stop_event.is_set(): raise SyncCancelledError("Сканирование прервано.")
-        if file_path.is_file():
-            if exclude_patterns and any(fnmatch.fnmatch(file_path.name, pattern) for pattern in exclude_patterns):
-                logging.info(f"ИСКЛЮЧЕНИЕ: Файл '{file_path.name}' по шаблону."); continue
+        with os.scandir(abs_dir) as it: entries = list(it)
+    except OSError as e: logging.error(f"Не удалось прочитать директорию {abs_dir}: {e}"); return []
+    if sort: entries.sort(key=lambda entry: entry.name)
+    return entries
+
+def collapse_paths(rel_paths):
+    """Нормализует набор относительных путей, убирая пути, вложенные в другие пути набора."""
+    result = []
+    for rel_path in sorted({os.path.normpath(p) for p in rel_paths if p and p != '.'}, key=lambda p: p.split(os.sep)):
+        if not result or not rel_path.startswith(result[-1] + os.sep): result.append(rel_path)
+    return result
+
+def scan_tree(directory, exclude_patterns=None, stop_event=None, sort=False, subpaths=None, _prefix=''):
+    """Обходит дерево через os.scandir, возвращая (rel_path, path, stat) для каждого файла.
+    Исключенные папки отсекаются до входа в них. При sort=True файлы выдаются в порядке
+    покомпонентного сравнения путей, что позволяет сливать два дерева на лету.
+    subpaths ограничивает обход перечисленными файлами и папками (относительно directory).
+    exclude_patterns — список шаблонов или ExcludeMatcher."""
+    excludes = ExcludeMatcher.compile(exclude_patterns)
+    if subpaths is not None:
+        for rel_path in collapse_paths(subpaths):
+            parts = rel_path.split(os.sep)
+            if parts[0] in SERVICE_NAMES or parts[0] == os.pardir: continue
+            path = os.path.join(directory, rel_path)
             try:
-                stat = file_path.stat()
-                files_to_process.append({'path': file_path, 'rel_path': file_path.relative_to(root_path), 'size': stat.st_size, 'mtime': stat.st_mtime})
-            except FileNotFoundError: continue
-    
-    def process_file(file_info):
-        if stop_event and stop_event.is_set(): return None
-        if comparison_mode == 'hybrid': return file_info['rel_path'], (file_info['size'], file_info['mtime'], None)
-        file_hash = calculate_file_hash(file_info['path'])
-        return (file_info['rel_path'], file_hash) if file_hash else None
-
-    if use_parallel:
-        with concurrent.futures.ThreadPoolExecutor() as executor: results = executor.map(process_file, files_to_process)
-    else:
-        results = map(process_file, files_to_process)
-    for result in results:
-        if result: rel_path, data = result; files_map[rel_path] = data
+                is_dir = os.path.isdir(path) and not os.path.islink(path)
+                if excludes and excludes.excludes_path(rel_path, is_dir): continue
+                if is_dir: yield from scan_tree(path, excludes, stop_event, sort, _prefix=rel_path + os.sep); continue
+                stat = os.stat(path)
+            except (FileNotFoundError, NotADirectoryError): continue
+            if S_ISREG(stat.st_mode): yield rel_path, path, stat
+        return
+    stack = [(_prefix, iter(_list_dir(os.fspath(directory), sort)))]
+    while stack:
+        rel_dir, entries = stack[-1]
+        entry = next(entries, None)
+        if entry is None: stack.pop(); continue
+        if not rel_dir and entry.name in SERVICE_NAMES: continue
+        rel_path = rel_dir + entry.name
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                if excludes and excludes.match(rel_path, is_dir=True):
+                    if file_log.isEnabledFor(logging.DEBUG): file_log.debug(f"ИСКЛЮЧЕНИЕ: Папка '{rel_path}' по шаблону.")
+                    continue
+                if stop_event and stop_event.is_set(): raise SyncCancelledError("Сканирование прервано.")
+                stack.append((rel_path + os.sep, iter(_list_dir(entry.path, sort))))
+            elif entry.is_file():
+                if excludes and excludes.match(rel_path):
+                    if file_log.isEnabledFor(logging.DEBUG): file_log.debug(f"ИСКЛЮЧЕНИЕ: Файл '{rel_path}' по шаблону.")
+                    continue
+                yield rel_path, entry.path, entry.stat()
+        except FileNotFoundError: continue
+
+def merge_trees(source_iter, dest_iter):
+    """Сливает два отсортированных обхода scan_tree, выдавая пары (source_item, dest_item); отсутствующая сторона — None."""
+    sort_key = lambda item: item[0].split(os.sep)
+    source_item, dest_item = next(source_iter, None), next(dest_iter, None)
+    while source_item or dest_item:
+        if dest_item is None or (source_item and sort_key(source_item) < sort_key(dest_item)):
+            yield source_item, None; source_item = next(source_iter, None)
+        elif source_item is None or sort_key(dest_item) < sort_key(source_item):
+            yield None, dest_item; dest_item = next(dest_iter, None)
+        else:
+            yield source_item, dest_item; source_item, dest_item = next(source_iter, None), next(dest_iter, None)
+
+def get_files_map(directory, exclude_patterns=None, stop_event=None, comparison_mode='accurate', use_parallel=False, hash_index=None, progress_callback=None, subpaths=None, hash_engine=None, storage=None, metrics=None, skip_paths=None, manifest=None):
+    """Карта файлов дерева (FileTable); skip_paths — относительные пути, которые не попадают в карту.
+    manifest (DestManifest) назначения подставляет хеши файлов с неизменными размером и mtime и пополняется вычисленными."""
+    hash_engine = hash_engine or DEFAULT_HASH_ENGINE
+    walk_started = time.monotonic()
+    if subpaths is None: logging.info(f"Сканирование директории: {directory} (Режим: {comparison_mode}, Параллельно: {use_parallel})")
+    accurate = comparison_mode == 'accurate'
+    files_map = FileTable(hash_engine.digest_size if accurate else 0)
+    # Остальная часть отпечатка нужна только индексу хешей и живет до конца сканирования.
+    mtimes_ns = array('q'); inodes = array('Q'); devices = array('Q')
+    walk_progress = ProgressMeter(progress_callback, "найдено")
+    for rel_path, _, stat in scan_tree(directory, exclude_patterns, stop_event, subpaths=subpaths):
+        if skip_paths and rel_path in skip_paths: continue
+        files_map.add(rel_path, stat.st_size, stat.st_mtime)
+        if accurate: mtimes_ns.append(stat.st_mtime_ns); inodes.append(stat.st_ino); devices.append(stat.st_dev)
+        walk_progress.advance(stat.st_size, 1)
+    if metrics: metrics.add_time('walk', time.monotonic() - walk_started)
+
+    index_root = HashIndex.root_key(directory) if hash_index else None
+    # Устаревшие записи индекса можно удалять только после полного обхода дерева.
+    prune_index = hash_index and subpaths is None
+    if manifest and subpaths is None: manifest.prune(files_map)
+    if not accurate:
+        if prune_index: hash_index.prune(index_root, files_map)
+        return files_map
+    cached = hash_index.load(index_root) if hash_index else {}
+    root = os.fspath(directory)
+
+    fingerprint_of = lambda file_id: (files_map.sizes[file_id], mtimes_ns[file_id], inodes[file_id], devices[file_id])
+    # Хеши из индекса подставляются сразу; в пул уходят только файлы, которые нужно прочитать.
+    misses = []; hits = manifest_hits = 0
+    for file_id in range(len(files_map)):
+        rel_path = files_map.rel_path(file_id)
+        file_hash = manifest.get(rel_path, files_map.sizes[file_id], mtimes_ns[file_id]) if manifest else None
+        if file_hash: manifest_hits += 1
+        else:
+            entry = cached.get(rel_path)
+            if entry and entry[:4] == fingerprint_of(file_id):
+                file_hash = entry[4]
+                if manifest: manifest.record(rel_path, files_map.sizes[file_id], mtimes_ns[file_id], file_hash)
+        if file_hash: files_map.set_digest(file_id, bytes.fromhex(file_hash)); hits += 1
+        else: misses.append(file_id)
+
+    workers = storage.hash_workers(hash_engine.workers) if storage else hash_engine.workers
+    buffer_size = storage.buffer_size if storage else READ_BUFFER_SIZE
+    if storage and storage.seek_order:
+        misses.sort(key=lambda file_id: physical_offset(os.path.join(root, files_map.rel_path(file_id)), inodes[file_id]))
+
+    pending = []
+    executor = hash_engine.executor(workers) if use_parallel and misses and workers > 1 else None
+    hash_started = file_started = time.monotonic()
+    if metrics: metrics.add(hash_cache_hits=hits)
+    # Без пула байты засчитываются по ходу чтения, с пулом — по готовым файлам.
+    hash_progress = ProgressMeter(progress_callback if misses else None, "хеширование", sum(files_map.sizes[file_id] for file_id in misses), len(misses))
+    try:
+        paths = (os.path.join(root, files_map.rel_path(file_id)) for file_id in misses)
+        for file_id, file_hash in zip(misses, hash_engine.hash_many(paths, executor, buffer_size, None if executor else hash_progress.advance)):
+            if stop_event and stop_event.is_set(): break
+            rel_path = files_map.rel_path(file_id)
+            hash_progress.advance(files_map.sizes[file_id] if executor else 0, 1, rel_path)
+            if not file_hash: files_map.discard(rel_path); continue
+            files_map.set_digest(file_id, bytes.fromhex(file_hash))
+            if metrics:
+                size = files_map.sizes[file_id]
+                metrics.add(bytes_read=size, bytes_hashed=size, files_hashed=1, hash_cache_misses=1)
+                # Время отдельного файла известно только без пула: из пула результаты приходят пачками.
+                if not executor: now = time.monotonic(); metrics.file_done('hash', os.path.join(root, rel_path), now - file_started, size); file_started = now
+            if manifest: manifest.record(rel_path, files_map.sizes[file_id], mtimes_ns[file_id], file_hash)
+            if not hash_index: continue
+            pending.append((rel_path, fingerprint_of(file_id), file_hash))
+            if len(pending) >= HASH_INDEX_BATCH_SIZE: hash_index.update(index_root, pending); pending = []
+    finally:
+        if executor: executor.shutdown(cancel_futures=True)
+        # Уже вычисленные хеши сохраняются даже при отмене или ошибке.
+        if pending: hash_index.update(index_root, pending)
+        if metrics: metrics.add_time('hash', time.monotonic() - hash_started)
+    if stop_event and stop_event.is_set(): raise SyncCancelledError("Сканирование прервано.")
+    hash_progress.finish()
+    if manifest and subpaths is None: logging.info(f"Манифест назначения: {manifest_hits} из {len(files_map)} хешей взяты без чтения файлов.")
+    if prune_index:
+        logging.info(f"Индекс хешей: {hits} из {len(files_map)} файлов не потребовали пересчета.")
+        hash_index.prune(index_root, files_map)
     return files_map
 
-def sync_folders(source_dir, dest_dir, no_overwrite, delete_removed, sync_empty_dirs=False, exclude_patterns=None, stop_event=None, comparison_mode='accurate', use_parallel=False, use_staging=False, use_trash=False, progress_callback=None):
+def detect_moves(source_files, dest_files, source_dir, dest_dir, comparison_mode='accurate', hash_index=None, stop_event=None, hash_engine=None, metrics=None, manifest=None):
+    """Сопоставляет новые файлы источника с файлами, которые есть только в назначении.
+    Кандидаты подбираются по размеру (в точном режиме сразу по хешу) и подтверждаются хешем.
+    Возвращает список пар (новый путь, старый путь) для переименования внутри назначения."""
+    new_files = [rel_path for rel_path in source_files if rel_path not in dest_files]
+    orphans = [rel_path for rel_path in dest_files if rel_path not in source_files]
+    if not new_files or not orphans: return []
+    source_index_root = HashIndex.root_key(source_dir) if hash_index else None
+    dest_index_root = HashIndex.root_key(dest_dir) if hash_index else None
+    # В гибридном режиме кандидаты группируются по размеру, в точном — сразу по двоичному хешу.
+    key_of = lambda files, rel_path: files.sizes[files.get(rel_path)] if comparison_mode == 'hybrid' else files.digest(files.get(rel_path))
+    candidates = {}
+    for rel_path in orphans: candidates.setdefault(key_of(dest_files, rel_path), []).append(rel_path)
+    if comparison_mode == 'hybrid':
+        orphan_hashes = {}
+        def orphan_hash(rel_path):
+            if rel_path not in orphan_hashes:
+                orphan_hashes[rel_path] = calculate_file_hash_cached(Path(dest_dir) / rel_path, hash_index, dest_index_root, rel_path, hash_engine=hash_engine, metrics=metrics, manifest=manifest)
+            return orphan_hashes[rel_path]
+
+    moves = []
+    for rel_path in new_files:
+        if stop_event and stop_event.is_set(): raise SyncCancelledError("Прервано на этапе поиска перемещений.")
+        group = candidates.get(key_of(source_files, rel_path))
+        if not group: continue
+        # Файл с тем же именем — самый вероятный кандидат, его проверяем первым.
+        name = os.path.basename(rel_path)
+        group.sort(key=lambda orphan: os.path.basename(orphan) != name)
+        if comparison_mode == 'hybrid':
+            source_hash = calculate_file_hash_cached(Path(source_dir) / rel_path, hash_index, source_index_root, rel_path, hash_engine=hash_engine, metrics=metrics)
+            match = next((orphan for orphan in group if source_hash and orphan_hash(orphan) == source_hash), None)
+        else:
+            match = group[0]
+        if match: group.remove(match); moves.append((rel_path, match))
+    return moves
+
+def scan_both(source_dir, dest_dir, exclude_patterns=None, stop_event=None, comparison_mode='accurate', use_parallel=False, hash_index=None, progress_callback=None, subpaths=None, hash_engine=None, storages=(None, None), metrics=None, dest_skip_paths=None, dest_manifest=None):
+    """Сканирует источник и назначение одновременно, каждое со своим пулом потоков.
+    Ошибка одной стороны останавливает сканирование другой. Если обе стороны на одном HDD,
+    они сканируются по очереди, чтобы не гонять головки между двумя деревьями."""
+    scan_stop = LinkedStopEvent(stop_event)
+    scan_status = {'источник': "ожидание", 'назначение': "ожидание"}; status_lock = threading.Lock()
+    # Индикатор показывает сумму обеих сторон: байты хеширования складываются, а этап без объема дает 0 из 1.
+    scan_amounts = {'источник': (0, 1), 'назначение': (0, 1)}
+
+    def side_callback(side):
+        if not progress_callback: return None
+        def callback(p_type, current, total, message):
+            with status_lock:
+                scan_status[side] = message; scan_amounts[side] = (current, total)
+                progress_callback(p_type, sum(amount[0] for amount in scan_amounts.values()), sum(amount[1] for amount in scan_amounts.values()),
+                                  "Сканирование — " + "; ".join(f"{name}: {status}" for name, status in scan_status.items()))
+        return callback
+
+    def scan(side, directory, storage, skip_paths=None, manifest=None):
+        callback = side_callback(side)
+        if callback: callback('overall', 0, 1, "сканирование...")
+        try: result = get_files_map(directory, exclude_patterns, scan_stop, comparison_mode, use_parallel, hash_index, callback, subpaths, hash_engine, storage, metrics, skip_paths, manifest)
+        except BaseException: scan_stop.set(); raise
+        if callback: callback('overall', 1, 1, f"готово ({len(result)} файлов)")
+        return result
+
+    source_storage, dest_storage = storages
+    same_disk = bool(source_storage and dest_storage and source_storage.seek_order and dest_storage.seek_order and source_storage.device == dest_storage.device)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1 if same_disk else 2, thread_name_prefix='scan') as executor:
+        futures = [executor.submit(scan, 'источник', source_dir, source_storage), executor.submit(scan, 'назначение', dest_dir, dest_storage, dest_skip_paths, dest_manifest)]
+        concurrent.futures.wait(futures)
+    errors = [future.exception() for future in futures]
+    # Настоящая ошибка важнее отмены, вызванной ею на другой стороне.
+    error = next((e for e in errors if e and not isinstance(e, SyncCancelledError)), None) or next((e for e in errors if e), None)
+    if error: raise error
+    return futures[0].result(), futures[1].result()
+
+def sync_folders(source_dir, dest_dir, no_overwrite, delete_removed, sync_empty_dirs=False, exclude_patterns=None, stop_event=None, comparison_mode='accurate', use_parallel=False, use_staging=False, use_trash=False, progress_callback=None, hash_index=None, copy_workers=1, verify_copies='none', detect_moves_enabled=True, streaming=False, only_paths=None, hash_engine=None, source_storage=None, dest_storage=None, metrics=None, journal=None, delta_min_size=0, manifest=None, source_files=None, copy_sink=None, throttle=None):
+    """only_paths — относительные пути файлов и папок, которыми ограничивается синхронизация
+    (инкрементальный проход режима наблюдения); None — синхронизировать деревья целиком.
+    source_storage/dest_storage (StorageInfo) подстраивают параллельность, буферы и порядок чтения под тип хранилища.
+    metrics (SyncMetrics) собирает длительность этапов, объемы данных и самые медленные файлы.
+    journal (SyncJournal) записывает план и выполненные операции; по журналу прерванного сеанса
+    уже скопированные файлы пропускаются, а крупные промежуточные файлы докопируются.
+    delta_min_size — файлы от этого размера (в байтах), уже существующие в назначении, обновляются блочной дельтой; 0 — выключено.
+    manifest (DestManifest) дает хеши файлов назначения без чтения и пополняется каждой записанной копией.
+    source_files — готовая карта источника (FileTable), когда один источник синхронизируется в несколько назначений;
+    copy_sink(rel_path, reason, compare_content) может забрать копию себе, вернув True — тогда копирует он.
+    throttle (Throttle) ограничивает скорость чтения и записи копий и число файловых операций в секунду."""
     source_path = Path(source_dir); dest_path = Path(dest_dir)
     if not dest_path.exists(): dest_path.mkdir(parents=True, exist_ok=True)
+    if only_paths is not None: only_paths = collapse_paths(only_paths); streaming = False
+    if source_files is not None: streaming = False
+    hash_engine = hash_engine or DEFAULT_HASH_ENGINE
+    # Шаблоны компилируются один раз на проход и дальше передаются готовым ExcludeMatcher.
+    exclude_patterns = ExcludeMatcher.compile(exclude_patterns)
+
+    # Длительность этапов в секундах; в потоковом режиме сканирование входит в этап копирования.
+    metrics = metrics or SyncMetrics()
+    end_phase = metrics.end_phase
     
-    if progress_callback: progress_callback('overall', 0, 1, "Сканирование источника...")
-    source_files = get_files_map(source_dir, exclude_patterns, stop_event, comparison_mode, use_parallel)
-    if progress_callback: progress_callback('overall', 0, 1, "Сканирование назначения...")
-    dest_files = get_files_map(dest_dir, exclude_patterns, stop_event, comparison_mode, use_parallel)
+    # Брошенные промежуточные файлы прерванного сеанса удаляются, а пригодные для докопирования не сканируются.
+    resumable_staging = journal.cleanup_staging(dest_path, source_path) if journal and use_staging and journal.staged else None
+    if not streaming:
+        if source_files is None:
+            source_files, dest_files = scan_both(source_dir, dest_dir, exclude_patterns, stop_event, comparison_mode, use_parallel, hash_index, progress_callback, only_paths, hash_engine, (source_storage, dest_storage), metrics, resumable_staging, manifest)
+        else:
+            dest_files = get_files_map(dest_dir, exclude_patterns, stop_event, comparison_mode, use_parallel, hash_index, progress_callback, only_paths, hash_engine, dest_storage, metrics, resumable_staging, manifest)
+        end_phase('scan')
+        if use_staging:
+            # Промежуточные файлы, оставшиеся без журнала, не считаются лишними: их перезапишет копия исходного файла.
+            for rel_path in [p for p in dest_files if p.endswith(STAGING_SUFFIX) and p[:-len(STAGING_SUFFIX)] in source_files]: dest_files.discard(rel_path)
+    source_index_root = HashIndex.root_key(source_dir) if hash_index else None
+    dest_index_root = HashIndex.root_key(dest_dir) if hash_index else None
     
-    stats = {"copied": 0, "updated": 0, "skipped": 0, "deleted": 0, "trashed": 0, "errors": 0, "dirs_created": 0}
+    stats = {"copied": 0, "updated": 0, "skipped": 0, "deleted": 0, "trashed": 0, "errors": 0, "dirs_created": 0, "moved": 0, "resumed": 0, "copy_methods": {}, "timings": metrics.phases}
 
     trash_dir = None
     if use_trash and delete_removed:
@@ -116,93 +1872,411 @@ def sync_folders(source_dir, dest_dir, no_overwrite, delete_removed, sync_empty_
         trash_dir.mkdir(parents=True, exist_ok=True)
 
     if sync_empty_dirs:
-        for dirpath, _, _ in os.walk(source_dir):
+        source_roots = [source_path] if only_paths is None else [source_path / rel_path for rel_path in only_paths if not (exclude_patterns and exclude_patterns.excludes_path(rel_path, is_dir=True))]
+        for dirpath, dirnames, _ in (walk for root in source_roots for walk in os.walk(root)):
             if stop_event and stop_event.is_set(): raise SyncCancelledError("Прервано на этапе синхронизации папок.")
             relative_dir = Path(dirpath).relative_to(source_path); dest_dir_path = dest_path / relative_dir
-            if not dest_dir_path.exists(): logging.info(f"СОЗДАНИЕ ДИРЕКТОРИИ: {relative_dir}"); dest_dir_path.mkdir(); stats["dirs_created"] += 1
+            if exclude_patterns:
+                dirnames[:] = [d for d in dirnames if not exclude_patterns.match(str(relative_dir / d), is_dir=True)]
+            if not dest_dir_path.exists():
+                if throttle: throttle.op()
+                file_log.info(f"СОЗДАНИЕ ДИРЕКТОРИИ: {relative_dir}"); dest_dir_path.mkdir(); stats["dirs_created"] += 1
+        end_phase('dirs')
 
-    total_files = len(source_files)
-    for i, (rel_path, source_data) in enumerate(source_files.items()):
-        if stop_event and stop_event.is_set(): raise SyncCancelledError("Прервано на этапе копирования файлов.")
-        if progress_callback: progress_callback('overall', i + 1, total_files, f"Проверка: {rel_path}")
+    if not streaming and delete_removed and detect_moves_enabled:
+        for new_rel, old_rel in detect_moves(source_files, dest_files, source_dir, dest_dir, comparison_mode, hash_index, stop_event, hash_engine, metrics, manifest):
+            if stop_event and stop_event.is_set(): raise SyncCancelledError("Прервано на этапе перемещения файлов.")
+            new_file_path = dest_path / new_rel
+            if throttle: throttle.op()
+            try:
+                if new_file_path.exists(): continue
+                new_file_path.parent.mkdir(parents=True, exist_ok=True)
+                os.rename(dest_path / old_rel, new_file_path)
+                shutil.copystat(source_path / new_rel, new_file_path)
+                file_log.info(f"ПЕРЕМЕЩЕНИЕ: {old_rel} -> {new_rel}")
+                if journal: journal.done('move', new_rel)
+                if manifest:
+                    # Содержимое переехало без изменений; в точном режиме его хеш известен из сканирования.
+                    manifest.discard(old_rel); old_digest = dest_files.digest(dest_files.get(old_rel))
+                    if old_digest: stat = new_file_path.stat(); manifest.record(new_rel, stat.st_size, stat.st_mtime_ns, old_digest.hex())
+                dest_files.discard(old_rel); dest_files.add(new_rel, *source_files.record(source_files.get(new_rel))); stats["moved"] += 1
+            except Exception as e: logging.error(f"Ошибка перемещения файла {old_rel} -> {new_rel}: {e}"); stats["errors"] += 1
+        end_phase('moves')
 
-        dest_file_path = dest_path / rel_path; needs_update = False; reason = ""
-        if rel_path not in dest_files: needs_update = True; reason = "КОПИРОВАНИЕ (новый)"
-        else:
-            dest_data = dest_files[rel_path]
-            if comparison_mode == 'hybrid':
-                source_size, source_mtime, _ = source_data; dest_size, dest_mtime, _ = dest_data
-                if source_size != dest_size or int(source_mtime) != int(dest_mtime):
-                    source_hash = calculate_file_hash(source_path / rel_path)
-                    if stop_event and stop_event.is_set(): raise SyncCancelledError("Прервано на этапе хеширования.")
-                    dest_hash = calculate_file_hash(dest_path / rel_path)
-                    if source_hash != dest_hash: needs_update = True; reason = "ОБНОВЛЕНИЕ (изменен)"
-            elif source_data != dest_data: needs_update = True; reason = "ОБНОВЛЕНИЕ (изменен)"
-        
-        if needs_update:
-            if no_overwrite and rel_path in dest_files: logging.warning(f"ПРОПУСК (перезапись отключена): {rel_path}"); stats["skipped"] += 1
+    stats_lock = threading.Lock()
+    def count(key):
+        with stats_lock: stats[key] += 1
+
+    copy_methods = stats["copy_methods"]
+    copy_buffer_size = max(storage.buffer_size if storage else COPY_BUFFER_SIZE for storage in (source_storage, dest_storage))
+    # Место под крупные копии выделяется заранее только на ФС, где posix_fallocate не эмулируется записью в каждый блок.
+    preallocate = _find_mount(dest_path)[0] in PREALLOCATE_FS_TYPES
+    def scanned_source_hash(rel_path, source_stat):
+        """Хеш источника, вычисленный при сканировании, если файл с тех пор не менялся."""
+        if streaming or not source_files.digest_size: return None
+        file_id = source_files.get(rel_path)
+        if file_id is None or source_files.sizes[file_id] != source_stat.st_size or source_files.mtimes[file_id] != source_stat.st_mtime: return None
+        return source_files.digest(file_id).hex()
+
+    def copy_task(rel_path, reason, compare_content=False, source_hash=None, size=0):
+        dest_file_path = dest_path / rel_path; source_file_path = source_path / rel_path
+        target_path = dest_file_path.with_name(dest_file_path.name + STAGING_SUFFIX) if use_staging else dest_file_path
+        resumable = False; file_progress = copy_progress.file(size, rel_path)
+        on_data = throttle.data_hook(file_progress) if throttle else file_progress
+        try:
+            if throttle: throttle.op()
+            source_stat = os.stat(source_file_path); source_fingerprint = (source_stat.st_size, source_stat.st_mtime_ns)
+            # Крупный файл, уже существующий в назначении, обновляется блочной дельтой.
+            delta = bool(delta_min_size) and source_stat.st_size >= delta_min_size and dest_file_path.is_file()
+            # Совпадение содержимого при разной дате проверяется по хешу, вычисленному во время самого копирования
+            # (при дельте — по отсутствию измененных блоков).
+            dest_hash = calculate_file_hash_cached(dest_file_path, hash_index, dest_index_root, rel_path, hash_engine=hash_engine, metrics=metrics, manifest=manifest) if compare_content and not delta else None
+            # Манифесту нужен хеш каждой копии: если он не известен из сканирования, он считается во время копирования.
+            source_hash = source_hash or scanned_source_hash(rel_path, source_stat)
+            copy_verify = 'trust' if verify_copies == 'none' and (compare_content or (manifest and not source_hash)) else verify_copies
+            started = time.monotonic(); resumed_bytes = 0; read_bytes = written_bytes = None; unchanged = False
+            target_path.parent.mkdir(parents=True, exist_ok=True)
+            # Без промежуточного файла копия не прерывается на середине, чтобы не оставить обрезанный файл.
+            copy_stop = stop_event if use_staging else None
+            if journal:
+                if use_staging: journal.stage(rel_path)
+                resumable = use_staging and not delta and source_stat.st_size >= RESUME_MIN_SIZE
+            if delta:
+                dest_stat = dest_file_path.stat(); dest_size = dest_stat.st_size
+                signature = hash_index.get_blocks(dest_index_root, rel_path, (dest_size, dest_stat.st_mtime_ns, dest_stat.st_ino, dest_stat.st_dev), DELTA_BLOCK_SIZE) if hash_index else None
+                file_hash, read_bytes, written_bytes, changed_bytes, digests = copy_file_delta(source_file_path, dest_file_path, target_path, copy_stop, copy_verify, hash_engine, signature, on_progress=on_data)
+                method = 'delta'; unchanged = compare_content and not changed_bytes and dest_size == source_stat.st_size
+                file_log.info(f"ДЕЛЬТА: {rel_path} — изменено {format_size(changed_bytes)} из {format_size(source_stat.st_size)}"
+                             f"{', дайджесты блоков назначения из индекса' if signature is not None else ''}")
+            elif resumable:
+                # Крупный файл копируется блоками с контрольными точками; после сбоя промежуточный файл докопируется.
+                method, file_hash, resumed_bytes = copy_file_resumable(source_file_path, target_path, copy_stop, copy_verify, hash_engine, journal.resume_chunks(rel_path, source_fingerprint),
+                                                                       lambda index, digest: journal.chunk(rel_path, source_fingerprint, index, digest), on_data, preallocate)
+            elif copy_verify in ('trust', 'reread'):
+                method = 'verified' if verify_copies == 'reread' else 'hashed'
+                file_hash = copy_file_hashed(source_path / rel_path, target_path, copy_stop, verify_copies, hash_engine, copy_buffer_size, on_data, preallocate)
             else:
-                logging.info(f"{reason}: {rel_path}")
-                try:
-                    target_path = dest_file_path.with_suffix(dest_file_path.suffix + '.tmp') if use_staging else dest_file_path
-                    target_path.parent.mkdir(parents=True, exist_ok=True)
-                    shutil.copy2(source_path / rel_path, target_path)
-                    if use_staging: os.rename(target_path, dest_file_path)
-                    if "ОБНОВЛЕНИЕ" in reason: stats["updated"] += 1
-                    else: stats["copied"] += 1
-                except Exception as e: logging.error(f"Ошибка операции с файлом {rel_path}: {e}"); stats["errors"] += 1
+                method = copy_file(source_path / rel_path, target_path, copy_stop, copy_buffer_size, on_data, THROTTLE_CHUNK_SIZE if throttle else COPY_CHUNK_SIZE, preallocate); file_hash = None
+            size = target_path.stat().st_size
+            # При проверке перечитыванием копия читается и хешируется второй раз.
+            passes = 2 if file_hash and verify_copies == 'reread' else 1
+            metrics.add(bytes_read=(size if read_bytes is None else read_bytes) + size * (passes - 1), bytes_written=size - resumed_bytes if written_bytes is None else written_bytes,
+                        bytes_hashed=size * passes if file_hash else 0)
+            metrics.file_done('copy', rel_path, time.monotonic() - started, size)
+            if resumed_bytes: file_log.info(f"ПРОДОЛЖЕНИЕ: {rel_path} — {format_size(resumed_bytes)} взято из промежуточного файла прерванного сеанса")
+            if not file_hash and source_hash:
+                # Хеш из сканирования годится для копии, только если источник не менялся и во время копирования.
+                after_stat = os.stat(source_file_path)
+                if (after_stat.st_size, after_stat.st_mtime_ns) == source_fingerprint: file_hash = source_hash
+            if unchanged or (compare_content and not delta and file_hash == dest_hash):
+                # Содержимое не изменилось: копия не нужна, с назначения снимаются только атрибуты источника.
+                if use_staging: target_path.unlink(); shutil.copystat(source_path / rel_path, dest_file_path)
+                if journal: journal.done('copy', rel_path, source_fingerprint, file_hash)
+                if manifest and file_hash: stat = dest_file_path.stat(); manifest.record(rel_path, stat.st_size, stat.st_mtime_ns, file_hash)
+                file_log.info(f"БЕЗ ИЗМЕНЕНИЙ (совпадает хеш): {rel_path}"); return
+            if use_staging: os.replace(target_path, dest_file_path)
+            if journal: journal.done('copy', rel_path, source_fingerprint, file_hash)
+            if file_hash: file_log.info(f"{reason}: {rel_path} [{method}, {hash_engine.name}={file_hash}]")
+            else: file_log.info(f"{reason}: {rel_path} [{method}]")
+            if (hash_index or manifest) and (file_hash or delta):
+                stat = dest_file_path.stat(); fingerprint = (stat.st_size, stat.st_mtime_ns, stat.st_ino, stat.st_dev)
+                if file_hash and manifest: manifest.record(rel_path, stat.st_size, stat.st_mtime_ns, file_hash)
+                if file_hash and hash_index: hash_index.update(dest_index_root, [(rel_path, fingerprint, file_hash)])
+                # Дайджесты блоков новой копии избавляют следующую дельту от чтения назначения.
+                if delta and hash_index: hash_index.update_blocks(dest_index_root, rel_path, fingerprint, DELTA_BLOCK_SIZE, digests)
+            with stats_lock: copy_methods[method] = copy_methods.get(method, 0) + 1
+            count("updated" if "ОБНОВЛЕНИЕ" in reason else "copied")
+        except SyncCancelledError:
+            # Промежуточный файл с контрольными точками остается для продолжения в следующем сеансе.
+            if not resumable: target_path.unlink(missing_ok=True)
+        except Exception as e:
+            logging.error(f"Ошибка операции с файлом {rel_path}: {e}"); count("errors")
+            if use_staging and not resumable: target_path.unlink(missing_ok=True)
+        finally:
+            file_progress.close()
+
+    def already_done(rel_path):
+        """Файл скопирован прерванным сеансом, источник с тех пор не менялся, копия на месте."""
+        if not journal or rel_path not in journal.completed: return False
+        try: source_stat = os.stat(source_path / rel_path); dest_size = os.stat(dest_path / rel_path).st_size
+        except OSError: return False
+        if dest_size != source_stat.st_size or not journal.is_done(rel_path, (source_stat.st_size, source_stat.st_mtime_ns)): return False
+        file_log.info(f"ПРОПУСК (скопирован в прерванном сеансе): {rel_path}"); count("resumed"); return True
+
+    def compare_task(rel_path, size=0):
+        # Точный режим при потоковой обработке: хеши обеих сторон считаются в пуле копирования.
+        if already_done(rel_path): return
+        source_hash = calculate_file_hash_cached(source_path / rel_path, hash_index, source_index_root, rel_path, hash_engine=hash_engine, metrics=metrics)
+        if not source_hash or (stop_event and stop_event.is_set()): return
+        if source_hash == calculate_file_hash_cached(dest_path / rel_path, hash_index, dest_index_root, rel_path, hash_engine=hash_engine, metrics=metrics, manifest=manifest): return
+        if no_overwrite: file_log.warning(f"ПРОПУСК (перезапись отключена): {rel_path}"); count("skipped")
+        else: copy_progress.add_total(size, 1); copy_task(rel_path, "ОБНОВЛЕНИЕ (изменен)", source_hash=source_hash, size=size)
+
+    def plan_update(rel_path, source_data, dest_data):
+        """Принимает записи (размер, mtime, хеш) обеих сторон и возвращает (причина, сравнить_содержимое)
+        для файла, который нужно скопировать, или None."""
+        if dest_data is None: return "КОПИРОВАНИЕ (новый)", False
+        if comparison_mode == 'hybrid':
+            source_size, source_mtime, _ = source_data; dest_size, dest_mtime, _ = dest_data
+            if source_size != dest_size: return "ОБНОВЛЕНИЕ (изменен)", False
+            if int(source_mtime) != int(dest_mtime):
+                # Хеши из индекса сравниваются сразу; иначе при разрешенной перезаписи сравнение
+                # выполняется во время копирования, чтобы не читать источник дважды.
+                source_hash = calculate_file_hash_cached(source_path / rel_path, hash_index, source_index_root, rel_path, compute=no_overwrite, hash_engine=hash_engine, metrics=metrics)
+                if stop_event and stop_event.is_set(): raise SyncCancelledError("Прервано на этапе хеширования.")
+                dest_hash = calculate_file_hash_cached(dest_path / rel_path, hash_index, dest_index_root, rel_path, compute=no_overwrite, hash_engine=hash_engine, metrics=metrics, manifest=manifest)
+                if source_hash and dest_hash: return ("ОБНОВЛЕНИЕ (изменен)", False) if source_hash != dest_hash else None
+                return "ОБНОВЛЕНИЕ (изменен)", True
+            return None
+        return ("ОБНОВЛЕНИЕ (изменен)", False) if source_data[2] != dest_data[2] else None
+
+    def remove_file(rel_path):
+        if throttle: throttle.op()
+        if use_trash:
+            file_log.info(f"В КОРЗИНУ: {rel_path}")
+            try:
+                trash_file_path = trash_dir / rel_path
+                trash_file_path.parent.mkdir(parents=True, exist_ok=True)
+                shutil.move(str(dest_path / rel_path), str(trash_file_path)); count("trashed")
+                if journal: journal.done('trash', rel_path)
+                if manifest: manifest.discard(rel_path)
+            except Exception as e: logging.error(f"Ошибка перемещения в корзину файла {rel_path}: {e}"); count("errors")
+        else:
+            file_log.info(f"УДАЛЕНИЕ: {rel_path}")
+            try:
+                (dest_path / rel_path).unlink(); count("deleted")
+                if journal: journal.done('delete', rel_path)
+                if manifest: manifest.discard(rel_path)
+            except Exception as e: logging.error(f"Ошибка удаления файла {rel_path}: {e}"); count("errors")
+
+    dest_device = dest_path.stat().st_dev
+    device_limits = {}
+    if source_storage: device_limits[source_path.stat().st_dev] = source_storage.copy_limit(copy_workers)
+    if dest_storage: device_limits[dest_device] = min(device_limits.get(dest_device, copy_workers), dest_storage.copy_limit(copy_workers))
+    copy_engine = CopyEngine(copy_workers, stop_event, device_limits)
+    # Объем копирования известен заранее, кроме потокового режима: там он растет по мере обхода.
+    copy_progress = ProgressMeter(progress_callback, "Потоковая синхронизация" if streaming else "Копирование")
+    def submit_copy(rel_path, reason, compare_content=False, source_device=None, size=0):
+        if streaming: copy_progress.add_total(size, 1)
+        if no_overwrite and reason != "КОПИРОВАНИЕ (новый)": file_log.warning(f"ПРОПУСК (перезапись отключена): {rel_path}"); count("skipped"); copy_progress.advance(size, 1); return
+        if already_done(rel_path): copy_progress.advance(size, 1); return
+        if journal: journal.plan(rel_path, reason)
+        if copy_sink and copy_sink(rel_path, reason, compare_content): copy_progress.advance(size, 1); return
+        if source_device is None:
+            try: source_device = os.stat(source_path / rel_path).st_dev
+            except OSError: source_device = dest_device
+        copy_engine.submit(copy_task, (source_device, dest_device), rel_path, reason, compare_content, None, size)
+
+    try:
+        if streaming:
+            # Оба дерева обходятся в отсортированном порядке и сливаются на лету: действия уходят
+            # в ограниченную очередь пула копирования сразу, без построения полных списков файлов.
+            logging.info(f"Потоковая синхронизация: {source_dir} -> {dest_dir} (Режим: {comparison_mode})")
+            source_iter = scan_tree(source_dir, exclude_patterns, stop_event, sort=True)
+            dest_iter = scan_tree(dest_dir, exclude_patterns, stop_event, sort=True)
+            for i, (source_item, dest_item) in enumerate(merge_trees(source_iter, dest_iter)):
+                if stop_event and stop_event.is_set(): raise SyncCancelledError("Прервано на этапе копирования файлов.")
+                if source_item is None:
+                    # Промежуточный файл копии, которая может выполняться прямо сейчас, не удаляется.
+                    staging_of = dest_item[0][:-len(STAGING_SUFFIX)] if use_staging and dest_item[0].endswith(STAGING_SUFFIX) else None
+                    if delete_removed and not (staging_of and (source_path / staging_of).is_file()): remove_file(dest_item[0])
+                    continue
+                rel_path, _, source_stat = source_item
+                if dest_item is not None and comparison_mode != 'hybrid':
+                    copy_engine.submit(compare_task, (source_stat.st_dev, dest_device), rel_path, source_stat.st_size); continue
+                source_data = (source_stat.st_size, source_stat.st_mtime, None)
+                dest_data = (dest_item[2].st_size, dest_item[2].st_mtime, None) if dest_item else None
+                update = plan_update(rel_path, source_data, dest_data)
+                if update: submit_copy(rel_path, *update, source_device=source_stat.st_dev, size=source_stat.st_size)
+        else:
+            # Копии сначала собираются, чтобы прогресс копирования считался от известного объема;
+            # на HDD они отправляются в порядке физического размещения источника.
+            planned = []; plan_progress = ProgressMeter(progress_callback, "Проверка", len(source_files), sizes=False)
+            for rel_path, source_id in source_files.items():
+                if stop_event and stop_event.is_set(): raise SyncCancelledError("Прервано на этапе копирования файлов.")
+                plan_progress.advance(1, item=rel_path)
+                dest_id = dest_files.get(rel_path)
+                update = plan_update(rel_path, source_files.record(source_id), None if dest_id is None else dest_files.record(dest_id))
+                if update: planned.append((rel_path, update, source_files.sizes[source_id]))
+            if source_storage and source_storage.seek_order: planned.sort(key=lambda item: physical_offset(source_path / item[0]))
+            copy_progress.add_total(sum(size for _, _, size in planned), len(planned))
+            for rel_path, update, size in planned: submit_copy(rel_path, *update, size=size)
+        copy_engine.wait()
+    finally:
+        copy_engine.shutdown()
+    if copy_progress.total: copy_progress.finish()
+    end_phase('copy')
 
     if delete_removed:
-        files_to_delete = [p for p in dest_files if p not in source_files]
-        total_delete = len(files_to_delete)
-        for i, rel_path in enumerate(files_to_delete):
-            if stop_event and stop_event.is_set(): raise SyncCancelledError("Прервано на этапе удаления файлов.")
-            if progress_callback: progress_callback('overall', i + 1, total_delete, f"Удаление/Перемещение: {rel_path}")
-            if use_trash:
-                logging.info(f"В КОРЗИНУ: {rel_path}")
-                try:
-                    trash_file_path = trash_dir / rel_path
-                    trash_file_path.parent.mkdir(parents=True, exist_ok=True)
-                    shutil.move(str(dest_path / rel_path), str(trash_file_path)); stats["trashed"] += 1
-                except Exception as e: logging.error(f"Ошибка перемещения в корзину файла {rel_path}: {e}"); stats["errors"] += 1
-            else:
-                logging.info(f"УДАЛЕНИЕ: {rel_path}")
-                try: (dest_path / rel_path).unlink(); stats["deleted"] += 1
-                except Exception as e: logging.error(f"Ошибка удаления файла {rel_path}: {e}"); stats["errors"] += 1
-        for dirpath, _, _ in os.walk(dest_path, topdown=False):
+        if not streaming:
+            files_to_delete = [p for p in dest_files if p not in source_files]
+            delete_progress = ProgressMeter(progress_callback, "Удаление/Перемещение", len(files_to_delete), sizes=False)
+            for rel_path in files_to_delete:
+                if stop_event and stop_event.is_set(): raise SyncCancelledError("Прервано на этапе удаления файлов.")
+                delete_progress.advance(1, item=rel_path)
+                remove_file(rel_path)
+        def remove_empty_dir(dirpath):
             relative_dir = Path(dirpath).relative_to(dest_path)
             source_equivalent = source_path / relative_dir
-            if not source_equivalent.exists() and not os.listdir(dirpath):
+            if not source_equivalent.exists() and os.path.isdir(dirpath) and not os.listdir(dirpath):
                 if str(relative_dir) != '.':
-                    try: logging.info(f"Удаление пустой директории: {dirpath}"); os.rmdir(dirpath)
+                    try: file_log.info(f"Удаление пустой директории: {dirpath}"); os.rmdir(dirpath)
                     except OSError as e: logging.error(f"Ошибка удаления пустой директории {dirpath}: {e}")
+        cleanup_roots = [dest_path] if only_paths is None else [dest_path / rel_path for rel_path in only_paths]
+        for root in cleanup_roots:
+            for dirpath, _, _ in os.walk(root, topdown=False): remove_empty_dir(dirpath)
+            if only_paths is not None:
+                # При инкрементальном проходе опустеть могли и родительские папки измененного пути.
+                for parent in root.parents:
+                    if parent == dest_path or dest_path not in parent.parents: break
+                    remove_empty_dir(parent)
+    if trash_dir and only_paths is not None and not any(trash_dir.iterdir()):
+        # Инкрементальные проходы частые: пустые папки корзины за каждый проход не накапливаются.
+        trash_dir.rmdir()
+    if delete_removed: end_phase('delete')
     return stats
 
-def run_sync_session(source, destination, no_overwrite, delete_removed, sync_empty_dirs=False, exclude_patterns=None, source_creds=None, dest_creds=None, stop_event=None, comparison_mode='accurate', use_parallel=False, use_staging=False, use_trash=False, progress_callback=None):
-    start_time = datetime.now()
+def log_storage_tuning(source_storage, dest_storage, use_parallel, copy_workers):
+    if not source_storage and not dest_storage: logging.info("Автонастройка под тип хранилища: Нет"); return
+    for label, storage in (("источника", source_storage), ("назначения", dest_storage)):
+        hash_workers = storage.hash_workers(os.cpu_count() or 1) if use_parallel else 1
+        logging.info(f"Хранилище {label}: {storage.describe()} — потоков хеширования: {hash_workers}, буфер: {storage.buffer_size // (1024 * 1024)} МБ, "
+                     f"копий на устройство: {storage.copy_limit(copy_workers)}, порядок чтения: {'по физическому размещению' if storage.seek_order else 'обход дерева'}")
+
+def run_sync_session(source, destination, no_overwrite, delete_removed, sync_empty_dirs=False, exclude_patterns=None, source_creds=None, dest_creds=None, stop_event=None, comparison_mode='accurate', use_parallel=False, use_staging=False, use_trash=False, progress_callback=None, use_hash_index=True, copy_workers=1, verify_copies='none', detect_moves_enabled=True, streaming=False, hash_algorithm=DEFAULT_HASH_ALGORITHM, hash_backend='thread', tree_hash_chunk_mb=0, auto_tune=True, metrics_file=METRICS_FILE, delta_min_mb=0, use_manifest=True, notify=True, throttle=''):
+    """Полный сеанс синхронизации с уведомлениями. После сеанса (в том числе прерванного) пишется отчет
+    метрик в metrics_file и рядом в .prom; пустой metrics_file отключает запись. Возвращает отчет.
+    Ход сеанса пишется в журнал в корне назначения: если сеанс прервется, следующий продолжит с места остановки.
+    notify=False отключает уведомление в Telegram (пакетный запуск отправляет одно общее).
+    throttle — расписание ограничения скорости (см. parse_throttle); пустая строка — без ограничения."""
+    start_time = datetime.now(); metrics = SyncMetrics()
     logging.info("="*50); logging.info("Начало сеанса синхронизации"); logging.info(f"Источник: {source}"); logging.info(f"Назначение: {destination}")
     logging.info(f"Перезапись отключена: {'Да' if no_overwrite else 'Нет'}"); logging.info(f"Удаление лишних файлов: {'Да' if delete_removed else 'Нет'}")
     logging.info(f"Синхронизация пустых папок: {'Да' if sync_empty_dirs else 'Нет'}"); logging.info(f"Исключения: {exclude_patterns if exclude_patterns else 'Нет'}")
     logging.info(f"Режим сравнения: {comparison_mode}"); logging.info(f"Параллельное сканирование: {'Да' if use_parallel else 'Нет'}")
-    logging.info(f"Безопасное удаление: {'Да' if use_trash else 'Нет'}"); logging.info(f"Транзакционное копирование: {'Да' if use_staging else 'Нет'}"); logging.info("="*50)
+    logging.info(f"Безопасное удаление: {'Да' if use_trash else 'Нет'}"); logging.info(f"Транзакционное копирование: {'Да' if use_staging else 'Нет'}")
+    logging.info(f"Индекс хешей: {HASH_INDEX_FILE if use_hash_index else 'Нет'}"); logging.info(f"Манифест назначения: {MANIFEST_NAME if use_manifest else 'Нет'}")
+    logging.info(f"Потоков копирования на устройство: {copy_workers}")
+    logging.info(f"Проверка копий: {verify_copies}"); logging.info(f"Поиск перемещенных файлов: {'Да' if detect_moves_enabled and delete_removed and not streaming else 'Нет'}")
+    logging.info(f"Потоковая синхронизация: {'Да' if streaming else 'Нет'}"); logging.info(f"Блочная дельта: {f'файлы от {delta_min_mb} МБ' if delta_min_mb else 'Нет'}")
+    logging.info(f"Хеширование: {hash_algorithm}, пул: {hash_backend}, древовидный хеш: {f'блоки по {tree_hash_chunk_mb} МБ' if tree_hash_chunk_mb else 'Нет'}")
+    logging.info(f"Расписание ограничения скорости: {throttle or 'Нет'}")
+    source_storage, dest_storage = (detect_storage(source), detect_storage(destination)) if auto_tune else (None, None)
+    log_storage_tuning(source_storage, dest_storage, use_parallel, copy_workers); logging.info(f"Отчет метрик: {metrics_file or 'Нет'}"); logging.info("="*50)
+    hash_index = None; journal = None; manifest = None; stats = None; status = 'error'; error = None; limiter = None
     try:
+        hash_engine = HashEngine(hash_algorithm, hash_backend, int(tree_hash_chunk_mb or 0) * 1024 * 1024)
+        if throttle: limiter = hash_engine.throttle = Throttle(throttle, stop_event)
         if not ensure_path_is_ready(source, source_creds): raise ConnectionError(f"Исходный путь недоступен: {source}")
         if not ensure_path_is_ready(destination, dest_creds): raise ConnectionError(f"Целевой путь недоступен: {destination}")
-        stats = sync_folders(source, destination, no_overwrite, delete_removed, sync_empty_dirs, exclude_patterns, stop_event, comparison_mode, use_parallel, use_staging, use_trash, progress_callback)
+        if use_hash_index:
+            try: hash_index = HashIndex(HASH_INDEX_FILE, hash_engine.name)
+            except sqlite3.Error as e: logging.error(f"Не удалось открыть индекс хешей {HASH_INDEX_FILE}, работа без индекса: {e}")
+        try:
+            journal = SyncJournal(destination, source)
+            if journal.resumed_from:
+                logging.info(f"Продолжение прерванного сеанса от {journal.resumed_from}: выполнено копий {len(journal.completed)} из {len(journal.planned)} запланированных, "
+                             f"незавершенных промежуточных файлов: {len(journal.staged)}")
+        except OSError as e: logging.error(f"Не удалось открыть журнал сеанса в {destination}, продолжение после сбоя будет недоступно: {e}")
+        if use_manifest:
+            manifest = DestManifest(destination, hash_engine)
+            logging.info(f"Манифест назначения: записей {len(manifest.entries)}" + (f", обновлен {manifest.updated}" if manifest.updated else ""))
+        # Подключение путей и открытие индекса — отдельный этап: на сетевых ресурсах он бывает долгим.
+        metrics.end_phase('prepare')
+        stats = sync_folders(source, destination, no_overwrite, delete_removed, sync_empty_dirs, exclude_patterns, stop_event, comparison_mode, use_parallel, use_staging, use_trash, progress_callback, hash_index, copy_workers, verify_copies, detect_moves_enabled, streaming, hash_engine=hash_engine, source_storage=source_storage, dest_storage=dest_storage, metrics=metrics, journal=journal, delta_min_size=int(delta_min_mb or 0) * 1024 * 1024, manifest=manifest, throttle=limiter)
+        status = 'success'
         duration = datetime.now() - start_time
         summary = (f"✅ *Синхронизация успешно завершена!*\n\n*Источник:* `{source}`\n*Назначение:* `{destination}`\n"
                    f"Время выполнения: `{duration}`\n\n*Статистика:*\n- Скопировано новых: *{stats['copied']}*\n- Обновлено: *{stats['updated']}*\n"
+                   f"- Перемещено (без копирования): *{stats.get('moved', 0)}*\n"
                    f"- Пропущено: *{stats['skipped']}*\n- Удалено (навсегда): *{stats['deleted']}*\n- Удалено (в корзину): *{stats['trashed']}*\n"
                    f"- Создано директорий: *{stats.get('dirs_created', 0)}*\n- Ошибки: *{stats['errors']}*")
-        logging.info("\n" + summary.replace('*', '').replace('`', '')); send_telegram_notification(summary)
+        if stats.get('resumed'): summary += f"\n- Уже скопировано прерванным сеансом: *{stats['resumed']}*"
+        if stats.get('copy_methods'): summary += "\n- Способы копирования: " + ", ".join(f"`{method}` {n}" for method, n in sorted(stats['copy_methods'].items()))
+        if limiter: summary += f"\n- Ограничение скорости: {format_throttle_waits(limiter.report())}"
+        logging.info("\n" + summary.replace('*', '').replace('`', ''))
+        if notify: send_telegram_notification(summary)
     except SyncCancelledError as e:
+        status = 'cancelled'; error = str(e)
         duration = datetime.now() - start_time
         cancel_message = f"🟡 *Синхронизация прервана пользователем!*\n\nПроцесс был остановлен после `{duration}`.\nСообщение: `{e}`"
-        logging.warning(cancel_message.replace('*', '').replace('`', '')); send_telegram_notification(cancel_message)
+        logging.warning(cancel_message.replace('*', '').replace('`', ''))
+        if notify: send_telegram_notification(cancel_message)
         raise e
     except Exception as e:
+        error = str(e)
         duration = datetime.now() - start_time
         error_message = (f"❌ *ОШИБКА СИНХРОНИЗАЦИИ!*\n\nПроизошла критическая ошибка: `{e}`\n"
                          f"Время выполнения до сбоя: `{duration}`\n\nПодробности смотрите в лог-файле: `{LOG_FILE}`")
-        logging.critical(f"КРИТИЧЕСКАЯ ОШИБКА: {e}", exc_info=True); send_telegram_notification(error_message)
-        raise e
\ No newline at end of file
+        logging.critical(f"КРИТИЧЕСКАЯ ОШИБКА: {e}", exc_info=True)
+        if notify: send_telegram_notification(error_message)
+        raise e
+    finally:
+        if journal:
+            try: journal.close(finished=status == 'success')
+            except OSError as e: logging.error(f"Ошибка закрытия журнала сеанса: {e}")
+        if manifest:
+            # Записи манифеста привязаны к размеру и mtime, поэтому он сохраняется и после прерванного сеанса.
+            try: manifest.save()
+            except OSError as e: logging.error(f"Не удалось сохранить манифест назначения: {e}")
+        if hash_index:
+            try: hash_index.compact()
+            except sqlite3.Error as e: logging.error(f"Ошибка обслуживания индекса хешей: {e}")
+            hash_index.close()
+        report = metrics.report(source=str(source), destination=str(destination), status=status, error=error, mode='full',
+                                stats={key: value for key, value in (stats or {}).items() if key != 'timings'}, throttle=limiter.report() if limiter else None)
+        logging.info("Метрики сеанса:\n" + format_metrics_summary(report))
+        if metrics_file:
+            try: prom_file = write_metrics_report(report, metrics_file); logging.info(f"Отчет метрик сохранен: {metrics_file}, {prom_file}")
+            except OSError as e: logging.error(f"Не удалось сохранить отчет метрик {metrics_file}: {e}")
+    return report
+
+def verify_destination(destination, dest_creds=None, hash_backend='thread', auto_tune=True, progress_callback=None, stop_event=None, throttle=''):
+    """Проверка целостности назначения по манифесту: каждый файл из манифеста перечитывается (параллельно)
+    и сверяется с записанным хешем. Другой хеш при тех же размере и mtime — повреждение, при других —
+    изменение в обход синхронизации. Назначение и манифест не изменяются. throttle ограничивает скорость чтения,
+    как у run_sync_session. Возвращает число файлов по результатам."""
+    start_time = datetime.now()
+    logging.info("="*50); logging.info(f"Проверка назначения по манифесту: {destination}")
+    results = {'ok': 0, 'corrupted': 0, 'modified': 0, 'missing': 0, 'unreadable': 0, 'untracked': 0}
+    try:
+        if not ensure_path_is_ready(destination, dest_creds): raise ConnectionError(f"Целевой путь недоступен: {destination}")
+        manifest = DestManifest(destination)
+        hash_engine = HashEngine(manifest.hash_engine.algorithm, hash_backend, manifest.hash_engine.tree_chunk_size)
+        if throttle: hash_engine.throttle = Throttle(throttle, stop_event)
+        storage = detect_storage(destination) if auto_tune else None
+        workers = storage.hash_workers(hash_engine.workers) if storage else hash_engine.workers
+        logging.info(f"Записей в манифесте: {len(manifest.entries)}, обновлен: {manifest.updated}, хеширование: {hash_engine.name}, потоков: {workers}"); logging.info("="*50)
+        present = []
+        for rel_path, entry in sorted(manifest.entries.items()):
+            try: present.append((rel_path, entry, os.stat(os.path.join(destination, rel_path))))
+            except FileNotFoundError: logging.error(f"ОТСУТСТВУЕТ: {rel_path}"); results['missing'] += 1
+        if storage and storage.seek_order: present.sort(key=lambda item: physical_offset(os.path.join(destination, item[0]), item[2].st_ino))
+        paths = (os.path.join(destination, rel_path) for rel_path, _, _ in present)
+        executor = hash_engine.executor(workers) if workers > 1 and len(present) > 1 else None
+        progress = ProgressMeter(progress_callback, "Проверка", sum(stat.st_size for _, _, stat in present), len(present))
+        try:
+            for (rel_path, (size, mtime_ns, expected), stat), file_hash in zip(present, hash_engine.hash_many(paths, executor, storage.buffer_size if storage else READ_BUFFER_SIZE, None if executor else progress.advance)):
+                if stop_event and stop_event.is_set(): raise SyncCancelledError("Проверка назначения прервана.")
+                progress.advance(stat.st_size if executor else 0, 1, rel_path)
+                if file_hash is None: results['unreadable'] += 1  # ошибка чтения уже записана в лог
+                elif file_hash == expected: results['ok'] += 1
+                elif (stat.st_size, stat.st_mtime_ns) == (size, mtime_ns): logging.error(f"ПОВРЕЖДЕН (хеш не совпадает при тех же размере и дате): {rel_path}"); results['corrupted'] += 1
+                else: logging.warning(f"ИЗМЕНЕН В ОБХОД СИНХРОНИЗАЦИИ: {rel_path}"); results['modified'] += 1
+        finally:
+            if executor: executor.shutdown(cancel_futures=True)
+        progress.finish()
+        results['untracked'] = sum(1 for rel_path, _, _ in scan_tree(destination, stop_event=stop_event) if rel_path not in manifest.entries)
+    except SyncCancelledError:
+        logging.warning("Проверка назначения прервана."); raise
+    except Exception as e:
+        logging.critical(f"КРИТИЧЕСКАЯ ОШИБКА проверки назначения: {e}", exc_info=True)
+        send_telegram_notification(f"❌ *ОШИБКА ПРОВЕРКИ НАЗНАЧЕНИЯ!*\n\n*Назначение:* `{destination}`\nОшибка: `{e}`\n\nПодробности смотрите в лог-файле: `{LOG_FILE}`")
+        raise
+    problems = results['corrupted'] + results['modified'] + results['missing'] + results['unreadable']
+    summary = (f"{'❌' if problems else '✅'} *Проверка назначения по манифесту {'выявила расхождения' if problems else 'пройдена'}!*\n\n*Назначение:* `{destination}`\n"
+               f"Время выполнения: `{datetime.now() - start_time}`\n\n*Результаты:*\n- В порядке: *{results['ok']}*\n- Повреждено: *{results['corrupted']}*\n"
+               f"- Изменено в обход синхронизации: *{results['modified']}*\n- Отсутствует: *{results['missing']}*\n- Не удалось прочитать: *{results['unreadable']}*\n"
+               f"- Нет в манифесте: *{results['untracked']}*")
+    (logging.error if problems else logging.info)("\n" + summary.replace('*', '').replace('`', '')); send_telegram_notification(summary)
+    return results
@@ -0,0 +1,183 @@
+import os
+import sys
+import errno
+import ctypes
+import ctypes.util
+import logging
+import select
+import sqlite3
+import struct
+import time
+from datetime import datetime
+import sync_logic
+
+# --- Константы ---
+# Пауза без новых событий, после которой накопленные изменения синхронизируются.
+WATCH_DEBOUNCE_SECONDS = 2.0
+# Максимальная задержка пачки при непрерывном потоке событий (в долях от паузы).
+WATCH_MAX_DELAY_FACTOR = 10
+WATCH_POLL_SECONDS = 0.5
+WATCH_READ_SIZE = 64 * 1024
+
+IN_MODIFY = 0x00000002; IN_ATTRIB = 0x00000004; IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040; IN_MOVED_TO = 0x00000080; IN_CREATE = 0x00000100; IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400; IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000; IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000; IN_EXCL_UNLINK = 0x04000000; IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK; IN_CLOEXEC = getattr(os, 'O_CLOEXEC', 0)
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR | IN_EXCL_UNLINK)
+EVENT_HEADER = struct.Struct('iIII')
+
+# --- Наблюдение за деревом ---
+class InotifyWatcher:
+    """Рекурсивное наблюдение за деревом через inotify (Linux). Каждая папка получает свой watch;
+    новые папки подхватываются по событиям, исключенные и служебные не отслеживаются."""
+    def __init__(self, root, exclude_patterns=None):
+        libc_name = ctypes.util.find_library('c') if sys.platform.startswith('linux') else None
+        if not libc_name: raise OSError("Режим наблюдения поддерживается только в Linux (inotify).")
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.root = os.fspath(root); self.excludes = sync_logic.ExcludeMatcher.compile(exclude_patterns)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0: raise OSError(ctypes.get_errno(), "inotify_init1: " + os.strerror(ctypes.get_errno()))
+        self.dirs = {}  # wd -> относительный путь папки ('' — корень)
+        self.watch_tree('')
+
+    def add_watch(self, rel_dir):
+        path = os.path.join(self.root, rel_dir) if rel_dir else self.root
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err in (errno.ENOENT, errno.ENOTDIR): return
+            if err == errno.ENOSPC: raise OSError(err, "Исчерпан лимит inotify-наблюдений (fs.inotify.max_user_watches)")
+            raise OSError(err, f"inotify_add_watch {path}: {os.strerror(err)}")
+        self.dirs[wd] = rel_dir
+
+    def watch_tree(self, rel_dir):
+        """Ставит наблюдение на папку и все ее подпапки."""
+        self.add_watch(rel_dir)
+        stack = [rel_dir]
+        while stack:
+            current = stack.pop()
+            for entry in sync_logic._list_dir(os.path.join(self.root, current) if current else self.root):
+                if not current and entry.name in sync_logic.SERVICE_NAMES: continue
+                try:
+                    if not entry.is_dir(follow_symlinks=False): continue
+                except OSError: continue
+                rel_path = os.path.join(current, entry.name) if current else entry.name
+                if self.excludes and self.excludes.match(rel_path, is_dir=True): continue
+                self.add_watch(rel_path); stack.append(rel_path)
+
+    def unwatch_tree(self, rel_dir):
+        """Снимает наблюдение с папки, ушедшей из дерева (перемещение наружу или внутри дерева)."""
+        for wd, watched in list(self.dirs.items()):
+            if watched == rel_dir or watched.startswith(rel_dir + os.sep):
+                self.libc.inotify_rm_watch(self.fd, wd); del self.dirs[wd]
+
+    def rewatch(self):
+        """Заново обходит дерево после переполнения очереди: часть новых папок могла остаться без наблюдения."""
+        self.watch_tree('')
+
+    def read_events(self):
+        """Читает доступные события и возвращает (множество измененных путей, было ли переполнение)."""
+        changed = set(); overflow = False
+        while True:
+            try: data = os.read(self.fd, WATCH_READ_SIZE)
+            except BlockingIOError: break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b'\0')
+                offset += EVENT_HEADER.size + length
+                if mask & IN_Q_OVERFLOW: overflow = True; continue
+                rel_dir = self.dirs.get(wd)
+                if rel_dir is None: continue
+                if mask & IN_IGNORED: del self.dirs[wd]; continue
+                if not name:
+                    # Событие самой наблюдаемой папки: пропажа корня фатальна, остальное покрывается событием родителя.
+                    if not rel_dir and mask & (IN_DELETE_SELF | IN_MOVE_SELF): raise FileNotFoundError(f"Исходная папка удалена или перемещена: {self.root}")
+                    continue
+                name = os.fsdecode(name)
+                if not rel_dir and name in sync_logic.SERVICE_NAMES: continue
+                rel_path = os.path.join(rel_dir, name) if rel_dir else name
+                is_dir = bool(mask & IN_ISDIR)
+                if self.excludes and self.excludes.match(rel_path, is_dir): continue
+                if is_dir and mask & IN_MOVED_FROM: self.unwatch_tree(rel_path)
+                if is_dir and mask & (IN_CREATE | IN_MOVED_TO): self.watch_tree(rel_path)
+                changed.add(rel_path)
+        return changed, overflow
+
+    def wait_batch(self, debounce=WATCH_DEBOUNCE_SECONDS, stop_event=None):
+        """Ждет первое событие, затем копит события, пока не наступит пауза debounce секунд
+        (но не дольше WATCH_MAX_DELAY_FACTOR пауз). Возвращает (пути, переполнение)."""
+        changed = set(); overflow = False; first_event = last_event = None
+        poller = select.poll(); poller.register(self.fd, select.POLLIN)
+        while True:
+            if stop_event and stop_event.is_set(): raise sync_logic.SyncCancelledError("Наблюдение остановлено.")
+            now = time.monotonic()
+            if first_event is not None:
+                if now - last_event >= debounce or now - first_event >= debounce * WATCH_MAX_DELAY_FACTOR: return changed, overflow
+                timeout = min(WATCH_POLL_SECONDS, debounce - (now - last_event))
+            else: timeout = WATCH_POLL_SECONDS
+            if not poller.poll(max(timeout, 0) * 1000): continue
+            batch, batch_overflow = self.read_events()
+            if batch or batch_overflow:
+                changed |= batch; overflow = overflow or batch_overflow
+                last_event = time.monotonic()
+                if first_event is None: first_event = last_event
+
+    def close(self):
+        if self.fd >= 0: os.close(self.fd); self.fd = -1
+
+# --- Сеанс наблюдения ---
+def watch_sync_session(source, destination, no_overwrite, delete_removed, sync_empty_dirs=False, exclude_patterns=None, source_creds=None, dest_creds=None, stop_event=None, comparison_mode='accurate', use_parallel=False, use_staging=False, use_trash=False, progress_callback=None, use_hash_index=True, copy_workers=1, verify_copies='none', detect_moves_enabled=True, streaming=False, hash_algorithm=sync_logic.DEFAULT_HASH_ALGORITHM, hash_backend='thread', tree_hash_chunk_mb=0, auto_tune=True, debounce=WATCH_DEBOUNCE_SECONDS, metrics_file=sync_logic.METRICS_FILE, delta_min_mb=0, use_manifest=True, throttle=''):
+    """Полная синхронизация, после которой изменения источника синхронизируются по мере появления.
+    Наблюдение ставится до полного прохода, чтобы не потерять изменения, сделанные во время него.
+    Отчет метрик в metrics_file перезаписывается после каждого прохода. Ограничение скорости throttle
+    действует и на полный проход, и на инкрементальные; ожидание в отчете считается с начала наблюдения."""
+    watcher = InotifyWatcher(source, exclude_patterns)
+    hash_index = None; manifest = None
+    try:
+        # Ошибки полного прохода уже обработаны и отправлены в уведомлении самим run_sync_session.
+        sync_logic.run_sync_session(source, destination, no_overwrite, delete_removed, sync_empty_dirs, exclude_patterns, source_creds, dest_creds, stop_event, comparison_mode, use_parallel, use_staging, use_trash, progress_callback, use_hash_index, copy_workers, verify_copies, detect_moves_enabled, streaming, hash_algorithm, hash_backend, tree_hash_chunk_mb, auto_tune, metrics_file, delta_min_mb, use_manifest, throttle=throttle)
+    except BaseException:
+        watcher.close(); raise
+    try:
+        hash_engine = sync_logic.HashEngine(hash_algorithm, hash_backend, int(tree_hash_chunk_mb or 0) * 1024 * 1024)
+        limiter = hash_engine.throttle = sync_logic.Throttle(throttle, stop_event) if throttle else None
+        source_storage, dest_storage = (sync_logic.detect_storage(source), sync_logic.detect_storage(destination)) if auto_tune else (None, None)
+        if use_hash_index:
+            try: hash_index = sync_logic.HashIndex(sync_logic.HASH_INDEX_FILE, hash_engine.name)
+            except sqlite3.Error as e: logging.error(f"Не удалось открыть индекс хешей {sync_logic.HASH_INDEX_FILE}, работа без индекса: {e}")
+        if use_manifest: manifest = sync_logic.DestManifest(destination, hash_engine)
+        logging.info(f"Наблюдение за изменениями: {source} (папок: {len(watcher.dirs)}, пауза: {debounce} с)")
+        while True:
+            changed, overflow = watcher.wait_batch(debounce, stop_event)
+            start_time = datetime.now(); metrics = sync_logic.SyncMetrics()
+            if overflow:
+                # События потеряны: точный список изменений неизвестен, поэтому деревья сравниваются целиком.
+                logging.warning("Переполнение очереди inotify: выполняется полная пересинхронизация.")
+                watcher.rewatch(); only_paths = None
+            else:
+                only_paths = sorted(changed)
+                logging.info(f"Изменения в источнике: {len(only_paths)} путей" + (f" ({', '.join(only_paths[:5])}{', ...' if len(only_paths) > 5 else ''})" if only_paths else ""))
+            stats = sync_logic.sync_folders(source, destination, no_overwrite, delete_removed, sync_empty_dirs, watcher.excludes, stop_event, comparison_mode, use_parallel, use_staging, use_trash, progress_callback, hash_index, copy_workers, verify_copies, detect_moves_enabled, only_paths=only_paths, hash_engine=hash_engine, source_storage=source_storage, dest_storage=dest_storage, metrics=metrics, delta_min_size=int(delta_min_mb or 0) * 1024 * 1024, manifest=manifest, throttle=limiter)
+            logging.info(f"Проход завершен за {datetime.now() - start_time}: скопировано {stats['copied']}, обновлено {stats['updated']}, "
+                         f"перемещено {stats['moved']}, пропущено {stats['skipped']}, удалено {stats['deleted'] + stats['trashed']}, ошибок {stats['errors']}")
+            if manifest:
+                try: manifest.save()
+                except OSError as e: logging.error(f"Не удалось сохранить манифест назначения: {e}")
+            if metrics_file:
+                report = metrics.report(source=str(source), destination=str(destination), status='success', error=None, mode='watch',
+                                        stats={key: value for key, value in stats.items() if key != 'timings'}, throttle=limiter.report() if limiter else None)
+                try: sync_logic.write_metrics_report(report, metrics_file)
+                except OSError as e: logging.error(f"Не удалось сохранить отчет метрик {metrics_file}: {e}")
+    except sync_logic.SyncCancelledError:
+        logging.warning("Наблюдение за изменениями остановлено."); raise
+    except Exception as e:
+        logging.critical(f"КРИТИЧЕСКАЯ ОШИБКА в режиме наблюдения: {e}", exc_info=True)
+        sync_logic.send_telegram_notification(f"❌ *ОШИБКА РЕЖИМА НАБЛЮДЕНИЯ!*\n\n*Источник:* `{source}`\nОшибка: `{e}`\n\nПодробности смотрите в лог-файле: `{sync_logic.LOG_FILE}`")
+        raise
+    finally:
+        watcher.close()
+        if hash_index: hash_index.close()